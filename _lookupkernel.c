@@ -0,0 +1,54 @@
+/*
+ * Refer to LICENSE file and README file for licensing information.
+ *
+ * Longest prefix match walk over the flattened RouteTable (see
+ * RouteTable.flatten) - one C loop per address instead of one NumPy pass per
+ * level. Called through ctypes, which releases the GIL for the call.
+ *
+ * Build (lookupkernel.py does this) -
+ *     cc -O3 -shared -fPIC -o _lookupkernel.so _lookupkernel.c
+ */
+
+#include <stdint.h>
+
+/*
+ * nlevels : Number of levels of the table
+ * levels : Cumulative number of bits looked up after every level
+ * strides : Bits looked up at every level
+ * final, output_idx, children : Per level flat arrays, children is the
+ *     number of the child table in the next level, -1 for none
+ * ips, n : Addresses (host byte order)
+ * result : Output Index of every address, -1 if there's no match
+ * depth : Level at which the lookup stopped (may be NULL)
+ */
+void lookup_flat(int nlevels, const int32_t *levels, const int32_t *strides,
+                 const uint8_t **final, const uint32_t **output_idx,
+                 const int64_t **children, const uint32_t *ips, int64_t n,
+                 int64_t *result, int64_t *depth)
+{
+    int64_t i;
+
+    for (i = 0; i < n; i++) {
+        uint32_t ip = ips[i];
+        int64_t match = -1;
+        int64_t idx = ip >> (32 - levels[0]);
+        int level = 0;
+
+        for (;;) {
+            if (final[level][idx] == 1)
+                match = output_idx[level][idx];
+            if (level + 1 == nlevels)
+                break;
+            int64_t child = children[level][idx];
+            if (child < 0)
+                break;
+            level++;
+            idx = (child << strides[level]) +
+                  ((ip >> (32 - levels[level])) &
+                   ((UINT32_C(1) << strides[level]) - 1));
+        }
+        result[i] = match;
+        if (depth)
+            depth[i] = level;
+    }
+}
@@ -10,109 +10,312 @@ A utility that parses AS information file and populates following information
 Also keeps other data handy
   - A country wide list of All ASes registered in the country
   So one can ask questions like 'which country has maximum ASes etc
+
+The file (CAIDA as-org2info, plain or compressed) is read as a stream in
+chunks of lines. Lines of a section are tokenized a chunk at a time (a single
+split for all the lines) and Org and AS lines are only collected while
+reading, the AS -> Org -> Country resolution is done at the end, so the
+sections may appear in any order.
+
+Parsed data is kept in NumPy arrays (sorted AS numbers, Org ids, country
+codes and names packed in byte buffers), which can be saved to and loaded
+from an .npz cache file (see parse(cache=...)) instead of parsing the file
+again.
 """
 
 import os
-from collections import namedtuple
-from gzip import GzipFile
+from collections import namedtuple, Counter
+from itertools import compress
+
+import numpy as np
+
+from decompress import open_stream
+from ipv4_routing_table import find_keys
+from prefixset import last_unique
 
 asinfo = namedtuple('asinfo', ['id', 'name', 'org', 'country'])
 
+_ORG_FIELDS = 5 # org_id|changed|org_name|country|source
+_AS_FIELDS = 6 # aut|changed|aut_name|org_id|opaque_id|source
+_CHUNK_SIZE = 1 << 20
+_NL = ord('\n')
+_SEP = ord('|')
+
+
+def _pack_strings(strings):
+    """Returns (buffer, offsets) for a list of bytes"""
+    lengths = np.fromiter((len(s) for s in strings), dtype=np.int64,
+                            count=len(strings))
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.frombuffer(b''.join(strings), dtype=np.uint8), offsets
+
+
+def _unpack_string(buf, offsets, i):
+    return buf[offsets[i]:offsets[i+1]].tobytes()
+
+
 class ASInformation:
-    def __init__(self, filename):
-        self._ases = {} # dictionary of AS informations key:asid, val:info
-        self._countries = {} #dictionary of Countries: key:Countrycode val:asid
-        self._file_handler = self._get_file_handler(filename)
-        self._orgs = {} # Org to country mapping
-
-    def _do_get_file_handle(self, cls, filename):
-        return cls(filename, 'rb')
-
-    def _get_file_handler(self, filename):
-        if not os.path.exists(filename):
-            raise IOError
-
-        if os.path.splitext(filename)[1].lower() == '.gz':
-            return self._do_get_file_handle(GzipFile, filename)
-        elif os.path.splitext(filename)[1].lower() == '.bz2':
-            return self._do_get_file_handle(BZ2File, filename)
-        else:
-            return self._do_get_file_handle(open, filename)
-
-    def parse(self):
-        f = self._file_handler
-        if not f or f.closed:
-            raise IOError
-
-        _format1_found = False
-        _format2_found = False
-        for line in f:
-            if line.startswith(b"# format:org_id"):
-                _format1_found = True
-                _format2_found = False
-                continue
-            if line.startswith(b"# format:aut"):
-                _format2_found = True
-                _format1_found = False
-                continue
-            if _format1_found:
-                self._do_parse_format1(line)
-            elif _format2_found:
-                self._do_parse_format2(line)
-
-    def _do_parse_format1(self, line):
-        """parse format 1 lines and update orgs dict"""
-        toks = line.strip().split(b'|')
-        if len(toks) != 5:
-            print (f"invalid line: {line}")
-            return
+    def __init__(self, filename=None):
+        self._filename = filename
+        self.errors = Counter() # Error counts: invalid_line, bad_asid etc.
+        self._as_ids = np.zeros(0, dtype=np.uint32) # Sorted
+        self._as_orgs = np.zeros(0, dtype=np.int64) # Index in _org_ids
+        self._as_names = _pack_strings([])
+        self._org_ids = np.zeros(0, dtype='S1') # Sorted
+        # Index in _country_codes, -1 if unknown
+        self._org_countries = np.zeros(0, dtype=np.int64)
+        self._org_names = _pack_strings([])
+        self._country_codes = np.zeros(0, dtype='S1') # Sorted
+        self._countries = None # Country : list of ASes, built when needed
 
-        org, _, _, country, _ = toks
+    def _iter_lines(self, f):
+        """ Yields lists of lines, a chunk at a time"""
+        rest = b''
+        while True:
+            data = f.read(_CHUNK_SIZE)
+            if not data:
+                if rest:
+                    yield [rest]
+                return
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            yield lines
 
-        self._orgs[org] = country
-        return
+    def _tokenize(self, lines, nfields, columns):
+        """ Appends the fields of all the lines (of one section) to columns
+        (one list per field). Lines with a wrong number of fields are
+        counted and dropped."""
+        lines = [l.rstrip(b'\r') for l in lines if l.strip()]
+        if not lines:
+            return
+        # Separators of every line (not the total, a short and a long line
+        # would cancel out and shift all the fields after them)
+        buf = np.frombuffer(b'\n'.join(lines), dtype=np.uint8)
+        starts = np.concatenate(([0], np.flatnonzero(buf == _NL) + 1))
+        seps = np.add.reduceat((buf == _SEP).view(np.uint8), starts,
+                                dtype=np.int64)
+        good = seps == nfields - 1
+        if not good.all():
+            self.errors['invalid_line'] += int(np.count_nonzero(~good))
+            lines = list(compress(lines, good.tolist()))
+            if not lines:
+                return
+        toks = b'|'.join(lines).split(b'|')
+        for i, column in enumerate(columns):
+            column.extend(toks[i::nfields])
 
-    def _do_parse_format2(self, line):
-        """parse format 2 lines and update ases and countries dicts"""
-        toks = line.strip().split(b'|')
-        if len(toks) != 6:
-            print (f"invalid line: {line}")
+    def parse(self, cache=None):
+        """ Parses the file. If cache (an .npz file name) is given, it's
+        loaded instead when it's newer than the file and is (re)written after
+        parsing otherwise."""
+        if cache is not None and os.path.exists(cache) and (
+                self._filename is None or os.path.getmtime(cache) >=
+                os.path.getmtime(self._filename)):
+            self._load(cache)
             return
+        if self._filename is None or not os.path.exists(self._filename):
+            raise IOError(f'No such file: {self._filename}')
 
-        asid, _,asname, org, _, _ = toks
-        country = self._orgs[org]
-        info = asinfo(*[int(asid), asname, org, country])
-        self._ases[int(asid)] = info
-        if country not in self._countries.keys():
-            self._countries[country] = [int(asid)]
-        else:
-            self._countries[country].append(int(asid))
+        orgs = [[] for _ in range(_ORG_FIELDS)]
+        ases = [[] for _ in range(_AS_FIELDS)]
+        section = None
+        with open_stream(self._filename) as f:
+            for lines in self._iter_lines(f):
+                begin = 0
+                for i, line in enumerate(lines):
+                    if not line.startswith(b'#'):
+                        continue
+                    self._tokenize_section(section, lines[begin:i], orgs,
+                                            ases)
+                    begin = i + 1
+                    if line.startswith(b"# format:org_id"):
+                        section = 'org'
+                    elif line.startswith(b"# format:aut"):
+                        section = 'as'
+                self._tokenize_section(section, lines[begin:], orgs, ases)
 
-    def close(self):
+        self._resolve(orgs, ases)
+        if cache is not None:
+            self.save(cache)
+
+    def _tokenize_section(self, section, lines, orgs, ases):
+        if section == 'org':
+            self._tokenize(lines, _ORG_FIELDS, orgs)
+        elif section == 'as':
+            self._tokenize(lines, _AS_FIELDS, ases)
+        elif any(l.strip() for l in lines):
+            self.errors['no_section'] += 1
+
+    def _resolve(self, orgs, ases):
+        """ Builds the arrays from the columns of Org and AS lines. Orgs that
+        are only referred to by AS lines are added with unknown country."""
+        asids, _, as_names, as_orgs, _, _ = ases
         try:
-            if self._file_handler:
-                self._file_handler.close()
-        except:
-            pass
+            ids = np.array(asids, dtype='S').astype(np.uint32) if asids else \
+                    np.zeros(0, dtype=np.uint32)
+            good = np.arange(len(asids))
+        except ValueError:
+            good = [i for i, a in enumerate(asids) if a.strip().isdigit()]
+            self.errors['bad_asid'] += len(asids) - len(good)
+            ids = np.array([int(asids[i]) for i in good], dtype=np.uint32)
+            good = np.array(good, dtype=np.int64)
+        self._as_ids, as_last = last_unique(ids)
+        as_last = good[as_last].tolist()
+        as_org_keys = np.array([as_orgs[i] for i in as_last] or [b''],
+                                dtype='S')[:len(as_last)]
+
+        org_ids, _, org_names, org_countries, _ = orgs
+        org_keys = np.array(org_ids or [b''], dtype='S')[:len(org_ids)]
+        org_keys, last = last_unique(org_keys)
+        countries = np.array(org_countries or [b''], dtype='S')[last]
+        names = [org_names[i] for i in last.tolist()]
+        unknown = np.setdiff1d(as_org_keys, org_keys)
+        self.errors['unknown_org'] += int(np.count_nonzero(
+                                            np.isin(as_org_keys, unknown)))
+
+        self._org_ids = np.concatenate((org_keys, unknown))
+        order = np.argsort(self._org_ids, kind='stable')
+        self._org_ids = self._org_ids[order]
+        self._country_codes, country_idx = np.unique(countries,
+                                                    return_inverse=True)
+        self._org_countries = np.concatenate((country_idx.ravel(),
+                        np.full(len(unknown), -1, dtype=np.int64)))[order]
+        names += [b''] * len(unknown)
+        self._org_names = _pack_strings([names[i] for i in order.tolist()])
+
+        # AS -> Org, deferred till all the Orgs are known
+        self._as_orgs = np.searchsorted(self._org_ids, as_org_keys)
+        self._as_names = _pack_strings([as_names[i] for i in as_last])
+        self._countries = None
+
+    def save(self, filename):
+        """ Saves the parsed data to an .npz file"""
+        with open(filename, 'wb+') as f:
+            np.savez(f, as_ids=self._as_ids, as_orgs=self._as_orgs,
+                    as_names=self._as_names[0],
+                    as_name_offsets=self._as_names[1], org_ids=self._org_ids,
+                    org_countries=self._org_countries,
+                    org_names=self._org_names[0],
+                    org_name_offsets=self._org_names[1],
+                    country_codes=self._country_codes)
+
+    def _load(self, filename):
+        x = np.load(filename)
+        self._as_ids = x['as_ids']
+        self._as_orgs = x['as_orgs']
+        self._as_names = (x['as_names'], x['as_name_offsets'])
+        self._org_ids = x['org_ids']
+        self._org_countries = x['org_countries']
+        self._org_names = (x['org_names'], x['org_name_offsets'])
+        self._country_codes = x['country_codes']
+        self._countries = None
+
+    @classmethod
+    def load(cls, filename):
+        """ Returns ASInformation loaded from an .npz file (see save)"""
+        self = cls()
+        self._load(filename)
+        return self
+
+    def close(self):
+        """ Nothing to do, the file is only open while parsing (kept for
+        compatibility)"""
+        pass
+
+    def _as_index(self, asid):
+        i = int(np.searchsorted(self._as_ids, asid))
+        if i < len(self._as_ids) and self._as_ids[i] == asid:
+            return i
+        return None
+
+    def _org_index(self, org):
+        i = int(np.searchsorted(self._org_ids, org))
+        if i < len(self._org_ids) and self._org_ids[i] == org:
+            return i
+        return None
+
+    def _as_countries(self):
+        """ Index in _country_codes of the country of every AS (-1 if
+        unknown)"""
+        return self._org_countries[self._as_orgs]
 
     def get_countries(self):
+        """ Returns dictionary of country : list of ASes"""
+        if self._countries is None:
+            countries = self._as_countries()
+            order = np.argsort(countries, kind='stable')
+            order = order[countries[order] >= 0]
+            codes, first = np.unique(countries[order], return_index=True)
+            groups = np.split(self._as_ids[order], first[1:])
+            self._countries = {bytes(self._country_codes[c]): g.tolist()
+                                for c, g in zip(codes.tolist(), groups)}
         return self._countries
 
     def get_ases_for_country(self, country):
-        return self._countries.get(country)
+        return self.get_countries().get(country)
+
+    def countries_for_ases(self, asids):
+        """ Returns country codes (a bytes array, b'' if unknown) of an
+        array of AS numbers"""
+        asids = np.asarray(asids, dtype=np.uint32)
+        result = np.zeros(len(asids), dtype=self._country_codes.dtype
+                            if len(self._country_codes) else 'S1')
+        if not len(self._as_ids):
+            return result
+        pos, found = find_keys(self._as_ids, asids)
+        countries = self._as_countries()[pos]
+        ok = found & (countries >= 0)
+        result[ok] = self._country_codes[countries[ok]]
+        return result
+
+    def orgs_for_ases(self, asids):
+        """ Returns Org ids (a bytes array, b'' if unknown) of an array of AS
+        numbers"""
+        asids = np.asarray(asids, dtype=np.uint32)
+        result = np.zeros(len(asids), dtype=self._org_ids.dtype)
+        if not len(self._as_ids):
+            return result
+        pos, ok = find_keys(self._as_ids, asids)
+        result[ok] = self._org_ids[self._as_orgs[pos[ok]]]
+        return result
 
     def country_from_asid(self, asid):
-        return self._ases.get(asid).country if asid in self._ases \
-                else None
+        i = self._as_index(asid)
+        if i is None:
+            return None
+        country = self._org_countries[self._as_orgs[i]]
+        return bytes(self._country_codes[country]) if country >= 0 else None
+
+    def get_org_name(self, org):
+        i = self._org_index(org)
+        if i is None:
+            return None
+        return _unpack_string(*self._org_names, i)
 
     def get_as_info(self, asid):
-        return self._ases.get(asid) if asid in self._ases else None
+        i = self._as_index(asid)
+        if i is None:
+            return None
+        org = int(self._as_orgs[i])
+        country = int(self._org_countries[org])
+        return asinfo(int(asid), _unpack_string(*self._as_names, i),
+                        bytes(self._org_ids[org]),
+                        bytes(self._country_codes[country]) if country >= 0
+                        else None)
+
+    def __len__(self):
+        return len(self._as_ids)
 
 if __name__ == '__main__':
 
     from collections import OrderedDict
+    from datetime import datetime as dt
+
+    then = dt.now()
     a = ASInformation("20230701.as-org2info.txt.gz")
-    a.parse()
+    a.parse(cache="20230701.as-org2info.npz")
+    print(f"{len(a)} ASes in {dt.now() - then}, errors: {dict(a.errors)}")
 
     cdict = a.get_countries()
     countries_by_num_ases = OrderedDict(sorted(cdict.items(),
@@ -0,0 +1,250 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+AS relationships and customer cones (CAIDA as-rel and ppdc-ases datasets).
+
+as-rel (and as-rel2) lines are <provider>|<customer>|-1 or <peer>|<peer>|0
+(as-rel2 has one more field with the source). They are loaded into adjacency
+lists in CSR form (for every AS, its neighbours are
+neighbours[offsets[i]:offsets[i+1]]) over dense AS indices (index in the
+sorted array of all AS numbers seen).
+
+ppdc-ases lines are '<AS> <AS> <AS> ...' - an AS followed by all the ASes of
+its customer cone.
+
+For the ASes of interest (eg. our transit providers) the cone is kept as a
+bitmap with one bit per dense AS index, so checking whether the origin AS of
+an address (found with RouteTable.lookup) is in a cone is a bit test.
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from decompress import open_stream
+from ipv4_addresses import text_to_ints
+from ipv4_routing_table import find_keys
+
+REL_P2C = -1
+REL_P2P = 0
+
+
+def _read_lines(filename):
+    """ Returns all non comment lines of a (possibly compressed) file"""
+    with open_stream(filename) as f:
+        data = f.read()
+    return [l for l in data.split(b'\n') if l.strip() and
+            not l.startswith(b'#')]
+
+
+def _index_in(ids, values):
+    """ Index of every value in the sorted array ids, -1 where not found"""
+    pos, found = find_keys(ids, values)
+    return np.where(found, pos, -1)
+
+
+def _csr(src, dst, n):
+    """ Adjacency lists (offsets, neighbours) of n nodes from edges"""
+    order = np.lexsort((dst, src))
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    return offsets, dst[order].astype(np.int32)
+
+
+def _neighbours(offsets, neighbours, nodes):
+    """ All neighbours of an array of nodes (with repetitions)"""
+    begin = offsets[nodes]
+    counts = offsets[nodes + 1] - begin
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=neighbours.dtype)
+    idx = np.arange(total) - np.repeat(np.cumsum(counts) - counts - begin,
+                                        counts)
+    return neighbours[idx]
+
+
+class InvalidRelationsFileErr(Exception):
+    pass
+
+
+class ASRelations:
+    def __init__(self, filename=None):
+        self.as_ids = np.zeros(0, dtype=np.uint32) # Sorted, dense index
+        self._customers = (np.zeros(1, dtype=np.int64),
+                            np.zeros(0, dtype=np.int32))
+        self._providers = self._customers
+        self._peers = self._customers
+        self.errors = Counter() # invalid_line, bad_asid, bad_relationship
+        if filename is not None:
+            self.load(filename)
+
+    def __len__(self):
+        return len(self.as_ids)
+
+    def load(self, filename):
+        """ Loads an as-rel or as-rel2 file. Lines with the wrong number of
+        fields, AS numbers that aren't 32 bit numbers or relationships other
+        than -1 and 0 are counted in errors and dropped."""
+        lines = _read_lines(filename)
+        if not lines:
+            return
+        nfields = lines[0].count(b'|') + 1
+        if nfields < 3:
+            raise InvalidRelationsFileErr(f'Not an as-rel file: {filename}')
+        good = [l for l in lines if l.count(b'|') + 1 == nfields]
+        self.errors['invalid_line'] += len(lines) - len(good)
+        toks = b'|'.join(good).split(b'|')
+        a, a_ok = text_to_ints(toks[0::nfields])
+        b, b_ok = text_to_ints(toks[1::nfields])
+        rel, rel_ok = text_to_ints(toks[2::nfields])
+        ok = a_ok & b_ok & (a >= 0) & (a <= 0xFFFFFFFF) & (b >= 0) & \
+                (b <= 0xFFFFFFFF)
+        self.errors['bad_asid'] += int(np.count_nonzero(~ok))
+        rel_ok &= (rel == REL_P2C) | (rel == REL_P2P)
+        self.errors['bad_relationship'] += int(np.count_nonzero(ok & ~rel_ok))
+        ok &= rel_ok
+        a, b, rel = a[ok], b[ok], rel[ok]
+
+        self.as_ids = np.unique(np.concatenate((a, b))).astype(np.uint32)
+        n = len(self.as_ids)
+        a = np.searchsorted(self.as_ids, a)
+        b = np.searchsorted(self.as_ids, b)
+        p2c = rel == REL_P2C
+        p2p = rel == REL_P2P
+        self._customers = _csr(a[p2c], b[p2c], n)
+        self._providers = _csr(b[p2c], a[p2c], n)
+        self._peers = _csr(np.concatenate((a[p2p], b[p2p])),
+                            np.concatenate((b[p2p], a[p2p])), n)
+
+    def index_of(self, asids):
+        """ Dense indices of an array of AS numbers, -1 for unknown ASes"""
+        return _index_in(self.as_ids, np.asarray(asids, dtype=np.uint32))
+
+    def _related(self, csr, asid):
+        i = self.index_of([asid])[0]
+        if i < 0:
+            return np.zeros(0, dtype=np.uint32)
+        return self.as_ids[_neighbours(*csr, np.array([i]))]
+
+    def get_customers(self, asid):
+        return self._related(self._customers, asid)
+
+    def get_providers(self, asid):
+        return self._related(self._providers, asid)
+
+    def get_peers(self, asid):
+        return self._related(self._peers, asid)
+
+    def customer_cone(self, asid):
+        """ Returns (sorted) AS numbers of the customer cone of asid (the AS
+        itself and all ASes reachable over provider to customer links).
+        Walked breadth first, a whole level of the graph at a time."""
+        i = self.index_of([asid])[0]
+        if i < 0:
+            return np.array([asid], dtype=np.uint32)
+        seen = np.zeros(len(self.as_ids), dtype=bool)
+        seen[i] = True
+        frontier = np.array([i])
+        while len(frontier):
+            nxt = np.unique(_neighbours(*self._customers, frontier))
+            frontier = nxt[~seen[nxt]]
+            seen[frontier] = True
+        return self.as_ids[seen]
+
+
+class ConeBitmaps:
+    """ Customer cones of a few ASes as bitmaps over the AS numbers of a
+    dataset."""
+    def __init__(self, as_ids):
+        self.as_ids = np.unique(np.asarray(as_ids, dtype=np.uint32))
+        self._cones = {} # AS : packed bitmap
+
+    @classmethod
+    def from_relations(cls, relations, ases):
+        """ Cones of ases computed from ASRelations"""
+        self = cls(relations.as_ids)
+        for asid in ases:
+            self.add_cone(asid, relations.customer_cone(asid))
+        return self
+
+    @classmethod
+    def from_ppdc(cls, filename, ases=None):
+        """ Cones from a ppdc-ases file, of ases only (all if None)"""
+        wanted = None if ases is None else {str(a).encode() for a in ases}
+        cones = {}
+        members = []
+        for line in _read_lines(filename):
+            toks = line.split()
+            if wanted is None or toks[0] in wanted:
+                cone = np.array(toks, dtype='S').astype(np.uint32)
+                cones[int(cone[0])] = cone
+                members.append(cone)
+        self = cls(np.concatenate(members) if members else [])
+        for asid, cone in cones.items():
+            self.add_cone(asid, cone)
+        return self
+
+    def _index_of(self, asids):
+        return _index_in(self.as_ids, np.asarray(asids, dtype=np.uint32))
+
+    def add_cone(self, asid, members):
+        """ Sets the cone of asid to the array of AS numbers members"""
+        idx = self._index_of(members)
+        bits = np.zeros(len(self.as_ids), dtype=bool)
+        bits[idx[idx >= 0]] = True
+        self._cones[int(asid)] = np.packbits(bits, bitorder='little')
+
+    def get_cone_ases(self):
+        return list(self._cones.keys())
+
+    def cone_size(self, asid):
+        return int(np.unpackbits(self._cones[asid], bitorder='little').sum())
+
+    def in_cone_many(self, asid, asns):
+        """ Returns bool array, True for the AS numbers in the cone of asid
+        (negative AS numbers, eg. -1 from RouteTable.lookup_many, are not)"""
+        asns = np.asarray(asns)
+        cone = self._cones.get(int(asid))
+        result = np.zeros(len(asns), dtype=bool)
+        if cone is None:
+            return result
+        valid = np.flatnonzero((asns >= 0) & (asns <= 0xFFFFFFFF))
+        idx = self._index_of(asns[valid])
+        ok = idx >= 0
+        idx = idx[ok]
+        result[valid[ok]] = (cone[idx >> 3] >> (idx & 7).astype(np.uint8)) & 1
+        return result
+
+    def in_cone(self, asid, asn):
+        if asn is None:
+            return False
+        return bool(self.in_cone_many(asid, [asn])[0])
+
+    def ip_in_cone(self, table, asid, ip_address):
+        """ True if the origin AS of ip_address in table (a RouteTable with
+        origin ASes as output Index, not payload Indices) is in the cone of
+        asid"""
+        return self.in_cone(asid, table.lookup(ip_address))
+
+    def ips_in_cone(self, table, asid, ips):
+        """ Same as ip_in_cone, for an array of addresses (32 bit
+        integers)"""
+        return self.in_cone_many(asid, table.lookup_many(ips))
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    # asrelations.py as-rel.txt.bz2 AS [AS ...]
+    then = dt.now()
+    r = ASRelations(sys.argv[1])
+    print(f"{len(r)} ASes loaded in {dt.now() - then}, errors: {dict(r.errors)}")
+    ases = [int(a) for a in sys.argv[2:]]
+    cones = ConeBitmaps.from_relations(r, ases)
+    for asid in ases:
+        print(f"AS{asid}: {len(r.get_customers(asid))} customers, "
+                f"{len(r.get_providers(asid))} providers, "
+                f"{len(r.get_peers(asid))} peers, "
+                f"cone of {cones.cone_size(asid)} ASes")
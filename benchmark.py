@@ -0,0 +1,152 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Benchmarks on synthetic (random) routing tables and inputs.
+
+Usage:
+    python benchmark.py enrich [--routes N] [--lines N]
+    python benchmark.py engines [--routes N] [--lookups N]
+    python benchmark.py threads [--routes N] [--lookups N] [--engine E]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from prefixset import PrefixSet
+from ipv4_addresses import u32_to_text
+
+
+def random_prefix_set(nroutes, seed=1):
+    """Returns a PrefixSet of random prefixes, with the prefix lengths
+    distributed roughly like a full IPv4 table (mostly /24s)."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.choice([8, 12, 14, 16, 18, 19, 20, 21, 22, 23, 24, 28, 32],
+                    nroutes, p=[0.001, 0.002, 0.007, 0.03, 0.03, 0.03, 0.05,
+                                0.05, 0.1, 0.07, 0.6, 0.02, 0.01])
+    prefixes = rng.integers(1 << 24, 224 << 24, nroutes, dtype=np.uint64)
+    masks = ((np.uint64(1) << lengths.astype(np.uint64)) - np.uint64(1)) << \
+            (np.uint64(32) - lengths.astype(np.uint64))
+    prefixes = (prefixes & masks).astype(np.uint32)
+    origins = rng.integers(1, 400000, nroutes, dtype=np.uint32)
+    ps = PrefixSet(prefixes, lengths, origins)
+    _, first = np.unique(ps.keys(), return_index=True)
+    return ps.take(first)
+
+
+def random_addresses(n, seed=2, skew=True):
+    """Returns n random addresses. If skew is True, most of the addresses are
+    from a few thousand /24s, like real traffic."""
+    rng = np.random.default_rng(seed)
+    addrs = rng.integers(0, 1 << 32, n, dtype=np.uint64).astype(np.uint32)
+    if skew:
+        hot = rng.integers(0, 1 << 24, 4096, dtype=np.uint32) << np.uint32(8)
+        pick = rng.random(n) < 0.8
+        addrs[pick] = hot[rng.zipf(1.3, int(pick.sum())) % len(hot)] | \
+                        (addrs[pick] & np.uint32(0xFF))
+    return addrs
+
+
+def _timed(label, fn, count, unit):
+    then = time.perf_counter()
+    result = fn()
+    secs = time.perf_counter() - then
+    print(f"{label:40s} {secs:8.3f}s {count / secs:14,.0f} {unit}/s")
+    return result
+
+
+def bench_enrich(args):
+    from enrich import Enricher, iter_chunks
+    import io
+
+    table = _timed('build table', lambda: random_prefix_set(
+                        args.routes).to_route_table(), args.routes, 'routes')
+    addrs = random_addresses(args.lines)
+    plain = ('\n'.join(u32_to_text(addrs)) + '\n').encode()
+    csv = b''.join(b'%d,%s,443\n' % (i, ip) for i, ip in
+                    enumerate(plain.split(b'\n')[:-1]))
+    _timed('flatten table', table.flatten, args.routes, 'routes')
+
+    for fmt, data, column in (('plain', plain, 0), ('csv', csv, 1)):
+        enricher = Enricher(table, fmt=fmt, column=column)
+        def run():
+            out = io.BytesIO()
+            for chunk in iter_chunks(io.BytesIO(data), args.chunk_size):
+                out.write(enricher.enrich(chunk))
+            return out
+        _timed(f'enrich {fmt}', run, args.lines, 'lines')
+
+
+def bench_engines(args):
+    from ipv4_routing_table import ENGINES, make_route_table
+
+    ps = random_prefix_set(args.routes)
+    addrs = random_addresses(args.lookups, skew=False)
+    results = {}
+    for engine in ENGINES:
+        table = make_route_table(engine)
+        _timed(f'{engine}: add', lambda: ps.to_route_table(table),
+                len(ps), 'routes')
+        # Prepare (flatten / build) the table for batch lookups
+        _timed(f'{engine}: first lookup_many', lambda: table.lookup_many(
+                addrs[:1]), len(ps), 'routes')
+        results[engine] = _timed(f'{engine}: lookup_many',
+                lambda: table.lookup_many(addrs), len(addrs), 'lookups')
+        print(f"{engine + ': memory':40s} {table.memory() / (1 << 20):8.1f} MB")
+    first, *others = ENGINES
+    for engine in others:
+        assert (results[engine] == results[first]).all(), engine
+
+
+def bench_threads(args):
+    from ipv4_routing_table import make_route_table
+    import lookupkernel
+
+    table = random_prefix_set(args.routes).to_route_table(
+                                    make_route_table(args.engine))
+    addrs = random_addresses(args.lookups, skew=False)
+    expected = table.lookup_many(addrs[:1]) # Prepare (flatten / build)
+    kernel = 'kernel' if args.engine == 'multibit' and \
+                lookupkernel.available() else 'numpy'
+    print(f"{args.engine} ({kernel}), {os.cpu_count()} CPUs")
+    base = None
+    for threads in args.threads:
+        then = time.perf_counter()
+        result = table.lookup_many(addrs, threads=threads)
+        secs = time.perf_counter() - then
+        if base is None:
+            base, expected = secs, result
+        assert (result == expected).all(), threads
+        print(f"{'threads: %d' % threads:40s} {secs:8.3f}s "
+                f"{len(addrs) / secs:14,.0f} lookups/s {base / secs:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('enrich', help='enrich.py throughput')
+    p.add_argument('--routes', type=int, default=100000)
+    p.add_argument('--lines', type=int, default=2000000)
+    p.add_argument('--chunk-size', type=int, default=4 << 20)
+    p.set_defaults(func=bench_enrich)
+    p = sub.add_parser('engines', help='RouteTable vs Poptrie memory and '
+                        'lookup_many speed')
+    p.add_argument('--routes', type=int, default=900000)
+    p.add_argument('--lookups', type=int, default=4000000)
+    p.set_defaults(func=bench_engines)
+    p = sub.add_parser('threads', help='lookup_many scaling with threads')
+    p.add_argument('--routes', type=int, default=900000)
+    p.add_argument('--lookups', type=int, default=16000000)
+    p.add_argument('--engine', choices=('multibit', 'poptrie'),
+                    default='multibit')
+    p.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    p.set_defaults(func=bench_threads)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
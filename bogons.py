@@ -0,0 +1,159 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Classifies addresses that are not routed, before looking them up in the
+routing table.
+
+Two checks are made, both of them without walking the table -
+ - Special use address blocks (RFC 6890 and the IANA special purpose
+   registry - private, loopback, link local, multicast, reserved etc.), from
+   a table of the category of every /16 (only the few /16s that are partly
+   special use are checked block by block)
+ - A bitmap of 64K bits, one per /16, that is set if any route in the table
+   covers (part of) the /16. Addresses in a /16 without a bit set are
+   'unrouted'.
+Only the addresses that pass both are looked up in the table. Lookups return
+a category, 'routed' with the output of the table or one of the others with
+no output (instead of just None).
+"""
+
+import numpy as np
+
+from ipv4_routing_table import ip_to_int
+
+ROUTED = 'routed'
+UNROUTED = 'unrouted'
+
+CATEGORIES = (ROUTED, UNROUTED, 'private', 'shared', 'loopback', 'link-local',
+                'documentation', 'multicast', 'reserved', 'broadcast')
+
+# Non globally routable special use blocks
+SPECIAL_USE = [
+    ('0.0.0.0', 8, 'reserved'),         # RFC 1122 'This network'
+    ('10.0.0.0', 8, 'private'),         # RFC 1918
+    ('100.64.0.0', 10, 'shared'),       # RFC 6598 Carrier grade NAT
+    ('127.0.0.0', 8, 'loopback'),       # RFC 1122
+    ('169.254.0.0', 16, 'link-local'),  # RFC 3927
+    ('172.16.0.0', 12, 'private'),      # RFC 1918
+    ('192.0.0.0', 24, 'reserved'),      # RFC 6890 IETF Protocol Assignments
+    ('192.0.2.0', 24, 'documentation'), # RFC 5737 TEST-NET-1
+    ('192.168.0.0', 16, 'private'),     # RFC 1918
+    ('198.18.0.0', 15, 'reserved'),     # RFC 2544 Benchmarking
+    ('198.51.100.0', 24, 'documentation'), # RFC 5737 TEST-NET-2
+    ('203.0.113.0', 24, 'documentation'), # RFC 5737 TEST-NET-3
+    ('224.0.0.0', 4, 'multicast'),      # RFC 5771
+    ('240.0.0.0', 4, 'reserved'),       # RFC 1112 Future use
+    ('255.255.255.255', 32, 'broadcast'), # RFC 919
+]
+
+
+_MIXED = 255
+
+
+class AddressClassifier:
+    def __init__(self, table, special_use=SPECIAL_USE):
+        """ table : RouteTable (or any table with route_arrays, lookup_int
+            and lookup_many).
+            special_use : List of (prefix, length, category) blocks.
+
+        The /16 bitmap is a snapshot of the table, call rebuild after the
+        table is changed."""
+        self._table = table
+        # Longest first, so that a more specific block wins.
+        blocks = sorted(special_use, key=lambda x: -x[1])
+        self._special_first = np.array([ip_to_int(p) for p, _, _ in blocks],
+                                        dtype=np.uint32)
+        self._special_last = np.array([ip_to_int(p) + (1 << (32 - l)) - 1
+                                        for p, l, _ in blocks], dtype=np.uint32)
+        self._special_codes = np.array([CATEGORIES.index(c)
+                                        for _, _, c in blocks], dtype=np.uint8)
+
+        # Category of every /16, _MIXED if only a part of it is special use
+        self._special16 = np.zeros(1 << 16, dtype=np.uint8)
+        for first, last, code in zip(self._special_first.tolist(),
+                                        self._special_last.tolist(),
+                                        self._special_codes.tolist()):
+            lo, hi = first >> 16, last >> 16
+            if last - first + 1 < (1 << 16):
+                self._special16[lo] = _MIXED
+                continue
+            part = self._special16[lo:hi+1]
+            part[part == 0] = code
+        self.rebuild()
+
+    def rebuild(self):
+        """ Rebuilds the /16 presence bitmap from the routes in the table"""
+        prefixes, lengths, _ = self._table.route_arrays()
+        first = prefixes >> np.uint32(16)
+        count = np.ones(len(prefixes), dtype=np.int64)
+        short = lengths < 16
+        count[short] = 1 << (16 - lengths[short].astype(np.int64))
+        # Mark [first, first + count) for every route with a +1/-1 sweep
+        edges = np.zeros((1 << 16) + 1, dtype=np.int64)
+        np.add.at(edges, first.astype(np.int64), 1)
+        np.add.at(edges, first.astype(np.int64) + count, -1)
+        present = np.cumsum(edges[:-1]) > 0
+        self._bitmap = np.packbits(present, bitorder='little')
+
+    def _routed16(self, ips):
+        idx = ips >> np.uint32(16)
+        return ((self._bitmap[idx >> np.uint32(3)] >>
+                    (idx & np.uint32(7)).astype(np.uint8)) & 1).astype(bool)
+
+    def _special(self, ips):
+        """ Category code of the special use block of every address,
+        0 (routed) if none."""
+        codes = self._special16[ips >> np.uint32(16)]
+        mixed = np.flatnonzero(codes == _MIXED)
+        if len(mixed):
+            sub = ips[mixed]
+            found = np.zeros(len(mixed), dtype=np.uint8)
+            for first, last, code in zip(self._special_first,
+                                    self._special_last, self._special_codes):
+                hit = (found == 0) & (sub >= first) & (sub <= last)
+                found[hit] = code
+            codes[mixed] = found
+        return codes
+
+    def classify_int(self, ip):
+        """ Returns (category, output) for an address given as a 32 bit
+        integer. output is None unless category is 'routed'."""
+        idx = ip >> 16
+        code = int(self._special16[idx])
+        if code == _MIXED:
+            code = int(self._special(np.array([ip], dtype=np.uint32))[0])
+        if code:
+            return CATEGORIES[code], None
+        if not (int(self._bitmap[idx >> 3]) >> (idx & 7)) & 1:
+            return UNROUTED, None
+        output = self._table.lookup_int(ip)
+        if output is None:
+            return UNROUTED, None
+        return ROUTED, output
+
+    def classify(self, ip_address):
+        return self.classify_int(ip_to_int(ip_address))
+
+    def classify_many(self, ips):
+        """ Classifies an array of addresses (32 bit integers). Returns
+        (codes, outputs) arrays - index in CATEGORIES and output (-1 unless
+        routed). Only the addresses in routed /16s that are not special use
+        are looked up in the table."""
+        ips = np.asarray(ips, dtype=np.uint32)
+        codes = self._special(ips)
+        outputs = np.full(len(ips), -1, dtype=np.int64)
+        maybe = codes == 0
+        maybe[maybe] = self._routed16(ips[maybe])
+        codes[(codes == 0) & ~maybe] = CATEGORIES.index(UNROUTED)
+        where = np.flatnonzero(maybe)
+        if len(where):
+            found = self._table.lookup_many(ips[where])
+            outputs[where] = found
+            codes[where[found < 0]] = CATEGORIES.index(UNROUTED)
+        return codes, outputs
+
+    def category_counts(self, codes):
+        """ Returns {category: count} for the codes from classify_many"""
+        counts = np.bincount(codes, minlength=len(CATEGORIES))
+        return {c: int(n) for c, n in zip(CATEGORIES, counts) if n}
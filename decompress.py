@@ -0,0 +1,417 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Decompression layer for MRT (and other) dump files.
+
+The format of a file is detected from its magic bytes rather than from the
+file name extension. Following formats are supported
+ - gzip (1f 8b)
+ - bzip2 ('BZh' followed by block size digit)
+ - xz (fd '7zXZ' 00) - if the 'lzma' module is available
+ - zstd (28 b5 2f fd) - if the 'compression.zstd' module is available
+ - Anything else is treated as an uncompressed file.
+
+Every format is handed to the caller as a plain buffered byte stream
+(io.BufferedReader) with a large buffer, so the MRT record framing does not
+need to know about compression at all.
+
+bzip2 streams can additionally be decoded in parallel. A bzip2 stream is a
+sequence of independently compressed blocks, each block starting with the 48
+bit magic 0x314159265359 (BCD pi) and the stream ending with 0x177245385090
+(BCD sqrt(pi)). The blocks are *not* byte aligned, so we look for the magic at
+all 8 possible bit shifts, cut the stream at block boundaries and re-wrap every
+block as a stand alone single block bzip2 stream, which is then decompressed in
+a process pool. The combined stream CRC of a single block stream is the block
+CRC itself, so the re-wrapped streams are valid bzip2 streams.
+
+A stream that ends in the middle (a truncated file) or can't be decoded ends
+the data there, everything decoded before that is still returned. The error
+is kept and can be checked with stream_error once the data is read.
+"""
+
+import io
+import os
+import bz2
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import lzma
+except ImportError: # pragma: no cover - depends on how python was built
+    lzma = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+FORMAT_PLAIN = 'plain'
+FORMAT_GZIP = 'gzip'
+FORMAT_BZIP2 = 'bzip2'
+FORMAT_XZ = 'xz'
+FORMAT_ZSTD = 'zstd'
+
+READ_BUFFER_SIZE = 1 << 20 # Size of the buffer handed to the record reader
+COMPRESSED_CHUNK_SIZE = 1 << 20 # Size of compressed data read at a time
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_BZIP2_MAGIC = b'BZh'
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+_BZ2_BLOCK_MAGIC = 0x314159265359
+_BZ2_EOS_MAGIC = 0x177245385090
+_BZ2_MAGIC_BITS = 48
+_BZ2_STREAM_HDR_BITS = 32 # 'BZh' + block size digit
+_BZ2_CRC_BITS = 32
+
+
+class UnsupportedCompressionErr(Exception):
+    pass
+
+class CorruptStreamErr(Exception):
+    pass
+
+
+def detect_format(header):
+    """ Returns the format of the data given first few bytes of a file."""
+    if header.startswith(_GZIP_MAGIC):
+        return FORMAT_GZIP
+    if header.startswith(_BZIP2_MAGIC) and header[3:4].isdigit():
+        return FORMAT_BZIP2
+    if header.startswith(_XZ_MAGIC):
+        return FORMAT_XZ
+    if header.startswith(_ZSTD_MAGIC):
+        return FORMAT_ZSTD
+    return FORMAT_PLAIN
+
+
+def detect_file_format(filename):
+    """ Returns the format of the file by looking at it's magic bytes."""
+    with open(filename, 'rb') as f:
+        return detect_format(f.read(8))
+
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS : Expect a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _decompressor_factory(fmt):
+    if fmt == FORMAT_GZIP:
+        return _gzip_decompressor
+    if fmt == FORMAT_BZIP2:
+        return bz2.BZ2Decompressor
+    if fmt == FORMAT_XZ:
+        if lzma is None:
+            raise UnsupportedCompressionErr(fmt)
+        return lzma.LZMADecompressor
+    if fmt == FORMAT_ZSTD:
+        if zstd is None:
+            raise UnsupportedCompressionErr(fmt)
+        return zstd.ZstdDecompressor
+    raise UnsupportedCompressionErr(fmt)
+
+
+class _ChunkedRawReader(io.RawIOBase):
+    """ A Raw Reader that returns data from an iterator of decoded chunks.
+    Used as the underlying 'raw' stream of an io.BufferedReader."""
+
+    def __init__(self, chunks, fileobj=None, on_close=None):
+        self._chunks = chunks
+        self._fileobj = fileobj
+        self._on_close = on_close
+        self._pending = b''
+        self._pending_off = 0
+        self.name = getattr(fileobj, 'name', None)
+        self.error = None # CorruptStreamErr that ended the data
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pending_off >= len(self._pending):
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+            except CorruptStreamErr as e:
+                # Not raised here, the buffered reader would drop the data
+                # it has already read
+                self.error = e
+                return 0
+            self._pending_off = 0
+        n = min(len(b), len(self._pending) - self._pending_off)
+        b[:n] = self._pending[self._pending_off:self._pending_off+n]
+        self._pending_off += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._on_close:
+                self._on_close()
+            if self._fileobj:
+                self._fileobj.close()
+        finally:
+            super().close()
+
+
+def _iter_decompressed(fileobj, factory, chunk_size=COMPRESSED_CHUNK_SIZE):
+    """ Yields decompressed chunks from fileobj using decompressors returned
+    by factory. Concatenated streams (multi member gzip, pbzip2 output etc.)
+    are handled by starting a new decompressor on any unused data. Raises
+    CorruptStreamErr if the data can't be decoded or ends in a stream."""
+    d = factory()
+    started = False
+    offset = 0 # Of data in the compressed file
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        offset += len(data)
+        while data:
+            try:
+                out = d.decompress(data)
+            except (OSError, EOFError, ValueError, zlib.error) as e:
+                raise CorruptStreamErr(f'{e} (before offset {offset})') from e
+            started = True
+            if out:
+                yield out
+            if not d.eof:
+                break
+            data = d.unused_data
+            d = factory()
+            started = False
+            if not data:
+                # New stream may begin in the next chunk, but empty trailing
+                # data is fine too.
+                break
+    if hasattr(d, 'flush'):
+        # zlib decompress objects may hold back some data
+        out = d.flush()
+        if out:
+            yield out
+    if started and not d.eof:
+        raise CorruptStreamErr(f'truncated at offset {offset}')
+
+
+def _bz2_magic_patterns(magic):
+    """ For each of 8 possible bit shifts, returns the (fixed_bytes, shift)
+    such that the 48 bit magic starting at bit 'shift' of a byte, fully
+    covers 'fixed_bytes' starting at the next byte."""
+    patterns = []
+    for shift in range(8):
+        # Magic placed at bit offset 'shift' in a 56 bit (7 byte) window
+        window = magic << (8 - shift)
+        wbytes = window.to_bytes(7, 'big')
+        if shift == 0:
+            # byte aligned - all 6 bytes are fixed
+            patterns.append((wbytes[:6], shift))
+        else:
+            patterns.append((wbytes[1:6], shift))
+    return patterns
+
+_BLOCK_PATTERNS = _bz2_magic_patterns(_BZ2_BLOCK_MAGIC)
+_EOS_PATTERNS = _bz2_magic_patterns(_BZ2_EOS_MAGIC)
+
+
+def _find_magic_bits(data, magic, patterns, start_bit=0):
+    """ Returns sorted list of bit offsets in data where 48 bit magic starts.
+    Uses bytes.find on the fully covered bytes of each of the 8 bit shifts
+    and then verifies the partial bytes."""
+    found = []
+    nbits = len(data) * 8
+    mask = (1 << _BZ2_MAGIC_BITS) - 1
+    for fixed, shift in patterns:
+        # For non zero shift, the 'fixed' bytes start one byte after the byte
+        # in which the magic starts.
+        lead = 0 if shift == 0 else 1
+        pos = data.find(fixed)
+        while pos != -1:
+            byte_off = pos - lead
+            bit_off = byte_off * 8 + shift
+            if byte_off >= 0 and bit_off >= start_bit and \
+                    bit_off + _BZ2_MAGIC_BITS <= nbits:
+                window = int.from_bytes(data[byte_off:byte_off+7], 'big')
+                wbits = (len(data[byte_off:byte_off+7])) * 8
+                val = (window >> (wbits - shift - _BZ2_MAGIC_BITS)) & mask
+                if val == magic:
+                    found.append(bit_off)
+            pos = data.find(fixed, pos + 1)
+    found.sort()
+    return found
+
+
+def _extract_bits(data, begin, end):
+    """ Returns (value, nbits) for bits [begin, end) in data."""
+    first = begin // 8
+    last = (end + 7) // 8
+    val = int.from_bytes(data[first:last], 'big')
+    total = (last - first) * 8
+    val >>= total - (end - first * 8)
+    nbits = end - begin
+    return val & ((1 << nbits) - 1), nbits
+
+
+def _decode_bz2_block(data, begin, end):
+    """ Worker: Wraps bits [begin, end) of data (a single bzip2 block starting
+    at it's block magic) into a single block bzip2 stream and decompresses
+    it."""
+    block, nbits = _extract_bits(data, begin, end)
+    # Block CRC follows the block magic
+    crc = (block >> (nbits - _BZ2_MAGIC_BITS - _BZ2_CRC_BITS)) & 0xFFFFFFFF
+    val = (block << (_BZ2_MAGIC_BITS + _BZ2_CRC_BITS)) | \
+            (_BZ2_EOS_MAGIC << _BZ2_CRC_BITS) | crc
+    nbits += _BZ2_MAGIC_BITS + _BZ2_CRC_BITS
+    pad = (-nbits) % 8
+    stream = b'BZh9' + (val << pad).to_bytes((nbits + pad) // 8, 'big')
+    return bz2.decompress(stream)
+
+
+def _iter_bz2_blocks(fileobj, chunk_size):
+    """ Yields (data, begin_bit, end_bit) for every block of the bzip2
+    stream(s) in fileobj, where data is a bytes object that contains the
+    block. Raises CorruptStreamErr if the last block doesn't end (with
+    another block or the end of stream)."""
+    buf = b''
+    eof = False
+    offset = 0 # Of buf in the compressed file
+    while not eof:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf += chunk
+        if not buf:
+            break
+        # Any boundary is a block magic or end of stream magic.
+        blocks = _find_magic_bits(buf, _BZ2_BLOCK_MAGIC, _BLOCK_PATTERNS)
+        ends = _find_magic_bits(buf, _BZ2_EOS_MAGIC, _EOS_PATTERNS)
+        bounds = sorted(blocks + ends)
+        consumed = 0
+        for i, begin in enumerate(blocks):
+            nxt = [b for b in bounds if b > begin]
+            if not nxt:
+                if eof:
+                    raise CorruptStreamErr('truncated block at offset '
+                                            f'{offset + begin // 8}')
+                break
+            end = nxt[0]
+            yield buf, begin, end
+            consumed = end
+        if eof:
+            break
+        # Keep everything from the last unfinished block. (Keep a byte before
+        # in case the block magic starts in the middle of that byte.)
+        keep_from = consumed // 8
+        if len(blocks) and blocks[-1] >= consumed:
+            keep_from = blocks[-1] // 8
+        buf = buf[keep_from:]
+        offset += keep_from
+
+
+class _ParallelBZ2Chunks:
+    """ Iterator over decompressed bzip2 blocks, decompressed out of order by
+    a pool of worker processes but yielded in order. At most 'inflight'
+    blocks are outstanding, so that the memory use is bounded."""
+
+    def __init__(self, fileobj, workers, chunk_size=COMPRESSED_CHUNK_SIZE * 8):
+        self._blocks = _iter_bz2_blocks(fileobj, chunk_size)
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._inflight = deque()
+        self._max_inflight = workers * 2
+        self._error = None # Raised once the blocks before it are returned
+
+    def __iter__(self):
+        return self
+
+    def _fill(self):
+        while self._error is None and \
+                len(self._inflight) < self._max_inflight:
+            try:
+                data, begin, end = next(self._blocks)
+            except StopIteration:
+                return
+            except CorruptStreamErr as e:
+                self._error = e
+                return
+            # Only ship the bytes of this block to the worker.
+            first = begin // 8
+            last = (end + 7) // 8
+            self._inflight.append(self._pool.submit(_decode_bz2_block,
+                data[first:last], begin - first * 8, end - first * 8))
+
+    def __next__(self):
+        self._fill()
+        if not self._inflight:
+            self.shutdown()
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+        try:
+            return self._inflight.popleft().result()
+        except (OSError, EOFError, ValueError) as e:
+            self.shutdown()
+            raise CorruptStreamErr(f'bzip2 block: {e}') from e
+
+    def shutdown(self):
+        for f in self._inflight:
+            f.cancel()
+        self._inflight.clear()
+        self._pool.shutdown(wait=True)
+
+
+def stream_error(stream):
+    """ Returns the CorruptStreamErr that ended the data of a stream returned
+    by open_stream (a truncated or corrupt file), None if there's none."""
+    return getattr(getattr(stream, 'raw', None), 'error', None)
+
+
+def open_stream(filename, workers=None, buffer_size=READ_BUFFER_SIZE):
+    """ Opens a (possibly compressed) file for reading and returns a buffered
+    binary stream of the decompressed data.
+
+    parameters:
+        workers: Number of processes used for decoding bzip2 files.
+                 None means os.cpu_count(), 1 disables parallel decoding.
+        buffer_size: Size of the read buffer of the returned stream.
+    """
+    fmt = detect_file_format(filename)
+    if fmt == FORMAT_PLAIN:
+        return open(filename, 'rb', buffering=buffer_size)
+
+    fileobj = open(filename, 'rb', buffering=0)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if fmt == FORMAT_BZIP2 and workers > 1:
+        chunks = _ParallelBZ2Chunks(fileobj, workers)
+        raw = _ChunkedRawReader(chunks, fileobj, on_close=chunks.shutdown)
+    else:
+        try:
+            factory = _decompressor_factory(fmt)
+        except UnsupportedCompressionErr:
+            fileobj.close()
+            raise
+        raw = _ChunkedRawReader(_iter_decompressed(fileobj, factory), fileobj)
+    return io.BufferedReader(raw, buffer_size=buffer_size)
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    for workers in (1, None):
+        then = dt.now()
+        total = 0
+        with open_stream(sys.argv[1], workers=workers) as f:
+            while True:
+                d = f.read(READ_BUFFER_SIZE)
+                if not d:
+                    break
+                total += len(d)
+            error = stream_error(f)
+        print(f"workers: {workers}, bytes: {total}, time: {dt.now() - then}"
+                + (f", error: {error}" if error else ""))
@@ -0,0 +1,340 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Enriches a stream of IP addresses (logs, flow records etc.) with the origin AS,
+the Org and the country of the AS.
+
+The routing table is loaded once (a table saved with RouteTable.save_table or
+built from one or more MRT RIBs), input is then read from stdin or from files
+in chunks of complete lines. Every chunk is processed as a whole -
+ - The IP address column is cut out of all the lines, using the positions of
+   the delimiters for CSV/TSV and with a single regular expression
+   substitution for JSON lines inputs
+ - Addresses are converted to integers with NumPy (ipv4_addresses.py)
+ - Looked up with a single RouteTable.lookup_many call
+ - The output columns are formatted once per distinct AS and the output is
+   gathered from the lines and the formatted columns with one fancy indexing
+   (see gather), without per line Python objects.
+So the memory used is bounded by the chunk size, no matter how large the
+input is.
+
+Usage:
+    python enrich.py --table rttable.npz --asinfo as-org2info.txt.gz < ips.txt
+    python enrich.py --rib rib.bz2 --format csv --column 2 --header flows.csv
+"""
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime as dt
+
+import numpy as np
+
+from decompress import open_stream
+from ipv4_addresses import text_to_u32
+
+FORMATS = ('plain', 'csv', 'tsv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 4 << 20
+OUTPUT_COLUMNS = (b'as', b'org', b'country')
+
+_DELIMITERS = {'plain': b'\t', 'csv': b',', 'tsv': b'\t'}
+_NL = ord('\n')
+_CLOSE_BRACE = ord('}')
+_JSON_BLANKS = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
+_MAX_FIELD_LEN = 17 # Quoted 255.255.255.255
+
+
+class Enricher:
+    def __init__(self, table, asinfo=None, fmt='plain', column=0, field='ip',
+                    threads=None):
+        """ table : RouteTable with AS numbers as output Index (not a
+            table of payload Indices, see payloads.py).
+            asinfo : A parsed ASInformation (optional) for Org and Country.
+            fmt : One of FORMATS.
+            column : Column (0 based) with the IP address for csv/tsv.
+            field : Name of the field with the IP address for jsonl.
+            threads : Threads for looking up a chunk (see
+            RouteTable.lookup_many).
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown format: {fmt}')
+        self._table = table
+        self._asinfo = asinfo
+        self._fmt = fmt
+        self._delim = _DELIMITERS.get(fmt)
+        self._column = column
+        self._threads = threads
+        self._extract = self._get_extract_re(fmt, field)
+        self._annotations = {}
+        self.lines = 0
+        self.matched = 0
+
+    def _get_extract_re(self, fmt, field):
+        """ Returns a regular expression that replaces every line of a JSON
+        lines input with just the IP address in it (lines are kept, so line
+        numbers don't change)"""
+        if fmt != 'jsonl':
+            return None
+        key = re.escape(json.dumps(field).encode())
+        return re.compile(rb'^[^\n]*?' + key +
+                            rb'\s*:\s*"([^"\n]*)"[^\n]*$', re.M)
+
+    def header(self, line):
+        """ Returns the header line with the output columns added."""
+        line = line.rstrip(b'\r\n')
+        if self._delim is None:
+            return line + b'\n'
+        return self._delim.join([line] + list(OUTPUT_COLUMNS)) + b'\n'
+
+    def _quote(self, value):
+        if self._fmt == 'csv' and (b',' in value or b'"' in value):
+            return b'"' + value.replace(b'"', b'""') + b'"'
+        if self._fmt != 'csv':
+            return value.replace(self._delim, b' ')
+        return value
+
+    def _annotation(self, asid):
+        """ Returns (and caches) the bytes to be added to a line for asid."""
+        ann = self._annotations.get(asid)
+        if ann is not None:
+            return ann
+        org = country = b''
+        if asid >= 0 and self._asinfo is not None:
+            info = self._asinfo.get_as_info(asid)
+            if info is not None:
+                org = self._asinfo.get_org_name(info.org) or info.org
+                country = info.country
+        if self._delim is None:
+            if asid < 0:
+                ann = b',"as":null,"org":null,"country":null}'
+            else:
+                ann = (',"as":%d,"org":%s,"country":%s}' % (asid,
+                        json.dumps(org.decode(errors='replace')),
+                        json.dumps(country.decode(errors='replace')))).encode()
+        else:
+            asstr = b'' if asid < 0 else str(asid).encode()
+            ann = self._delim + self._delim.join([asstr, self._quote(org),
+                                                    self._quote(country)])
+        self._annotations[asid] = ann
+        return ann
+
+    def lookup(self, chunk):
+        """ Returns AS for every line in the chunk (-1 if not found)"""
+        if self._extract is not None:
+            buf = self._extract.sub(rb'\1', chunk)
+        elif self._fmt != 'plain':
+            buf = cut_column(chunk, self._delim, self._column)
+        else:
+            buf = chunk
+        addrs, valid = text_to_u32(buf)
+        ases = self._table.lookup_many(addrs, threads=self._threads)
+        ases[~valid] = -1
+        return ases
+
+    def enrich(self, chunk):
+        """ Enriches a chunk of complete lines (ending with a newline) and
+        returns the output lines."""
+        if b'\r' in chunk:
+            chunk = chunk.replace(b'\r\n', b'\n')
+        ases = self.lookup(chunk)
+        uniq, inverse = np.unique(ases, return_inverse=True)
+        anns = [self._annotation(a) for a in uniq.tolist()]
+        inverse = inverse.ravel()
+        self.lines += len(ases)
+        self.matched += int(np.count_nonzero(ases >= 0))
+
+        a = np.frombuffer(chunk, dtype=np.uint8)
+        ends = np.flatnonzero(a == _NL)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        if self._delim is None:
+            # The annotation replaces the closing brace of the (stripped)
+            # line, lines without one are only stripped.
+            ends = _rstrip(a, starts, ends)
+            brace = np.zeros(len(ends), dtype=bool)
+            has = ends > starts
+            brace[has] = a[ends[has] - 1] == _CLOSE_BRACE
+            ends = ends - brace
+            inverse = np.where(brace, inverse, len(anns))
+            anns.append(b'')
+
+        # Every output line is the line and it's annotation (with a newline),
+        # gathered from the chunk and the annotations of the distinct ASes.
+        lengths = np.array([len(x) + 1 for x in anns], dtype=np.int64)
+        offsets = np.cumsum(lengths) - lengths + len(chunk)
+        src = np.frombuffer(chunk + b'\n'.join(anns) + b'\n', dtype=np.uint8)
+        seg_starts = np.empty(2 * len(starts), dtype=np.int64)
+        seg_lengths = np.empty(2 * len(starts), dtype=np.int64)
+        seg_starts[0::2] = starts
+        seg_starts[1::2] = offsets[inverse]
+        seg_lengths[0::2] = ends - starts
+        seg_lengths[1::2] = lengths[inverse]
+        return gather(src, seg_starts, seg_lengths)
+
+
+def gather(src, starts, lengths):
+    """ Returns src[starts[i]:starts[i]+lengths[i]] for all i (src is a uint8
+    array) concatenated, as bytes. Done as a single fancy indexing of src,
+    the indices being a cumulative sum of steps (1 within a segment, a jump
+    at the start of every segment)."""
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(starts):
+        return b''
+    out_starts = np.cumsum(lengths) - lengths
+    size = int(out_starts[-1] + lengths[-1])
+    # Indices fit 32 bits for chunk sized inputs, half the memory traffic
+    dtype = np.int32 if max(size, len(src)) < (1 << 31) else np.int64
+    step = np.ones(size, dtype=dtype)
+    step[0] = starts[0]
+    step[out_starts[1:]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+    return src[np.cumsum(step, dtype=dtype)].tobytes()
+
+
+def _rstrip(a, starts, ends):
+    """ Ends of the lines (between starts and ends) without trailing
+    whitespace, as bytes.rstrip"""
+    ends = ends.copy()
+    todo = np.flatnonzero(ends > starts)
+    while len(todo):
+        todo = todo[np.isin(a[ends[todo] - 1], _JSON_BLANKS)]
+        ends[todo] -= 1
+        todo = todo[ends[todo] > starts[todo]]
+    return ends
+
+
+def cut_column(chunk, delim, column):
+    """ Returns a buffer with just the given column (0 based) of every line of
+    the chunk, one per line. Surrounding quotes are removed, quoted delimiters
+    are not supported (IP addresses don't have any). Fields too long to be an
+    IP address come out empty."""
+    a = np.frombuffer(chunk, dtype=np.uint8)
+    is_nl = a == _NL
+    nls = np.flatnonzero(is_nl)
+    seps = np.flatnonzero(is_nl | (a == delim[0])) # Line end ends a field too
+    line_starts = np.concatenate(([0], nls[:-1] + 1))
+    first_sep = np.searchsorted(seps, line_starts)
+    nseps = np.searchsorted(seps, nls, side='right') - first_sep
+
+    has = nseps > column
+    last = len(seps) - 1
+    if column:
+        begin = seps[np.minimum(first_sep + column - 1, last)] + 1
+    else:
+        begin = line_starts
+    begin = np.where(has, begin, 0)
+    end = np.where(has, seps[np.minimum(first_sep + column, last)], begin)
+    n = end - begin
+    n[n > _MAX_FIELD_LEN] = 0
+
+    # Gather the fields and a newline (the line's own) after every one of them
+    seg_starts = np.empty(2 * len(n), dtype=np.int64)
+    seg_lengths = np.ones(2 * len(n), dtype=np.int64)
+    seg_starts[0::2] = begin
+    seg_starts[1::2] = nls
+    seg_lengths[0::2] = n
+    out = gather(a, seg_starts, seg_lengths)
+    if b'"' in out:
+        out = out.replace(b'"', b'')
+    return out
+
+
+def iter_chunks(f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields chunks of complete lines (each chunk ending in a newline) of
+    about chunk_size bytes from a binary file."""
+    rest = b''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            if rest:
+                yield rest + b'\n'
+            return
+        if rest:
+            data = rest + data
+        cut = data.rfind(b'\n') + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+
+
+def enrich_stream(enricher, fin, fout, chunk_size=DEFAULT_CHUNK_SIZE,
+                    header=False):
+    """ Enriches all lines of fin and writes them to fout."""
+    if header:
+        line = fin.readline()
+        if line:
+            fout.write(enricher.header(line))
+    for chunk in iter_chunks(fin, chunk_size):
+        fout.write(enricher.enrich(chunk))
+
+
+def load_table(args):
+    from ipv4_routing_table import RouteTable
+    from ribmerge import merge_ribs_to_table
+
+    if args.table:
+        return RouteTable(args.table)
+    table, _ = merge_ribs_to_table(args.rib)
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Adds AS, Org and Country '
+                                        'columns to a stream of IP addresses')
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--table', help='Routing table saved by save_table')
+    src.add_argument('--rib', nargs='+', help='MRT RIB file(s)')
+    parser.add_argument('--asinfo', help='CAIDA as-org2info file')
+    parser.add_argument('--format', choices=FORMATS, default='plain')
+    parser.add_argument('--column', type=int, default=0,
+                        help='IP address column for csv/tsv (0 based)')
+    parser.add_argument('--field', default='ip',
+                        help='IP address field for jsonl')
+    parser.add_argument('--header', action='store_true',
+                        help='First line of every input is a header')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--threads', type=int,
+                        help='Look up every chunk on this many threads')
+    parser.add_argument('-o', '--output', help='Output file (default stdout)')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print throughput to stderr')
+    parser.add_argument('inputs', nargs='*', help='Input files (default stdin)')
+    args = parser.parse_args(argv)
+
+    asinfo = None
+    if args.asinfo:
+        from asinformation import ASInformation
+
+        asinfo = ASInformation(args.asinfo)
+        asinfo.parse()
+        asinfo.close()
+
+    enricher = Enricher(load_table(args), asinfo, args.format, args.column,
+                        args.field, args.threads)
+
+    fout = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    then = dt.now()
+    try:
+        if not args.inputs:
+            enrich_stream(enricher, sys.stdin.buffer, fout, args.chunk_size,
+                            args.header)
+        for filename in args.inputs:
+            with open_stream(filename) as fin:
+                enrich_stream(enricher, fin, fout, args.chunk_size,
+                                args.header)
+    finally:
+        if args.output:
+            fout.close()
+        else:
+            fout.flush()
+
+    if args.stats:
+        secs = max((dt.now() - then).total_seconds(), 1e-9)
+        print(f"lines: {enricher.lines}, matched: {enricher.matched}, "
+                f"time: {secs:.2f}s, lines/s: {enricher.lines / secs:.0f}",
+                file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
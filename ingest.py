@@ -0,0 +1,455 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Resumable ingest of MRT RIBs.
+
+Reading a full RIB (decompressing and decoding every record) is the long part
+of building a routing table. While reading, a checkpoint is written every so
+often (atomically, to an .npz file) with
+ - the reader state (see MRTDumper.checkpoint) : offset of the next record in
+   the decompressed stream, the counters, the PEER_INDEX_TABLE record and the
+   last TABLE_DUMP prefix (so that the records of the other peers for it after
+   the offset are still skipped)
+ - the prefixes, lengths and origins read so far (the PrefixSet the table is
+   built from)
+If the ingest is interrupted, running it again with the same checkpoint
+continues from the offset. Compressed streams can't be seeked, so they are
+decompressed again up to the offset, but the records before it are not
+decoded again. The checkpoint is removed once the file is read completely.
+
+A checkpoint is only used for the file it was written for (same name, size
+and modification time).
+
+build_bounded builds a table from RIBs within a memory budget - prefixes are
+collected in sorted runs (the same buffer is reused for every run) and once
+the runs kept in memory would go over half of the budget, they are written
+(spilled) to a file. The runs are then merged a block at a time (the other
+half of the budget) and every merged block goes into the table right away.
+The budget bounds the prefixes being read and merged, the table built grows
+with the number of routes (see RouteTable.memory). Files are read one after
+the other and the peak RSS of every stage (read, merge and build) is
+reported, so the budget can be checked against a VM's memory.
+"""
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from mrtdump import MRTDumper
+from prefixset import PrefixSet
+from ribmerge import merge_prefix_sets, merge_rows, coverage_of, \
+                        MERGE_RULES, InvalidMergeRuleErr
+
+DEFAULT_INTERVAL = 60 # Seconds between checkpoints
+_CHECK_EVERY = 1 << 14 # Prefixes between looks at the clock
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+_BATCH_ROWS = 1 << 18 # Most rows per batch
+_MIN_ROWS = 1 << 10 # Fewest rows per batch or merge block
+_ROW_DTYPE = np.dtype([('prefix', 'u4'), ('length', 'u1'), ('origin', 'u4')])
+_ROW_BYTES = _ROW_DTYPE.itemsize
+# Bytes per row loaded for merging, with the keys, the merged copies and the
+# temporaries of merge_rows
+_MERGE_ROW_BYTES = 128
+
+StageMemory = namedtuple('StageMemory', ['stage', 'peak_rss', 'seconds',
+                                            'start_rss'])
+
+_COUNTERS = ('offset', 'records', 'filtered', 'skipped_bytes', 'resyncs',
+                'truncated', 'decode_errors', 'last_length')
+
+
+def _file_id(mrt_file):
+    st = os.stat(mrt_file)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def save_checkpoint(filename, mrt_file, state, prefixes, lengths, origins):
+    """Writes a checkpoint, replacing the earlier one only once it's
+    written completely."""
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb+') as f:
+        np.savez(f, mrt_file=np.array(os.path.basename(mrt_file)),
+                    file_id=_file_id(mrt_file),
+                    counter_names=np.array(_COUNTERS),
+                    counters=np.array([state[c] for c in _COUNTERS],
+                                        dtype=np.int64),
+                    peer_table=np.frombuffer(state['peer_table'],
+                                                dtype=np.uint8),
+                    last_prefix=np.frombuffer(state['last_prefix'],
+                                                dtype=np.uint8),
+                    prefixes=np.frombuffer(prefixes, dtype=np.uint32),
+                    lengths=np.frombuffer(lengths, dtype=np.uint8),
+                    origins=np.frombuffer(origins, dtype=np.uint32))
+    os.replace(tmp, filename)
+
+
+def load_checkpoint(filename, mrt_file):
+    """Returns (reader state, PrefixSet read so far) from a checkpoint,
+    None if there's none for mrt_file."""
+    if filename is None or not os.path.exists(filename):
+        return None
+    x = np.load(filename)
+    if str(x['mrt_file']) != os.path.basename(mrt_file) or \
+            not (x['file_id'] == _file_id(mrt_file)).all() or \
+            'counter_names' not in x.files: # Written by an older version
+        return None
+    state = dict(zip(x['counter_names'].tolist(), x['counters'].tolist()))
+    state['peer_table'] = x['peer_table'].tobytes()
+    state['last_prefix'] = x['last_prefix'].tobytes()
+    return state, PrefixSet(x['prefixes'], x['lengths'], x['origins'])
+
+
+def ingest_file(mrt_file, checkpoint=None, interval=DEFAULT_INTERVAL,
+                workers=None, record_filter=None, stats=None):
+    """Same as PrefixSet.from_mrt, writing a checkpoint (file name) every
+    interval seconds and resuming from it if it exists."""
+    prefixes = array('I')
+    lengths = array('B')
+    origins = array('I')
+    dumper = MRTDumper(mrt_file, workers=workers, record_filter=record_filter)
+    try:
+        resumed = load_checkpoint(checkpoint, mrt_file)
+        if resumed is not None:
+            state, ps = resumed
+            prefixes.frombytes(ps.prefixes.tobytes())
+            lengths.frombytes(ps.lengths.tobytes())
+            origins.frombytes(ps.origins.tobytes())
+            dumper.resume(state)
+
+        last = time.monotonic()
+        for n, (prefix, length, asid) in enumerate(dumper.prefix_origins(), 1):
+            if length > 0:
+                prefixes.append(int.from_bytes(prefix, 'big'))
+                lengths.append(length)
+                origins.append(asid)
+            if checkpoint is not None and not n % _CHECK_EVERY and \
+                    time.monotonic() - last >= interval:
+                save_checkpoint(checkpoint, mrt_file, dumper.checkpoint(),
+                                prefixes, lengths, origins)
+                last = time.monotonic()
+        if stats is not None:
+            stats.update(dumper.get_stats())
+            stats['resumed_at'] = resumed[0]['offset'] if resumed else 0
+    finally:
+        dumper.close()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return PrefixSet(np.frombuffer(prefixes, dtype=np.uint32),
+                    np.frombuffer(lengths, dtype=np.uint8),
+                    np.frombuffer(origins, dtype=np.uint32))
+
+
+def checkpoint_name(checkpoint_dir, mrt_file):
+    return os.path.join(checkpoint_dir,
+                        os.path.basename(mrt_file) + '.checkpoint.npz')
+
+
+def _ingest_worker(args):
+    mrt_file, checkpoint, interval = args
+    # Don't start a decompression pool in every worker
+    return ingest_file(mrt_file, checkpoint, interval, workers=1)
+
+
+def ingest(mrt_files, checkpoint_dir, rule='first', workers=None,
+            interval=DEFAULT_INTERVAL):
+    """Same as ribmerge.merge_ribs, with a checkpoint for every file in
+    checkpoint_dir. Running it again after an interruption continues every
+    file from it's last checkpoint."""
+    if rule not in MERGE_RULES:
+        raise InvalidMergeRuleErr(rule)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    jobs = [(f, checkpoint_name(checkpoint_dir, f), interval)
+                for f in mrt_files]
+    if workers is None:
+        workers = min(len(mrt_files), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sets = list(pool.map(_ingest_worker, jobs))
+    else:
+        sets = [_ingest_worker(job) for job in jobs]
+    return merge_prefix_sets(sets, rule,
+                                [os.path.basename(f) for f in mrt_files])
+
+
+def peak_rss():
+    """Peak resident set size (bytes) of the process since the last
+    reset_peak_rss (since the start where that's not supported)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Resets the peak RSS (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_rss():
+    """Resident set size (bytes) of the process, 0 where it's not known"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _run_stage(report, stage, fn, *args):
+    reset_peak_rss()
+    start = current_rss()
+    then = time.monotonic()
+    result = fn(*args)
+    report.append(StageMemory(stage, peak_rss(), time.monotonic() - then,
+                                start))
+    return result
+
+
+def _row_keys(rows):
+    return (rows['prefix'].astype(np.uint64) << np.uint64(8)) | \
+            rows['length'].astype(np.uint64)
+
+
+class _ColumnSpill:
+    """Prefix, length and origin rows collected in batches, in memory while
+    they fit in the budget and in a file (in spill_dir) otherwise.
+
+    With runs True every batch is sorted by (prefix, length) and only the
+    first row of a prefix is kept, the batches are then sorted runs merged
+    by merge_runs."""
+
+    def __init__(self, memory_budget, spill_dir, name, runs=False):
+        self._budget = memory_budget
+        self._filename = os.path.join(spill_dir, name)
+        self._runs = runs
+        rows = max(min(_BATCH_ROWS, memory_budget // (4 * _ROW_BYTES)),
+                    _MIN_ROWS)
+        self._buffer = np.empty(rows, _ROW_DTYPE)
+        self._rows = 0
+        self._batches = [] # [collector, rows in memory, offset in file, count]
+        self._kept_bytes = 0
+        self._file = None
+        self._file_rows = 0
+        self.collector = 0 # Of the rows appended from now on
+        self.spilled_rows = 0
+
+    def append(self, prefix, length, origin):
+        i = self._rows
+        self._buffer[i] = (prefix, length, origin)
+        self._rows = i + 1
+        if self._rows == len(self._buffer):
+            self.flush()
+
+    def _spill(self, batch):
+        if self._file is None:
+            self._file = open(self._filename, 'wb+')
+        batch[1].tofile(self._file)
+        batch[2] = self._file_rows
+        self._file_rows += batch[3]
+        self.spilled_rows += batch[3]
+        batch[1] = None
+
+    def flush(self):
+        """Moves the rows in the buffer to a batch (kept or spilled)"""
+        n = self._rows
+        if not n:
+            return
+        self._rows = 0
+        rows = self._buffer[:n]
+        if self._runs:
+            keys = _row_keys(rows)
+            order = np.argsort(keys, kind='stable')
+            first = np.ones(n, dtype=bool)
+            first[1:] = keys[order[1:]] != keys[order[:-1]]
+            rows = rows[order[first]]
+        batch = [self.collector, rows.copy(), 0, len(rows)]
+        self._batches.append(batch)
+        if self._file is None and \
+                self._kept_bytes + batch[3] * _ROW_BYTES <= self._budget:
+            self._kept_bytes += batch[3] * _ROW_BYTES
+            return
+        for b in self._batches:
+            if b[1] is not None:
+                self._spill(b)
+        self._kept_bytes = 0
+
+    def _load(self, batch, start, n):
+        """Rows start to start + n of a batch"""
+        if batch[1] is not None:
+            return batch[1][start:start+n]
+        self._file.seek((batch[2] + start) * _ROW_BYTES)
+        return np.fromfile(self._file, _ROW_DTYPE, min(n, batch[3] - start))
+
+    def to_prefix_set(self):
+        """All the rows, the spilled ones memory mapped from the file (which
+        is removed, the mapping stays valid)"""
+        self.flush()
+        if self._file is None:
+            if not self._batches:
+                return PrefixSet()
+            rows = np.concatenate([b[1] for b in self._batches])
+        else:
+            self._file.close()
+            rows = np.memmap(self._filename, dtype=_ROW_DTYPE, mode='r')
+            os.remove(self._filename)
+        return PrefixSet(rows['prefix'], rows['length'], rows['origin'])
+
+    def merge_runs(self, rule, nsets, memory_budget):
+        """Merges the sorted runs (see ribmerge.merge_rows), yields (merged
+        PrefixSet, counts) for consecutive ranges of prefixes. At most
+        memory_budget bytes of rows of all the runs are loaded at a time.
+
+        Every run is read in blocks. All the rows with keys up to the
+        smallest last key of the loaded blocks are in the loaded blocks
+        (keys are unique in a run), they are merged and the run(s) that ran
+        out of rows get their next block."""
+        self.flush()
+        if self._file is not None:
+            self._file.flush()
+        runs = [b for b in self._batches if b[3]]
+        block_rows = max(memory_budget // (max(len(runs), 1) *
+                                            _MERGE_ROW_BYTES), _MIN_ROWS)
+        loaded = [min(block_rows, b[3]) for b in runs]
+        blocks = [self._load(b, 0, block_rows) for b in runs]
+        keys = [_row_keys(rows) for rows in blocks]
+        active = list(range(len(runs)))
+        while active:
+            cutoff = min(keys[i][-1] for i in active)
+            parts = []
+            for i in active:
+                n = int(np.searchsorted(keys[i], cutoff, side='right'))
+                parts.append((keys[i][:n], blocks[i][:n], runs[i][0]))
+                blocks[i], keys[i] = blocks[i][n:], keys[i][n:]
+                if not len(blocks[i]) and loaded[i] < runs[i][3]:
+                    blocks[i] = self._load(runs[i], loaded[i], block_rows)
+                    keys[i] = _row_keys(blocks[i])
+                    loaded[i] += len(blocks[i])
+            active = [i for i in active if len(blocks[i])]
+            yield merge_rows(np.concatenate([k for k, _, _ in parts]),
+                        np.concatenate([r['origin'] for _, r, _ in parts]),
+                        np.concatenate([np.full(len(k), c, dtype=np.uint32)
+                                        for k, _, c in parts]), rule, nsets)
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+            os.remove(self._filename)
+
+
+def _read_rows(spill, mrt_file, record_filter=None, stats=None):
+    """Appends the prefixes of an MRT file to a _ColumnSpill"""
+    dumper = MRTDumper(mrt_file, workers=1, record_filter=record_filter)
+    try:
+        for prefix, length, asid in dumper.prefix_origins():
+            if length > 0:
+                spill.append(int.from_bytes(prefix, 'big'), length, asid)
+        spill.flush()
+        if stats is not None:
+            stats.update(dumper.get_stats())
+            stats['spilled_rows'] = spill.spilled_rows
+    finally:
+        dumper.close()
+
+
+def read_bounded(mrt_file, memory_budget=DEFAULT_MEMORY_BUDGET,
+                    spill_dir=None, record_filter=None, stats=None):
+    """Same as PrefixSet.from_mrt, keeping at most memory_budget bytes of
+    prefixes in memory, the rest is spilled to a file in spill_dir."""
+    spill = _ColumnSpill(memory_budget, spill_dir or tempfile.gettempdir(),
+                            f'{os.path.basename(mrt_file)}.{os.getpid()}')
+    _read_rows(spill, mrt_file, record_filter, stats)
+    return spill.to_prefix_set()
+
+
+def _merge_into(spill, rule, names, table, memory_budget):
+    table = PrefixSet().to_route_table(table)
+    total = [np.zeros(len(names), dtype=np.int64) for _ in range(3)]
+    nmerged = 0
+    for merged, counts in spill.merge_runs(rule, len(names), memory_budget):
+        merged.to_route_table(table)
+        nmerged += len(merged)
+        for t, c in zip(total, counts):
+            t += c
+    table.build()
+    return table, coverage_of(names, total, nmerged)
+
+
+def build_bounded(mrt_files, memory_budget=DEFAULT_MEMORY_BUDGET,
+                    spill_dir=None, rule='first', table=None):
+    """Reads the mrt_files one after the other, merges them (same as
+    ribmerge.merge_prefix_sets) and adds the prefixes to table (a RouteTable
+    or PoptrieTable, which is a lot smaller, see make_route_table) within a
+    memory budget. Returns (table, coverage, report), report is a list of
+    StageMemory (peak RSS, time and RSS at the start) of every stage.
+
+    While reading, prefixes are collected in sorted runs, kept in memory up
+    to half of the budget and spilled to a file in spill_dir beyond that.
+    The runs are merged a block at a time (the other half of the budget)
+    and every merged block is added to the table right away. The budget is
+    for the prefixes being read and merged, the table itself (the result)
+    grows with the number of routes."""
+    if rule not in MERGE_RULES:
+        raise InvalidMergeRuleErr(rule)
+    own_dir = spill_dir is None
+    if own_dir:
+        spill_dir = tempfile.mkdtemp(prefix='ingest-')
+    names = [os.path.basename(f) for f in mrt_files]
+    spill = _ColumnSpill(memory_budget // 2, spill_dir,
+                            f'runs.{os.getpid()}', runs=True)
+    report = []
+    try:
+        for i, f in enumerate(mrt_files):
+            spill.collector = i
+            _run_stage(report, f'read {names[i]}', _read_rows, spill, f)
+        table, coverage = _run_stage(report, 'merge and build', _merge_into,
+                                spill, rule, names, table, memory_budget // 2)
+    finally:
+        spill.close()
+        if own_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    return table, coverage, report
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    if sys.argv[1] == '--budget':
+        from ipv4_routing_table import make_route_table
+
+        # ingest.py --budget MB engine rib [rib ...]
+        table, coverage, report = build_bounded(sys.argv[4:],
+                    int(sys.argv[2]) << 20, table=make_route_table(sys.argv[3]))
+        for stage in report:
+            print(f"{stage.stage}: peak RSS {stage.peak_rss >> 20} MB "
+                    f"(+{(stage.peak_rss - stage.start_rss) >> 20} MB), "
+                    f"{stage.seconds:.1f}s")
+        print(f"Table: {table.memory() >> 20} MB")
+        sys.exit()
+
+    # ingest.py checkpoint_dir rib [rib ...] (run again to resume)
+    then = dt.now()
+    merged, coverage = ingest(sys.argv[2:], sys.argv[1])
+    print(f"Merged {len(merged)} prefixes in {dt.now() - then}")
+    for c in coverage:
+        print(f"{c.name}: prefixes:{c.prefixes}, unique:{c.unique}, "
+                f"selected:{c.selected}, coverage:{c.coverage:.2%}")
@@ -3,30 +3,25 @@
 #
 from datetime import datetime as dt
 
-from mrtdump import MRTDumper
 from asinformation import ASInformation
-from ipv4_routing_table import RouteTable
-from mrttypes import PeerIndexTable, RIBEntry
+from ribmerge import merge_ribs_to_table
+from ipv4_addresses import text_to_u32
+from bogons import AddressClassifier
+
+# RIBs from one or more collectors, the prefixes are merged
+RIB_FILES = ['rib.20230626.0400.bz2']
 
 a = ASInformation('20230701.as-org2info.txt.gz')
-r = RouteTable()
-dumper = MRTDumper('rib.20230626.0400.bz2')
 
-count = 0
 add_then = dt.now()
-for dump in dumper:
-    if type(dump) == PeerIndexTable:
-        dumper._peeridx_tbl = dump
-    if type(dump) == RIBEntry:
-        prefix, length, asid =  dump.get_prefix_length_dest_as()
-        if length > 0:
-            r.add(prefix, length, asid)
-    count += 1
-    if count % 1000 == 0:
-        pass #print(count, prefix, length, asid, r.rtentries_alloced)
+r, coverage = merge_ribs_to_table(RIB_FILES, rule='first')
+count = sum(c.prefixes for c in coverage)
 
 add_now = dt.now()
 print(f"Time Taken to insert {count} entries {add_now - add_then}")
+for c in coverage:
+    print(f"{c.name}: {c.prefixes} prefixes, {c.unique} unique, "
+            f"coverage {c.coverage:.2%}")
 
 print(r.lookup('123.252.240.140'))
 
@@ -1032,10 +1027,25 @@ ip_addresses = """231.231.100.42
 77.175.181.138
 42.249.255.211"""
 
-ips =  map(lambda x: x.strip(), ip_addresses.split())
 then = dt.now()
-for ip in ips:
-    r.lookup(ip.strip())
+ips, valid = text_to_u32(ip_addresses.encode())
+for ip in ips.tolist():
+    r.lookup_int(ip)
+now = dt.now()
+
+print(now-then)
+
+then = dt.now()
+ases = r.lookup_many(ips)
 now = dt.now()
 
 print(now-then)
+
+c = AddressClassifier(r)
+print(c.classify('231.231.100.42'), c.classify('10.115.242.147'))
+
+then = dt.now()
+codes, ases = c.classify_many(ips)
+now = dt.now()
+
+print(now-then, c.category_counts(codes))
@@ -0,0 +1,144 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Bulk conversion of IPv4 addresses to 32 bit integers (NumPy uint32 arrays).
+
+The conversions work on whole buffers at a time using NumPy, there are no per
+address python objects (strings, lists of octets etc.) created. The resulting
+arrays can be passed directly to RouteTable.lookup_many.
+"""
+
+import numpy as np
+
+_NL = ord('\n')
+_DOT = ord('.')
+_ZERO = ord('0')
+_SPACE = ord(' ')
+_TAB = ord('\t')
+_CR = ord('\r')
+_WHITESPACE = b' \t\r'
+_STRIP_STEPS = 8 # Blanks stripped at a time for all lines, see _strip
+_MAX_ADDRESS_LEN = 15 # 255.255.255.255
+
+
+def _strip(is_blank, starts, ends):
+    """Returns the starts and ends of lines without the leading and trailing
+    blanks (start == end for blank lines). A few blanks are stripped from all
+    the lines at once, the rare lines with more are stripped one by one."""
+    starts = starts.copy()
+    ends = ends.copy()
+    for pos, step in ((starts, 1), (ends, -1)):
+        at = pos if step > 0 else ends - 1
+        todo = np.flatnonzero((starts < ends) & is_blank[at])
+        for _ in range(_STRIP_STEPS):
+            if not len(todo):
+                break
+            pos[todo] += step
+            at = pos[todo] if step > 0 else pos[todo] - 1
+            todo = todo[(starts[todo] < ends[todo]) & is_blank[at]]
+        for i in todo.tolist():
+            text = np.flatnonzero(~is_blank[starts[i]:ends[i]])
+            if not len(text):
+                starts[i] = ends[i]
+            elif step > 0:
+                starts[i] += text[0]
+            else:
+                ends[i] = starts[i] + text[-1] + 1
+    return starts, ends
+
+
+def text_to_u32(buf):
+    """Converts a bytes like buffer of newline separated dotted quad IPv4
+    addresses to a uint32 array with one element per line.
+
+    Blanks, tabs and carriage returns around an address are ignored (a line
+    with blanks inside the address is not valid). Returns a tuple of
+    (addresses, valid) where valid is a boolean array that is False for lines
+    that are not valid IPv4 addresses (the corresponding address is 0).
+
+    Works on the whole buffer as a flat array of characters: lines with
+    exactly three dots (and nothing but digits otherwise) are candidates, the
+    dots and the line ends then give the last digit of every octet.
+    """
+    buf = bytes(buf)
+    blanks = any(c in buf for c in _WHITESPACE)
+    if buf and buf[-1] != _NL:
+        buf += b'\n'
+
+    # A newline in front, so that every line starts after a newline.
+    a = np.frombuffer(b'\n' + buf, dtype=np.uint8)
+    line_ends = np.flatnonzero(a == _NL)
+    nlines = len(line_ends) - 1
+    addrs = np.zeros(max(nlines, 0), dtype=np.uint32)
+    if nlines <= 0:
+        return addrs, np.zeros(0, dtype=bool)
+    starts = line_starts = line_ends[:-1] + 1
+    ends = line_ends = line_ends[1:]
+
+    digits = a - np.uint8(_ZERO) # wraps around for chars < '0'
+    is_dot = a == _DOT
+    is_bad = (digits > 9) & ~is_dot & (a != _NL)
+    if blanks:
+        # Lines are stripped, blanks inside a line make it invalid.
+        is_blank = (a == _SPACE) | (a == _TAB) | (a == _CR)
+        starts, ends = _strip(is_blank, starts, ends)
+        is_bad &= ~is_blank
+        inner = np.flatnonzero(is_blank)
+        line = np.searchsorted(line_ends, inner)
+        is_bad[inner[(inner >= starts[line]) & (inner < ends[line])]] = True
+    dots = np.flatnonzero(is_dot)
+    ndots = np.add.reduceat(is_dot.view(np.uint8), line_starts, dtype=np.int32)
+    valid = (ndots == 3) & (ends - starts <= _MAX_ADDRESS_LEN)
+    bad = np.flatnonzero(is_bad)
+    if len(bad):
+        valid[np.searchsorted(line_ends, bad)] = False
+
+    rows = np.flatnonzero(valid)
+    first_dot = (np.cumsum(ndots) - ndots)[rows]
+    d = dots[first_dot[:, None] + np.arange(3)]
+    field_starts = [starts[rows], d[:, 0] + 1, d[:, 1] + 1, d[:, 2] + 1]
+    field_ends = [d[:, 0], d[:, 1], d[:, 2], ends[rows]]
+    ok = np.ones(len(rows), dtype=bool)
+    addr = np.zeros(len(rows), dtype=np.uint32)
+    for octet, (begin, end) in enumerate(zip(field_starts, field_ends)):
+        ndigits = end - begin
+        ok &= (ndigits >= 1) & (ndigits <= 3)
+        # Digits before the start of the field are masked out.
+        value = digits[end - 1].astype(np.uint32)
+        value += digits[end - 2] * np.uint32(10) * (ndigits >= 2)
+        value += digits[end - 3] * np.uint32(100) * (ndigits >= 3)
+        ok &= value <= 255
+        addr |= value << np.uint32(8 * (3 - octet))
+
+    valid[rows] = ok
+    addrs[rows] = np.where(ok, addr, 0)
+    return addrs, valid
+
+
+def packed_to_u32(buf):
+    """Converts a buffer of 4 byte packed (network byte order) addresses to a
+    uint32 array."""
+    return np.frombuffer(buf, dtype='>u4').astype(np.uint32)
+
+
+def text_to_ints(values):
+    """Converts a list of byte strings of (decimal) numbers to an int64 array.
+    Returns a tuple of (numbers, valid) where valid is False for the strings
+    that are not numbers (the corresponding number is 0)."""
+    try:
+        return np.array(values, dtype='S').astype(np.int64), \
+                np.ones(len(values), dtype=bool)
+    except ValueError:
+        valid = np.array([v.strip().lstrip(b'-').isdigit() for v in values],
+                            dtype=bool)
+        ints = [int(v) if ok else 0 for v, ok in zip(values, valid.tolist())]
+        return np.array(ints, dtype=np.int64), valid
+
+
+def u32_to_text(addrs):
+    """Converts an array of addresses back to a list of dotted quad strings.
+    (Mainly useful for printing results.)"""
+    addrs = np.asarray(addrs, dtype=np.uint32)
+    octets = addrs.astype('>u4').view(np.uint8).reshape(-1, 4)
+    return ['%d.%d.%d.%d' % tuple(o) for o in octets.tolist()]
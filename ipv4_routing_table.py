@@ -19,6 +19,10 @@ Second level is a list of 256 entries for each of the 'third' octet
 Third level is a list of 16 entries for the higher nibble of the last octet
 Final level is a list of 16 entries for the lower nibble of the last octet.
 
+This is the default layout (strides 16-8-4-4), the number of levels and the
+bits looked up at each of them can be chosen when creating the table (see
+stride_layout.py for picking one for a given set of prefixes).
+
 Each Entry looks like following
  - final (there's a routing prefix corresponding to this entry)
  - children (empty or a table of entries)
@@ -62,16 +66,135 @@ Now when we want to populate 12.0 (a lesser prefix), when we encounter
 we'd not overwrite the entry
 """
 
-from socket import inet_aton
+from socket import inet_aton, inet_ntoa
 import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import functools
+import itertools
+
+import lookupkernel
 
 RouteEntryNP = np.dtype([('final', 'u1'), ('prefix_len', 'u1'),
                             ('output_idx', '>u4'), ('children', 'O')])
 
 empty_entry = np.zeros(1, RouteEntryNP)
 
+# Bits looked up at every level: 16 + 8 + 4 + 4
+DEFAULT_STRIDES = (16, 8, 4, 4)
+
+MIN_THREAD_CHUNK = 1 << 16 # Smaller chunks are not worth a thread
+
+
+def lookup_in_threads(lookup, ips, threads):
+    """ Splits the array ips into chunks, one per thread, and returns the
+    concatenated results of lookup (a function returning an array of output
+    Indices for an array of addresses) run on the chunks on a thread pool.
+    lookup should release the GIL (NumPy operations or the compiled kernel,
+    see lookupkernel.py) for the threads to run in parallel."""
+    if threads is not None and len(ips) < threads * MIN_THREAD_CHUNK:
+        threads = len(ips) // MIN_THREAD_CHUNK
+    if not threads or threads <= 1:
+        return lookup(ips)
+    chunks = np.array_split(ips, threads)
+    with ThreadPoolExecutor(threads) as pool:
+        return np.concatenate(list(pool.map(lookup, chunks)))
+
+
+def flatten_tables(tables, nlevels):
+    """ Returns the sub-tables of the first level (and all their children) as
+    flat arrays, see RouteTable.flatten"""
+    flat = []
+    for level in range(nlevels):
+        next_tables = []
+        children = []
+        for tbl in tables:
+            c = np.full(len(tbl), -1, dtype=np.int64)
+            for i, child in enumerate(tbl['children'].tolist()):
+                if isinstance(child, np.ndarray):
+                    c[i] = len(next_tables)
+                    next_tables.append(child)
+            children.append(c)
+        if tables:
+            final = np.concatenate([t['final'] for t in tables])
+            prefix_len = np.concatenate([t['prefix_len'] for t in tables])
+            output_idx = np.concatenate([t['output_idx'] for t in tables])
+            children = np.concatenate(children)
+        else:
+            final = np.zeros(0, np.uint8)
+            prefix_len = np.zeros(0, np.uint8)
+            output_idx = np.zeros(0, np.uint32)
+            children = np.zeros(0, np.int64)
+        flat.append((final, prefix_len, output_idx.astype(np.uint32),
+                        children))
+        tables = next_tables
+    return flat
+
+
+def lookup_flat_numpy(flat, levels, table_sizes, ips, idx):
+    """ Longest prefix match of an array of addresses on flat arrays (see
+    RouteTable.flatten), idx is the index of every address in the first level
+    arrays. Returns output Indices (-1 where there's no match) and the levels
+    at which lookups stopped."""
+    result = np.full(len(ips), -1, dtype=np.int64)
+    depth = np.zeros(len(ips), dtype=np.int64)
+    where = np.arange(len(ips))
+    for level, (final, _, output_idx, children) in enumerate(flat):
+        f = final[idx] == 1
+        result[where[f]] = output_idx[idx[f]]
+        if level + 1 == len(flat):
+            break
+        child = children[idx]
+        more = child >= 0
+        where = where[more]
+        depth[where] = level + 1
+        shift = np.uint32(32 - levels[level+1])
+        mask = np.uint32(table_sizes[level+1] - 1)
+        idx = child[more] * table_sizes[level+1] + \
+                ((ips[where] >> shift) & mask)
+        if not len(idx):
+            break
+    return result, depth
+
+
+def ip_to_int(ip):
+    """ Returns an address given as a string or an integer as an integer"""
+    if isinstance(ip, str):
+        return struct.unpack('>I', inet_aton(ip))[0]
+    return int(ip)
+
+
+def find_keys(keys, wanted):
+    """ Returns positions of wanted in the sorted array keys and whether each
+    of them is there (the position of a missing one means nothing)."""
+    if not len(keys):
+        return np.zeros(len(wanted), dtype=np.int64), \
+                np.zeros(len(wanted), dtype=bool)
+    pos = np.searchsorted(keys, wanted)
+    pos[pos == len(keys)] = 0
+    return pos, keys[pos] == wanted
+
+
+def longest_match(keys, addrs, lengths):
+    """ Returns the index into keys (sorted prefix << 8 | length, see
+    PrefixSet.keys) of the longest prefix covering every address, only
+    prefixes of the given lengths are looked for. -1 where there's none."""
+    addrs = np.asarray(addrs, dtype=np.uint64)
+    match = np.full(len(addrs), -1, dtype=np.int64)
+    for l in sorted({int(l) for l in lengths}, reverse=True):
+        todo = np.flatnonzero(match < 0)
+        if not len(todo):
+            break
+        mask = np.uint64(((1 << l) - 1) << (32 - l))
+        pos, hit = find_keys(keys,
+                        ((addrs[todo] & mask) << np.uint64(8)) | np.uint64(l))
+        match[todo[hit]] = pos[hit]
+    return match
+
+
+class InvalidStridesErr(Exception):
+    pass
+
 class RouteEntry:
     def __init__(self, pre_len, final, output_idx):
         """Prefix Length of this Entry. Whether this entry is final or not and
@@ -102,143 +225,403 @@ class RouteEntry:
             s += repr(child)
         return s
 
+
+class RouteQueries:
+    """ Queries on the routes of a routing table, shared by RouteTable and
+    poptrie.PoptrieTable. They only need route_arrays (sorted by prefix and
+    then length) and lookup_many."""
+
+    def _range_of(self, prefix, length):
+        """ Returns first and last address (as int) of prefix/length"""
+        first = struct.unpack('>I', inet_aton(prefix))[0]
+        first &= ((1 << length) - 1) << (32 - length)
+        return first, first + (1 << (32 - length)) - 1
+
+    def covered_by(self, prefix, length):
+        """ Returns the routes equal to or more specific than prefix/length as
+        (prefixes, lengths, outputs) arrays."""
+        first, last = self._range_of(prefix, length)
+        prefixes, lengths, outputs = self.route_arrays()
+        begin = np.searchsorted(prefixes, first)
+        end = np.searchsorted(prefixes, last, side='right')
+        inside = begin + np.flatnonzero(lengths[begin:end] >= length)
+        return prefixes[inside], lengths[inside], outputs[inside]
+
+    def covering(self, prefix, length):
+        """ Returns the routes equal to or less specific than prefix/length,
+        as a list of (prefix, length, output) tuples, shortest first."""
+        first, _ = self._range_of(prefix, length)
+        prefixes, lengths, outputs = self.route_arrays()
+        result = []
+        if not len(prefixes):
+            return result
+        keys = (prefixes.astype(np.uint64) << np.uint64(8)) | lengths
+        l = np.arange(length + 1, dtype=np.uint64)
+        masks = ((np.uint64(1) << l) - np.uint64(1)) << (np.uint64(32) - l)
+        wanted = ((np.uint64(first) & masks) << np.uint64(8)) | l
+        pos, found = find_keys(keys, wanted)
+        for i in pos[found].tolist():
+            result.append((inet_ntoa(struct.pack('>I', int(prefixes[i]))),
+                            int(lengths[i]), int(outputs[i])))
+        return result
+
+    def cidr_segments(self, prefix, length):
+        """ Splits the address range of prefix/length into segments of
+        consecutive addresses that have the same longest prefix match.
+        Returns (first addresses, last addresses, outputs) arrays, output is
+        -1 for a segment without a route."""
+        first, last = self._range_of(prefix, length)
+        prefixes, lengths, _ = self.covered_by(prefix, length)
+        starts = prefixes.astype(np.uint64)
+        ends = starts + (np.uint64(1) << (np.uint64(32) - lengths))
+        bounds = np.unique(np.concatenate(([first], starts, ends)))
+        bounds = bounds[bounds <= last].astype(np.uint32)
+        outputs = self.lookup_many(bounds)
+        keep = np.ones(len(bounds), dtype=bool)
+        keep[1:] = outputs[1:] != outputs[:-1]
+        starts = bounds[keep]
+        lasts = np.append(starts[1:].astype(np.int64) - 1, last)
+        return starts, lasts.astype(np.uint32), outputs[keep]
+
+
 # The class below is deprecated, but still is here for reference which depicts
 # basic structre. Numpy 'dtype' RouteEntryNP does exactly the same
-class RouteTable:
-    def __init__(self, filename=None):
-        self.table_sizes = [ 1 << 16, 1 << 8, 1 << 4, 1 << 4]
-        self.levels = [16, 24, 28, 32]
+class RouteTable(RouteQueries):
+    def __init__(self, filename=None, strides=DEFAULT_STRIDES):
+        """ strides : Number of address bits looked up at every level (they
+        should add up to 32), eg. (24, 8) for at most two lookups per
+        address or (16, 4, 4, 4, 4) for smaller tables. Ignored when loading
+        a table from filename, the saved layout is used."""
+        self._set_strides(strides)
+        self._flat = None
+        self._routes = None
+        self._cache = None
         if filename is None:
             self.level0_table = np.zeros(self.table_sizes[0], RouteEntryNP)
             self.rtentries_alloced = 0
             self.rtentries_alloced += self.table_sizes[0]
         else:
             self._load_table(filename)
-            # FIXME : Get this right
-            self.rtentries_alloced = 0
 
         #for i in range(self.table_sizes[0]):
             #self.level0_table.append(RouteEntry(0,0,0))
 
+    def _set_strides(self, strides):
+        strides = [int(x) for x in strides]
+        if not strides or sum(strides) != 32 or min(strides) < 1:
+            raise InvalidStridesErr(f'Strides should add up to 32: {strides}')
+        self.strides = strides
+        self.table_sizes = [1 << x for x in strides]
+        self.levels = list(itertools.accumulate(strides))
+
     def lookup(self, ip_address):
         """ Looks up an IP address and returns an output Index"""
-        ip_arr = [x for x in inet_aton(ip_address)]
+        return self.lookup_int(struct.unpack('>I', inet_aton(ip_address))[0])
+
+    def lookup_packed(self, packed):
+        """ Looks up a 4 byte packed (network byte order) IP address."""
+        return self.lookup_int(int.from_bytes(packed, 'big'))
+
+    def lookup_int(self, ip):
+        """ Looks up an IP address given as a 32 bit integer and returns an
+        output Index (None if there's no matching prefix)"""
+        if self._cache is not None:
+            return self._cached_lookup(ip)
+        return self._lookup_int(ip)[0]
+
+    def _lookup_int(self, ip):
+        """ Returns the output Index and the level at which lookup stopped"""
         match = None
         tbl = self.level0_table
-        for i, level in enumerate(self.levels):
-            idx, _ = self._idx_from_tuple(ip_arr, 32, i)
-            entry = tbl[idx]
-            if entry['final'] == 1:
-                match = entry['output_idx']
-            try:
-                if entry['children'] != 0:
-                    tbl = entry['children']
-            except:
-                tbl = entry['children']
-            else:
+        for level, (bits, table_size) in enumerate(zip(self.levels,
+                                                        self.table_sizes)):
+            idx = (ip >> (32 - bits)) & (table_size - 1)
+            final, _, output_idx, children = tbl[idx].item()
+            if final == 1:
+                match = output_idx
+            if not isinstance(children, np.ndarray):
                 break
+            tbl = children
+        return match, level
+
+    def lookup_many(self, ips, dedupe=False, threads=None):
+        """ Looks up an array of IP addresses (32 bit integers, see
+        ipv4_addresses.py for converting from text) and returns an int64
+        array of output Indices, -1 where there's no matching prefix.
+
+        Lookups are done on the flattened table (see flatten), every level is
+        looked up for all the addresses at once.
+
+        If dedupe is True or the lookup cache is enabled, repeated addresses
+        in the batch are looked up only once.
+
+        If threads is given, the batch is split into that many chunks looked
+        up on a thread pool (see lookup_in_threads). The lookup cache is not
+        shared between threads, lookups with the cache enabled run in the
+        calling thread."""
+        ips = np.asarray(ips, dtype=np.uint32)
+        if self._cache is None and not dedupe:
+            return self._lookup_many_threads(ips, threads)
+
+        uniq, inverse = np.unique(ips, return_inverse=True)
+        if self._cache is not None:
+            result = self._cached_lookup_many(uniq)
+        else:
+            result = self._lookup_many_threads(uniq, threads)
+        return result[inverse.ravel()]
+
+    def _lookup_many_threads(self, ips, threads):
+        self.flatten() # Once, before the threads
+        return lookup_in_threads(lambda chunk: self._lookup_many(chunk)[0],
+                                    ips, threads)
+
+    def _lookup_many(self, ips):
+        """ Returns output Indices and the levels at which lookups stopped.
+        Uses the compiled kernel (see lookupkernel.py) when it's built."""
+        if lookupkernel.available():
+            return lookupkernel.lookup_flat(self.flatten(), self.levels,
+                                            self.strides, ips)
+        return self._lookup_many_numpy(ips)
+
+    def _lookup_many_numpy(self, ips):
+        idx = (ips >> np.uint32(32 - self.levels[0])).astype(np.int64)
+        return lookup_flat_numpy(self.flatten(), self.levels, self.table_sizes,
+                                    ips, idx)
+
+    def enable_cache(self, size=1 << 16):
+        """ Enables an LRU cache of lookup results in front of lookup_int (and
+        hence lookup) and lookup_many, holding at most size results.
+
+        A result is cached for the /24 of the address, if the lookup doesn't
+        need more than 24 bits of the address, otherwise for the address
+        itself. Cached results are invalidated by add and delete."""
+        self._cache = OrderedDict()
+        self._cache_size = size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def disable_cache(self):
+        self._cache = None
+
+    def cache_stats(self):
+        """ Returns a dictionary of cache hits, misses, hit rate and size."""
+        lookups = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits, 'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+                'size': len(self._cache) if self._cache is not None else 0}
+
+    def _cache_key(self, ip, level):
+        if self.levels[level] <= 24:
+            return ip >> 8
+        return ip | (1 << 32)
+
+    def _cache_get(self, ip):
+        """ Returns (found, output Index) from the cache"""
+        cache = self._cache
+        for key in (ip >> 8, ip | (1 << 32)):
+            if key in cache:
+                cache.move_to_end(key)
+                self.cache_hits += 1
+                return True, cache[key]
+        self.cache_misses += 1
+        return False, None
+
+    def _cache_put(self, ip, level, match):
+        cache = self._cache
+        cache[self._cache_key(ip, level)] = match
+        if len(cache) > self._cache_size:
+            cache.popitem(last=False)
+
+    def _cached_lookup(self, ip):
+        found, match = self._cache_get(ip)
+        if found:
+            return match
+        match, level = self._lookup_int(ip)
+        self._cache_put(ip, level, match)
         return match
 
+    def _cached_lookup_many(self, ips):
+        result = np.empty(len(ips), dtype=np.int64)
+        misses = []
+        for i, ip in enumerate(ips.tolist()):
+            found, match = self._cache_get(ip)
+            if found:
+                result[i] = -1 if match is None else match
+            else:
+                misses.append(i)
+        if misses:
+            misses = np.array(misses)
+            matches, levels = self._lookup_many(ips[misses])
+            result[misses] = matches
+            for ip, level, match in zip(ips[misses].tolist(), levels.tolist(),
+                                        matches.tolist()):
+                self._cache_put(ip, level, None if match < 0 else match)
+        return result
+
+    def _invalidate_cache(self, prefix, length):
+        """ Removes all cached results for addresses in prefix/length"""
+        if not self._cache:
+            return
+        p = struct.unpack('>I', inet_aton(prefix))[0]
+        lo = p & (((1 << length) - 1) << (32 - length))
+        hi = lo + (1 << (32 - length)) - 1
+        lo24, hi24 = lo >> 8, hi >> 8
+        lo32, hi32 = lo | (1 << 32), hi | (1 << 32)
+        cache = self._cache
+        if (hi24 - lo24) + (hi - lo) + 2 <= len(cache):
+            for key in range(lo24, hi24 + 1):
+                cache.pop(key, None)
+            for key in range(lo32, hi32 + 1):
+                cache.pop(key, None)
+        else:
+            stale = [k for k in cache if lo24 <= k <= hi24 or
+                                            lo32 <= k <= hi32]
+            for key in stale:
+                del cache[key]
+
+    def build(self):
+        """ Flattens the table now (see flatten) instead of at the first
+        lookup_many, the table itself is built by add. Returns the flattened
+        table."""
+        return self.flatten()
+
+    def flatten(self):
+        """ Returns the table as flat arrays, one tuple of (final, prefix_len,
+        output_idx, children) arrays per level. All the sub-tables of a level are
+        concatenated, children is the number of the child table in the next
+        level (-1 for none).
+
+        The flattened table is cached till the next add or delete."""
+        if self._flat is None:
+            self._flat = flatten_tables([self.level0_table], len(self.levels))
+        return self._flat
+
+    def route_arrays(self):
+        """ Returns all the routes in the table as (prefixes, lengths,
+        outputs) arrays, sorted by prefix and then length.
+
+        The routes are recovered from the entries of the flattened table, so
+        a prefix whose entries are all overwritten by longer prefixes of the
+        same level (eg. a /23 with both of its /24s in the table) is not
+        returned, it would never be the result of a lookup anyway."""
+        if self._routes is not None:
+            return self._routes
+        keys = []
+        outputs = []
+        bases = np.arange(self.table_sizes[0], dtype=np.uint64) << \
+                np.uint64(32 - self.levels[0])
+        for level, (final, prefix_len, output_idx, children) in \
+                enumerate(self.flatten()):
+            f = np.flatnonzero(final == 1)
+            lens = prefix_len[f].astype(np.uint64)
+            masks = ((np.uint64(1) << lens) - np.uint64(1)) << \
+                    (np.uint64(32) - lens)
+            keys.append(((bases[f] & masks) << np.uint64(8)) | lens)
+            outputs.append(output_idx[f])
+            if level + 1 == len(self.levels):
+                break
+            # Base address of every entry of the next level
+            parents = np.flatnonzero(children >= 0)
+            table_bases = np.zeros(len(parents), dtype=np.uint64)
+            table_bases[children[parents]] = bases[parents]
+            size = self.table_sizes[level+1]
+            bases = (np.repeat(table_bases, size).reshape(-1, size) +
+                    (np.arange(size, dtype=np.uint64) <<
+                        np.uint64(32 - self.levels[level+1]))).ravel()
+        keys, first = np.unique(np.concatenate(keys), return_index=True)
+        outputs = np.concatenate(outputs)[first]
+        self._routes = ((keys >> np.uint64(8)).astype(np.uint32),
+                        (keys & np.uint64(0xFF)).astype(np.uint8), outputs)
+        return self._routes
+
+    def routes(self):
+        """ Iterates over all (prefix, length, output) routes in the table
+        (see route_arrays)."""
+        prefixes, lengths, outputs = self.route_arrays()
+        for p, l, o in zip(prefixes.tolist(), lengths.tolist(),
+                            outputs.tolist()):
+            yield inet_ntoa(struct.pack('>I', p)), l, o
+
+    def to_prefix_set(self):
+        """ Returns the routes in the table as a PrefixSet"""
+        from prefixset import PrefixSet
+
+        return PrefixSet(*self.route_arrays())
+
     def add(self, prefix, length, dest_idx):
         """ Adds a prefix to routing table."""
+        self._flat = None
+        self._routes = None
+        self._invalidate_cache(prefix, length)
 
-        #print(f"prefix: {prefix}, length: {length}")
-        prefix_arr = [x for x in inet_aton(prefix)]
-        #print(f"prefix_arr: {prefix_arr}")
-        level = 0
+        prefix = struct.unpack('>I', inet_aton(prefix))[0]
         tbl = self.level0_table
-        while level < len(self.levels):
-            idx_base, span = self._idx_from_tuple(prefix_arr,
-                                                    length, level)
-
-            lvl_prelen = self.levels[level]
-            tblsz = self.table_sizes[level]
-            nxtsz = self.table_sizes[level+1] if level < 3 else 0
-            i = 0
-            while i < span:
-                assert tbl is not None
-                entry = tbl[idx_base+i]
-                #entry.table_idx = idx_base + i
-                #entry.table_level = level
-                if length <= lvl_prelen:
-                    #entry.entry = struct.pack('>BBI', True, length, dest_idx)
-                    entry['final'] = 1
-                    entry['prefix_len'] = length
-                    entry['output_idx'] = dest_idx
-                else:
-                    try:
-                        if entry['children'] != 0:
-                            break
-                    except:
-                        break
-                    tbl = np.zeros(nxtsz, RouteEntryNP)
-                    self.rtentries_alloced += nxtsz
-                    entry['children'] = tbl
-                #print(f"entry:{entry}, idx_base: {idx_base}, i: {i}")
-                i += 1
-            if lvl_prelen >= length: # Break from outer loop
+        for level, lvl_prelen in enumerate(self.levels):
+            idx_base, span = self._idx_from_prefix(prefix, length, level)
+            if length <= lvl_prelen:
+                entries = tbl[idx_base:idx_base+span]
+                # Don't overwrite a longer prefix learnt earlier
+                update = (entries['final'] == 0) | \
+                            (entries['prefix_len'] <= length)
+                entries['final'][update] = 1
+                entries['prefix_len'][update] = length
+                entries['output_idx'][update] = dest_idx
                 break
-            level += 1
-            tbl = entry['children']
+            entry = tbl[idx_base]
+            children = entry['children']
+            if not isinstance(children, np.ndarray):
+                nxtsz = self.table_sizes[level+1]
+                children = np.zeros(nxtsz, RouteEntryNP)
+                self.rtentries_alloced += nxtsz
+                entry['children'] = children
+            tbl = children
 
     def delete(self, prefix, length):
-        "Deletes an entry in the routing table."
-        prefix_arr = [x for x in inet_aton(prefix)]
-        level = 0
+        """Deletes an entry in the routing table.
+        Only the entries filled by this prefix are cleared. If a shorter prefix
+        of the same level (eg. a /17 for a /18) covers the deleted prefix, it
+        needs to be added again to fill the entries."""
+        self._flat = None
+        self._routes = None
+        self._invalidate_cache(prefix, length)
+
+        prefix = struct.unpack('>I', inet_aton(prefix))[0]
         tbl = self.level0_table
-        while level < len(self.levels):
-            idx_base, span = self._idx_from_tuple(prefix_arr,
-                                                    length, level)
-
-            lvl_prelen = self.levels[level]
-            tblsz = self.table_sizes[level]
-            nxtsz = self.table_sizes[level+1] if level < 3 else 0
-            i = 0
-            while i < span:
-                entry = tbl[idx_base+i]
-                if length <= lvl_prelen:
-                    #entry.entry = struct.pack('>BBI', False, 0, 0)
-                    entry['final'] = 0
-                    entry['prefix_len'] = 0
-                    entry['output_idx'] = 0
-                else:
-                    tbl = entry['children']
-                # FIXME : Add code to delete the entry.children
-                # if occupation of table is zero
-                i += 1
-            level += 1
-
-    def _idx_from_tuple(self, prefix_arr, prelen, level):
-        _levels = [16, 24, 28, 32]
-        _level_edges = [(0,2),(2,3), (3,4), (3,4)]
-        begin, end = _level_edges[level]
-        leveloff = _levels[level]
-
-        # TODO: Make sure pre_arr respects prefix length
-        # For example r.add('12.128.0.0/8') should really not care about the
-        # second octet
+        for level, lvl_prelen in enumerate(self.levels):
+            idx_base, span = self._idx_from_prefix(prefix, length, level)
+            if length > lvl_prelen:
+                children = tbl[idx_base]['children']
+                if not isinstance(children, np.ndarray):
+                    return # No such prefix
+                tbl = children
+                continue
+            entries = tbl[idx_base:idx_base+span]
+            clear = (entries['final'] == 1) & (entries['prefix_len'] == length)
+            entries['final'][clear] = 0
+            entries['prefix_len'][clear] = 0
+            entries['output_idx'][clear] = 0
+            # FIXME : Add code to delete the entry.children
+            # if occupation of table is zero
+            break
+
+    def _idx_from_prefix(self, prefix, prelen, level):
+        """ Returns index of the first entry for the prefix (an int) in the
+        table of the given level and the number of entries it spans."""
+        leveloff = self.levels[level]
         if prelen > leveloff:
             span = 1
         else:
             span = 1 << (leveloff - prelen)
-        prefix_arr = prefix_arr[begin:end][::-1]
-        idx = functools.reduce(lambda x,y: x + ((1 << (8*y[0])) * y[1]),
-                        enumerate(prefix_arr), 0)
-        #print(f"prefix_arr: {prefix_arr}, "\
-                #f"prefix_length: {prelen}, level: {level}")
-        x = 0
-        for a,b in enumerate(prefix_arr):
-            #print(f"x : {x}, a: {a}, b : {b}")
-            c = (1 << (8*a)) * b
-            x = x + c
-        #print(f"idx: {idx}, x: {x}, "\
-                #f"prefix_length: {prelen}, span: {span}")
-        if level == 2:
-            idx = idx >> 4
-        if level == 3:
-            idx = idx & 0x0F
+            # Host bits of the prefix are not looked at
+            prefix &= ~((1 << (32 - prelen)) - 1) & 0xFFFFFFFF
+        idx = (prefix >> (32 - leveloff)) & (self.table_sizes[level] - 1)
         return idx, span
 
+    def memory(self):
+        """ Returns bytes used by the table entries (sub-table array headers
+        and the flattened copy are not counted)"""
+        return int(self.rtentries_alloced) * RouteEntryNP.itemsize
+
     def print_entry(self, entry, tblidx, level):
         try:
             has_children = entry['children'] != 0
@@ -256,15 +639,70 @@ class RouteTable:
             self.print_entry(entry, i, 0)
 
     def save_table(self, filename):
+        """ Saves the flattened table (see flatten), so that loading doesn't
+        need to unpickle every sub-table."""
         allocced = np.zeros(1, '>u4')
         allocced[0] = self.rtentries_alloced
+        arrays = {}
+        for level, arrs in enumerate(self.flatten()):
+            for name, arr in zip(('final', 'prefix_len', 'output_idx',
+                                    'children'), arrs):
+                arrays[f'{name}{level}'] = arr
         with open(filename, 'wb+') as f:
-            np.savez(f, allocced=allocced, tbl0=self.level0_table)
+            np.savez(f, allocced=allocced, strides=np.array(self.strides),
+                        levels=np.array(self.levels),
+                        table_sizes=np.array(self.table_sizes), **arrays)
 
     def _load_table(self, filename):
         x = np.load(filename)
-        self.level0_table = x['tbl0']
-        self.rtentries_alloced = x['allocced'][0]
+        if 'tbl0' in x:
+            # Older format, table saved as is.
+            x = np.load(filename, allow_pickle=True)
+            self._set_strides(DEFAULT_STRIDES)
+            self.level0_table = x['tbl0']
+            self.rtentries_alloced = x['allocced'][0]
+            return
+
+        if 'strides' in x:
+            self._set_strides(x['strides'].tolist())
+        else:
+            self._set_strides(np.diff(x['levels'], prepend=0).tolist())
+        flat = []
+        for level in range(len(self.levels)):
+            flat.append(tuple(x[f'{name}{level}'] for name in
+                        ('final', 'prefix_len', 'output_idx', 'children')))
+
+        # Rebuild the sub-tables as views of one array per level.
+        tables = None
+        for level in reversed(range(len(self.levels))):
+            final, prefix_len, output_idx, children = flat[level]
+            big = np.zeros(len(final), RouteEntryNP)
+            big['final'] = final
+            big['prefix_len'] = prefix_len
+            big['output_idx'] = output_idx
+            for idx in np.flatnonzero(children >= 0).tolist():
+                big['children'][idx] = tables[children[idx]]
+            size = self.table_sizes[level]
+            tables = [big[i:i+size] for i in range(0, len(big), size)]
+        self.level0_table = tables[0]
+        self.rtentries_alloced = int(x['allocced'][0])
+        self._flat = flat
+
+
+ENGINES = ('multibit', 'poptrie')
+
+def make_route_table(engine='multibit', filename=None, **kwargs):
+    """ Returns an (empty or loaded from filename) routing table of the given
+    engine - 'multibit' (RouteTable) or 'poptrie' (poptrie.PoptrieTable).
+    Both have the same add, delete, lookup, lookup_many and RouteQueries
+    interface (see poptrie.py for what PoptrieTable does not support)."""
+    if engine == 'multibit':
+        return RouteTable(filename, **kwargs)
+    if engine == 'poptrie':
+        from poptrie import PoptrieTable
+
+        return PoptrieTable(filename, **kwargs)
+    raise ValueError(f'Unknown engine: {engine}, should be one of {ENGINES}')
 
 if __name__ == '__main__':
     r = RouteTable()
@@ -278,6 +716,10 @@ if __name__ == '__main__':
     print("lookup: 12.0.1.1", r.lookup('12.0.1.1'))
     print("lookup: 12.129.1.1", r.lookup('12.129.1.1'))
     print("lookup: 12.127.10.1", r.lookup('12.127.10.1'))
+    print("lookup_many:", r.lookup_many([0x0C000101, 0x0C810101, 0x0C7F0A01]))
+    print("routes:", list(r.routes()))
+    print("covering 12.127.10.0/26:", r.covering('12.127.10.0', 26))
+    print("segments 12.127.0.0/16:", r.cidr_segments('12.127.0.0', 16))
     #r.add('12.0.1.0', 24, 2001)
     #r.add('12.0.2.16', 28, 2004)
     #r.add('12.0.2.0', 24, 2005)
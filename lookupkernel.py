@@ -0,0 +1,127 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Optional compiled lookup kernel for RouteTable.lookup_many.
+
+_lookupkernel.c walks the flattened table (see RouteTable.flatten) one
+address at a time in C. It's loaded with ctypes (no build system needed, the
+shared library is built with the C compiler by 'python lookupkernel.py
+build') and ctypes releases the GIL during the call, so batches can be looked
+up from several threads.
+
+When the library isn't built (or can't be loaded) RouteTable falls back to
+the NumPy implementation, which gives the same results. Set IPGIRI_NO_KERNEL
+in the environment to not load it.
+
+'python lookupkernel.py check' compares both on a random table (and times
+them), test_lookupkernel.py compares them on random tables of several stride
+layouts.
+"""
+
+import ctypes
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(_DIR, '_lookupkernel.c')
+LIBRARY = os.path.join(_DIR, '_lookupkernel.so')
+
+_u8p = ctypes.POINTER(ctypes.c_uint8)
+_u32p = ctypes.POINTER(ctypes.c_uint32)
+_i32p = ctypes.POINTER(ctypes.c_int32)
+_i64p = ctypes.POINTER(ctypes.c_int64)
+
+
+def build(cc=None):
+    """ Compiles the kernel, returns True if it's loaded"""
+    cc = cc or os.environ.get('CC', 'cc')
+    subprocess.check_call([cc, '-O3', '-shared', '-fPIC', '-o', LIBRARY,
+                            SOURCE])
+    return _load() is not None
+
+
+def _load():
+    global _lib
+    _lib = None
+    if os.environ.get('IPGIRI_NO_KERNEL') or not os.path.exists(LIBRARY):
+        return None
+    try:
+        lib = ctypes.CDLL(LIBRARY)
+    except OSError:
+        return None
+    lib.lookup_flat.restype = None
+    lib.lookup_flat.argtypes = [ctypes.c_int, _i32p, _i32p,
+                                ctypes.POINTER(_u8p), ctypes.POINTER(_u32p),
+                                ctypes.POINTER(_i64p), _u32p, ctypes.c_int64,
+                                _i64p, _i64p]
+    _lib = lib
+    return lib
+
+
+def available():
+    return _lib is not None
+
+
+def _ptrs(arrays, ptype):
+    return (ptype * len(arrays))(*[a.ctypes.data_as(ptype) for a in arrays])
+
+
+def lookup_flat(flat, levels, strides, ips, depth=True):
+    """ Same as RouteTable._lookup_many, on the flattened table flat (see
+    RouteTable.flatten). Returns (output Indices, depths) - depths is None if
+    depth is False."""
+    ips = np.ascontiguousarray(ips, dtype=np.uint32)
+    result = np.empty(len(ips), dtype=np.int64)
+    depths = np.empty(len(ips), dtype=np.int64) if depth else None
+    final = [np.ascontiguousarray(f) for f, _, _, _ in flat]
+    output_idx = [np.ascontiguousarray(o, dtype=np.uint32)
+                    for _, _, o, _ in flat]
+    children = [np.ascontiguousarray(c, dtype=np.int64) for _, _, _, c in flat]
+    levels = np.ascontiguousarray(levels, dtype=np.int32)
+    strides = np.ascontiguousarray(strides, dtype=np.int32)
+    _lib.lookup_flat(len(flat), levels.ctypes.data_as(_i32p),
+                    strides.ctypes.data_as(_i32p), _ptrs(final, _u8p),
+                    _ptrs(output_idx, _u32p), _ptrs(children, _i64p),
+                    ips.ctypes.data_as(_u32p), len(ips),
+                    result.ctypes.data_as(_i64p),
+                    depths.ctypes.data_as(_i64p) if depth else None)
+    return result, depths
+
+
+_lib = None
+_load()
+
+
+if __name__ == '__main__':
+    from datetime import datetime as dt
+
+    from benchmark import random_prefix_set, random_addresses
+    from ipv4_routing_table import RouteTable
+
+    # lookupkernel.py build|check
+    if 'build' in sys.argv[1:]:
+        print(f"Built {LIBRARY}: {build()}")
+    if 'check' in sys.argv[1:]:
+        if not available():
+            sys.exit(f"{LIBRARY} not built (python lookupkernel.py build)")
+        for strides in ((16, 8, 4, 4), (24, 8), (16, 4, 4, 4, 4)):
+            table = random_prefix_set(50000, 1).to_route_table(
+                                                    RouteTable(strides=strides))
+            ips = random_addresses(1 << 20, 2)
+            table.flatten()
+            then = dt.now()
+            expected = table._lookup_many_numpy(ips)
+            numpy_time = dt.now() - then
+            then = dt.now()
+            result = lookup_flat(table.flatten(), table.levels,
+                                    table.strides, ips)
+            kernel_time = dt.now() - then
+            same = all((a == b).all() for a, b in zip(expected, result))
+            print(f"strides {strides}: {'same' if same else 'DIFFERENT'} "
+                    f"results, numpy {numpy_time}, kernel {kernel_time}")
+            if not same:
+                sys.exit(1)
@@ -8,24 +8,31 @@ Format of the MRT file is described in rfc6396
 (http://tools.ietf.org/html/rfc6396)
 
 It's an implementation of mrtdump.pl (ADD URL HERE)
-Supports TABLE_DUMP (Type 12, Subtype 1) and TABLE_DUMP_V2 (Type 13, Subtype 2)
+Supports TABLE_DUMP (Type 12) and TABLE_DUMP_V2 (Type 13), see mrttypes.py
+for the supported subtypes.
 """
 
 import struct
 from collections import namedtuple
+import ipaddress
 import os
 
-from gzip import GzipFile
-from bz2 import BZ2File
+import numpy as np
 
-from mrttypes import read_mrt_entry
-from mrttypes import PeerIndexTable, RIBEntry
+from decompress import open_stream, stream_error
+
+from mrttypes import read_mrt_entry, read_prefix_origin, read_rib_prefix
+from mrttypes import PeerIndexTable, RIBEntry, InvalidMRTEntryErr
+from mrttypes import AFI_IPV4, AFI_IPV6, SAFI_UNICAST, RIB_HEAD_LENGTH
 
 
 MRTHeader = namedtuple('MRTHeader', ['ts', 'type', 'subtype', 'length'])
 MRT_HEADER_LENGTH = 12
 _MRT_HDR_PACKSTR = '>IHHI'
 _KNOWN_MRT_TYPES = (11, 12, 13, 16, 17, 32, 33, 48, 49)
+MAX_RECORD_LENGTH = 1 << 24 # Longer records are taken to be corrupt
+RESYNC_WINDOW = 1 << 16 # Bytes read at a time while resynchronising
+_MAX_TS_GAP = 30 * 86400 # Of consecutive records, while resynchronising
 
 class MRTFileNotFoundErr(Exception):
     pass
@@ -33,49 +40,347 @@ class MRTFileNotFoundErr(Exception):
 class InvalidMRTFileErr(Exception):
     pass
 
+def _find_header(buf, eof):
+    """Returns (position of the first valid header in buf, position of the
+    first header that may be valid but is followed by bytes not in buf yet).
+    See MRTDumper._resync. Every offset of buf is checked at once."""
+    b = np.frombuffer(bytes(buf), dtype=np.uint8).astype(np.int64)
+    n = len(b) - MRT_HEADER_LENGTH + 1
+    if n <= 0:
+        return None, None
+    ts = (b[0:n] << 24) | (b[1:n+1] << 16) | (b[2:n+2] << 8) | b[3:n+3]
+    types = (b[4:n+4] << 8) | b[5:n+5]
+    lengths = (b[8:n+8] << 24) | (b[9:n+9] << 16) | (b[10:n+10] << 8) | \
+                b[11:n+11]
+    valid = np.isin(types, _KNOWN_MRT_TYPES) & (lengths <= MAX_RECORD_LENGTH)
+    cand = np.flatnonzero(valid)
+    nxt = cand + MRT_HEADER_LENGTH + lengths[cand]
+    inside = nxt < n
+    ok = np.zeros(len(cand), dtype=bool)
+    c, x = cand[inside], nxt[inside]
+    ok[inside] = valid[x] & (np.abs(ts[x] - ts[c]) <= _MAX_TS_GAP)
+    # A record that ends exactly at the end of the file
+    ok |= eof & (nxt == len(b))
+    undecided = np.zeros(len(cand), dtype=bool) if eof else ~inside
+    first_ok = int(cand[ok][0]) if ok.any() else None
+    first_undecided = int(cand[undecided][0]) if undecided.any() else None
+    if first_undecided is not None and (first_ok is None or
+                                        first_undecided < first_ok):
+        return None, first_undecided
+    return first_ok, None
+
+
+class MRTFilter(object):
+    """ Record filters applied by MRTDumper while reading. Records that don't
+    match are skipped without being decoded - on the MRT header alone for the
+    types, on the first few bytes of the record for the prefix filters."""
+
+    def __init__(self, types=None, afi_safi=None, prefix=None, min_length=0,
+                    max_length=128):
+        """ types : MRT types (all subtypes) or (type, subtype) tuples of the
+            records to read. The PEER_INDEX_TABLE is always read.
+            The following apply to RIB records only -
+            afi_safi : (AFI, SAFI) of the records to read.
+            prefix : Only prefixes within this one (eg. '1.0.0.0/8').
+            min_length, max_length : Range of prefix lengths to read.
+        """
+        self._types = None
+        if types is not None:
+            self._types = {t if isinstance(t, tuple) else (t, None)
+                            for t in types}
+            self._types.add((13, 1))
+        self._afi_safi = afi_safi
+        self._net = None
+        if prefix is not None:
+            net = ipaddress.ip_network(prefix, strict=False)
+            self._net = (AFI_IPV4 if net.version == 4 else AFI_IPV6,
+                            net.prefixlen, int(net.network_address),
+                            net.max_prefixlen)
+        self._min_length = min_length
+        self._max_length = max_length
+        self.filters_prefixes = afi_safi is not None or prefix is not None \
+                                or min_length > 0 or max_length < 128
+
+    def wants_type(self, m):
+        if self._types is None:
+            return True
+        return (m.type, m.subtype) in self._types or \
+                (m.type, None) in self._types
+
+    def wants_prefix(self, afi, safi, prefix, length):
+        if prefix is None:
+            return False
+        if self._afi_safi is not None and (afi, safi) != self._afi_safi:
+            return False
+        if not self._min_length <= length <= self._max_length:
+            return False
+        if self._net is not None:
+            net_afi, net_length, net, bits = self._net
+            if afi != net_afi or length < net_length:
+                return False
+            shift = bits - net_length
+            return int.from_bytes(prefix, 'big') >> shift == net >> shift
+        return True
+
+
 class MRTDumper(object):
-    def __init__(self, mrt_file):
+    def __init__(self, mrt_file, workers=None, record_filter=None):
+        """ record_filter : An MRTFilter, records that don't match are
+        skipped while reading."""
+        self._workers = workers
         self._file_reader = self._get_file_handle(mrt_file)
+        f = self._file_reader
+        # Filtered records are seeked over in plain files, up to this
+        self._file_size = os.fstat(f.fileno()).st_size if f.seekable() \
+                            else None
         self._peeridx_tbl = None
-        self._rib_entries = []
+        self._filter = record_filter
+        self._pending = b'' # Read ahead while resynchronising
+        self._pending_pos = 0
+        # Counters, see get_stats
+        self.records = 0
+        self.filtered = 0
+        self.skipped_bytes = 0
+        self.resyncs = 0
+        self.truncated = 0
+        self.decode_errors = 0
+        self.offset = 0 # Of the next record in the (decompressed) stream
+        self._peeridx_raw = b''
+        # Last TABLE_DUMP (prefix, length) returned by prefix_origins
+        self._last_prefix = None
 
     def _get_file_handle(self, mrt_file):
-        """ Tries to determine the file type of the mrt_file, if it's a valid
-        file and then opens the file for reading using appropriate reader.
-            1. For normal MRT file - just returns the file handle
-            2. For bz2 MRT file - returns an open bz2.BZ2File handle
-            3. For gz MRT file - returns an open gzip.GZipFile handle
+        """ Opens the mrt_file for reading. The compression format (if any) is
+        determined from the magic bytes of the file (see decompress.py), the
+        returned handle is always a plain buffered byte stream.
         Also tries to do a basic error checking, ensure that the first 12
         bytes are indeed MRT header.
         """
         if not os.path.exists(mrt_file):
             raise MRTFileNotFoundErr
 
-        if os.path.splitext(mrt_file)[1].lower() == '.gz':
-            return self._do_get_file_handle(GzipFile, mrt_file)
-        elif os.path.splitext(mrt_file)[1].lower() == '.bz2':
-            return self._do_get_file_handle(BZ2File, mrt_file)
-        else:
-            return self._do_get_file_handle(open, mrt_file)
+        return self._do_get_file_handle(mrt_file)
 
     def __iter__(self):
         """ Iterator for the class"""
         return self
 
-    def __next__(self):
+    def _read(self, n):
+        """Reads n bytes (less at the end of the file), from the bytes read
+        ahead while resynchronising first."""
+        if self._pending_pos >= len(self._pending):
+            return self._file_reader.read(n)
+        pos = self._pending_pos
+        data = self._pending[pos:pos+n]
+        self._pending_pos = pos + len(data)
+        if len(data) < n:
+            data += self._file_reader.read(n - len(data))
+        return data
 
+    def _read_record(self):
+        """Reads the next record (that matches the filter), returns MRTHeader
+        and the record buffer. Corrupt headers (unknown type, impossible
+        length) are skipped by resynchronising to the next valid header, a
+        truncated record at the end ends the dump. Both are counted (see
+        get_stats)."""
         if not self._file_reader:
             raise StopIteration
-        f = self._file_reader
-        try:
-            x = f.read(MRT_HEADER_LENGTH)
+        flt = self._filter
+        while True:
+            x = self._read(MRT_HEADER_LENGTH)
+            if len(x) < MRT_HEADER_LENGTH:
+                # The compressed stream may end (or break) between records
+                if x or (not self.truncated and
+                            stream_error(self._file_reader) is not None):
+                    self.truncated += 1
+                    self.skipped_bytes += len(x)
+                raise StopIteration
             m = MRTHeader(*struct.unpack(_MRT_HDR_PACKSTR, x))
-        except:
-            raise StopIteration
+            if m.type not in _KNOWN_MRT_TYPES or m.length > MAX_RECORD_LENGTH:
+                self._resync(x)
+                continue
+
+            if flt is not None and not flt.wants_type(m):
+                self._skip(m.length)
+                self.offset += MRT_HEADER_LENGTH + m.length
+                continue
+            if flt is None or not flt.filters_prefixes:
+                e = self._read(m.length)
+            else:
+                head = self._read(min(m.length, RIB_HEAD_LENGTH))
+                p = read_rib_prefix(m, head)
+                if p is not None and not flt.wants_prefix(*p):
+                    self._skip(m.length - len(head))
+                    self.offset += MRT_HEADER_LENGTH + m.length
+                    continue
+                e = head + self._read(m.length - len(head))
+            if len(e) < m.length:
+                self.truncated += 1
+                self.skipped_bytes += MRT_HEADER_LENGTH + len(e)
+                raise StopIteration
+            self.records += 1
+            self.offset += MRT_HEADER_LENGTH + m.length
+            if m.type == 13 and m.subtype == 1:
+                self._peeridx_raw = x + e
+            return m, e
 
-        e = f.read(m.length)
-        entry = read_mrt_entry(m, e, self)
-        return entry
+    def _skip(self, length):
+        """Skips length bytes of a filtered record"""
+        self.filtered += 1
+        left = len(self._pending) - self._pending_pos
+        if left > 0:
+            n = min(left, length)
+            self._pending_pos += n
+            length -= n
+        f = self._file_reader
+        if f.seekable():
+            end = f.tell() + length
+            if end > self._file_size:
+                self.truncated += 1
+                end = self._file_size
+            f.seek(end)
+        elif len(f.read(length)) < length:
+            self.truncated += 1
+
+    def _resync(self, header):
+        """Finds the next valid header after a corrupt one (header) - one
+        with a known type and a plausible length, followed by another valid
+        header (or the end of the file) within a month of it. The bytes
+        before it are skipped."""
+        self.resyncs += 1
+        buf = header[1:]
+        skipped = 1
+        while True:
+            more = self._read(RESYNC_WINDOW)
+            eof = len(more) < RESYNC_WINDOW
+            buf += more
+            pos, undecided = _find_header(buf, eof)
+            if pos is not None:
+                break
+            if eof:
+                pos = len(buf)
+                break
+            # Keep the bytes that may still start a header
+            keep = max(len(buf) - MRT_HEADER_LENGTH + 1, 0)
+            if undecided is not None and len(buf) - undecided <= \
+                    MAX_RECORD_LENGTH + MRT_HEADER_LENGTH:
+                keep = undecided
+            skipped += keep
+            buf = buf[keep:]
+        self.skipped_bytes += skipped + pos
+        self.offset += skipped + pos
+        left = self._pending[self._pending_pos:]
+        self._pending = buf[pos:] + left
+        self._pending_pos = 0
+
+    def __next__(self):
+        while True:
+            m, e = self._read_record()
+            try:
+                entry = read_mrt_entry(m, e, self)
+            except (IndexError, struct.error, KeyError, InvalidMRTEntryErr):
+                self.decode_errors += 1
+                continue
+            if type(entry) == PeerIndexTable:
+                self._peeridx_tbl = entry
+            return entry
+
+    def get_stats(self):
+        """Returns a dictionary of counters -
+            records : Records read (including filtered ones)
+            filtered : Records skipped by the filter
+            skipped_bytes : Bytes skipped because of corrupt headers or a
+                            truncated record
+            resyncs : Corrupt headers found, the reader resynchronised to
+                        the next valid header after each of them
+            truncated : Truncated records at the end of the file, or a
+                        truncated (corrupt) compressed stream (0 or 1)
+            decode_errors : Records that couldn't be decoded (eg. with a
+                            prefix length longer than the address)
+        """
+        return {'records': self.records + self.filtered,
+                'filtered': self.filtered,
+                'skipped_bytes': self.skipped_bytes,
+                'resyncs': self.resyncs, 'truncated': self.truncated,
+                'decode_errors': self.decode_errors}
+
+    def prefix_origins(self, afi=AFI_IPV4, safi=SAFI_UNICAST):
+        """Iterates over (prefix, prefix length, origin AS) of all the RIB
+        records for the given AFI/SAFI, prefix is packed (4 or 16 bytes).
+        Uses the fast extraction path in mrttypes that doesn't build RIB
+        Entry objects. Prefixes without an AS Path are skipped.
+        TABLE_DUMP (type 12) files have a record for every peer, only the
+        first of the consecutive records for the same prefix is returned."""
+        while True:
+            try:
+                m, e = self._read_record()
+            except StopIteration:
+                return
+            try:
+                po = read_prefix_origin(m, e)
+                if po is None:
+                    if m.type == 13 and m.subtype == 1:
+                        self._peeridx_tbl = read_mrt_entry(m, e, self)
+                    continue
+            except (IndexError, struct.error, KeyError, InvalidMRTEntryErr):
+                self.decode_errors += 1
+                continue
+            a, s, prefix, length, origin = po
+            if a != afi or s != safi or origin is None:
+                continue
+            if m.type == 12:
+                if self._last_prefix == (prefix, length):
+                    continue
+                self._last_prefix = (prefix, length)
+            yield prefix, length, origin
+
+    def checkpoint(self):
+        """Returns the reader state (a dictionary) for resuming from the next
+        record with resume - offset of the record in the decompressed stream,
+        the counters, the PEER_INDEX_TABLE record read so far and the last
+        TABLE_DUMP prefix returned by prefix_origins (the records of the
+        other peers for it may follow the offset)."""
+        state = self.get_stats()
+        state['offset'] = self.offset
+        state['peer_table'] = self._peeridx_raw
+        last = self._last_prefix
+        state['last_prefix'] = last[0] if last is not None else b''
+        state['last_length'] = last[1] if last is not None else -1
+        return state
+
+    def resume(self, state):
+        """Continues reading from a checkpoint (see checkpoint) of the same
+        file. Compressed streams can't be seeked, they are decompressed up to
+        the offset (but not decoded)."""
+        f = self._file_reader
+        left = state['offset'] - self.offset
+        if f.seekable():
+            f.seek(left, os.SEEK_CUR)
+        else:
+            while left > 0:
+                data = f.read(min(left, 1 << 20))
+                if not data:
+                    break
+                left -= len(data)
+        self.offset = state['offset']
+        for name in ('filtered', 'skipped_bytes', 'resyncs', 'truncated',
+                        'decode_errors'):
+            setattr(self, name, state.get(name, 0))
+        self.records = state.get('records', 0) - self.filtered
+        raw = state.get('peer_table', b'')
+        if raw:
+            m = MRTHeader(*struct.unpack(_MRT_HDR_PACKSTR,
+                                            raw[:MRT_HEADER_LENGTH]))
+            self._peeridx_raw = raw
+            self._peeridx_tbl = read_mrt_entry(m, raw[MRT_HEADER_LENGTH:],
+                                                self)
+        if state.get('last_length', -1) >= 0:
+            self._last_prefix = (state['last_prefix'], state['last_length'])
+
+    def get_peer_table(self):
+        """Returns the PeerIndexTable read from the file (None if it is not
+        read yet)."""
+        return self._peeridx_tbl
 
     def get_peer_by_idx(self, idx):
         """Returns the Peer Info @ idx from the PeerIndexTable.
@@ -83,24 +388,18 @@ class MRTDumper(object):
         """
         return self._peeridx_tbl.get_peer_at_idx(idx)
 
-    def get_rib_entries(self, sort=False, etype=0):
-        """Lists all the RIB Entries in the given file.
-        parameters:
-            sort: If true - prints in lexicographically sorted
-            etype: 0 (prints all)
-                   2 (prints IPV4 Unicast)
-        """
-        return self._rib_entries
-
-    def _do_get_file_handle(self, cls, mrt_file):
+    def _do_get_file_handle(self, mrt_file):
         """Lower Level file open and error checking"""
-        f = cls(mrt_file, 'rb')
-        x = f.read(MRT_HEADER_LENGTH)
-        m = MRTHeader(*struct.unpack(_MRT_HDR_PACKSTR, x))
-        if m.type not in _KNOWN_MRT_TYPES:
+        f = open_stream(mrt_file, workers=self._workers)
+        # Decompressed streams are not seekable, so only peek at the header.
+        x = f.peek(MRT_HEADER_LENGTH)[:MRT_HEADER_LENGTH]
+        try:
+            m = MRTHeader(*struct.unpack(_MRT_HDR_PACKSTR, x))
+        except struct.error:
+            m = None
+        if m is None or m.type not in _KNOWN_MRT_TYPES:
             f.close()
             raise InvalidMRTFileErr(f'{mrt_file}')
-        f.seek(0)
         return f
 
     def close(self):
@@ -114,24 +413,22 @@ class MRTDumper(object):
     def __repr__(self):
         """ Prints the opened file and our own id"""
         string = str(self._file_reader)
-        string = string[1:-1]
-        if type(self._file_reader) == BZ2File:
-            string = string + " for file " + self._file_reader.name + "  "
+        string = string[1:-1] + "  "
         return "< MRTDumper for " + string + str(hex(id(self))) + ">"
 
 
 if __name__ == '__main__':
     #dumper = MRTDumper('updates.20150603.1000')
-    dumper = MRTDumper('rib.20230626.0400.bz2')
+    # IPv4 unicast /8 to /24 prefixes in 1.0.0.0/8 only
+    dumper = MRTDumper('rib.20230626.0400.bz2', record_filter=MRTFilter(
+                    afi_safi=(AFI_IPV4, SAFI_UNICAST), prefix='1.0.0.0/8',
+                    min_length=8, max_length=24))
     #dumper = MRTDumper('rib.20150617.1600')
 
-    # TODO : should this be parsed in MRTDumper class?
     for dump in dumper:
         print(dump)
         if type(dump) == PeerIndexTable:
-            dumper._peeridx_tbl = dump
-        if type(dump) == RIBEntry:
-            #dumper._rib_entries.append(dump)
-            pass
+            dump.print_entries()
 
     dumper.close()
+    print(dumper.get_stats())
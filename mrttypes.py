@@ -4,11 +4,16 @@
 """
 Implementation of various MRT Types supported. Right now following types
 are supportd.
+ - TABLE_DUMP (Type 12) - AFI_IPv4 and AFI_IPv6 subtypes
+ - TABLE_DUMP_V2 (Type 13) - PEER_INDEX_TABLE, RIB_IPV4_UNICAST,
+   RIB_IPV4_MULTICAST, RIB_IPV6_UNICAST, RIB_IPV6_MULTICAST and RIB_GENERIC
+   (for the AFI/SAFI combinations above)
 """
 
 from collections import namedtuple
 import struct
-from socket import inet_ntoa
+from socket import inet_ntoa, inet_ntop, AF_INET6
+from array import array
 import gc
 import binascii
 
@@ -16,13 +21,30 @@ import binascii
 BGP_ATYPE_ORIGIN = 1
 BGP_ATYPE_ASPATH = 2
 BGP_ATYPE_NEXTHOP = 3
+BGP_ATYPE_AS4PATH = 17
 
 BGP_ORIGIN_TYPES = ['IGP', 'EGP', 'UNDEFINED']
 
+# AS used in place of 4 octet AS in 2 octet AS_PATH (rfc6793)
+AS_TRANS = 23456
+
 def bytes_to_hexstr(bytestr):
     return ' '.join(['%02X' % ord(x) for x in bytestr])
 
-def parse_bgp_attr(atype, aval_buf):
+def parse_aspath(aval_buf, as_size=4):
+    """Parses all the segments of an AS_PATH attribute and returns a list of
+    ASes. as_size is 4 for TABLE_DUMP_V2 and 2 for TABLE_DUMP"""
+    ases = []
+    segproc = 0
+    while segproc + 2 <= len(aval_buf):
+        segtype, seglen = aval_buf[segproc], aval_buf[segproc+1]
+        segproc += 2
+        asfmt = '>%d%s' % (seglen, 'I' if as_size == 4 else 'H')
+        ases.extend(struct.unpack_from(asfmt, aval_buf, segproc))
+        segproc += seglen * as_size
+    return ases
+
+def parse_bgp_attr(atype, aval_buf, as_size=4):
     """Given a type and value buffer, parses a BGP attribute and returns the value
     parsed"""
     if atype == BGP_ATYPE_ORIGIN:
@@ -34,13 +56,11 @@ def parse_bgp_attr(atype, aval_buf):
         return attr, aval, 1
     elif atype == BGP_ATYPE_ASPATH:
         attr = 'ASPATH'
-        segtype, seglen = struct.unpack('BB', aval_buf[:2])
-        ases = []
-        segproc = 2
-        for i in range(seglen):
-            as_,  = struct.unpack('>I', aval_buf[segproc:segproc+4])
-            segproc += 4
-            ases.append(as_)
+        ases = parse_aspath(aval_buf, as_size)
+        return attr, ases, len(aval_buf)
+    elif atype == BGP_ATYPE_AS4PATH:
+        attr = 'AS4PATH'
+        ases = parse_aspath(aval_buf, 4)
         return attr, ases, len(aval_buf)
     elif atype == BGP_ATYPE_NEXTHOP:
         attr = 'NEXTHOP'
@@ -50,7 +70,7 @@ def parse_bgp_attr(atype, aval_buf):
         return None, None, len(aval_buf)
 
 
-def parse_bgp_attrs(attr_buf):
+def parse_bgp_attrs(attr_buf, as_size=4):
     """Parses BGP attributes in the buffers, returns a dictionary of attributes
         key: Attribute, val:Attribute_value of respective type
     """
@@ -77,7 +97,7 @@ def parse_bgp_attrs(attr_buf):
 
         alen = alen[0]
         aval = attr_buf[proc:proc+alen]
-        attr, attr_val, p = parse_bgp_attr(t, aval)
+        attr, attr_val, p = parse_bgp_attr(t, aval, as_size)
         if p <  0:
             break
         if attr is not None:
@@ -88,6 +108,12 @@ def parse_bgp_attrs(attr_buf):
 class MRTType(object):
     pass
 
+class UnsupportedMRTEntryErr(Exception):
+    pass
+
+class InvalidMRTEntryErr(Exception):
+    pass
+
 MRTPeerIndexHeader = namedtuple('MRTPeerIndexHeader',
                             ['collector_ip', 'view_name_len'])
 
@@ -95,13 +121,20 @@ MRTPeerIndexEntry = namedtuple('MRTPeerIndexEntry',
                                 ['entry_type', 'peer_bgp_id', 'peer_ip', 'peer_asid'])
 
 class PeerIndexTable(MRTType):
+    """Peer Index Table (rfc6396 4.3.1).
+
+    Peers are kept in arrays (BGP Id, packed IP, IP string, AS), the IP
+    strings are converted once when the table is read, so that RIB Entries
+    only need to refer to peers by their index.
+    """
 
     _PEER_IDX_TBL_HDRSTR = '>4sH'
     _PEER_IDX_TBL_ENTRYSTRS = ['>BI4sH', '>BI16sH', '>BI4sI', '>BI16sI']
+    _PEER_IDX_TBL_ENTRYSTRUCTS = [struct.Struct(x)
+                                    for x in _PEER_IDX_TBL_ENTRYSTRS]
 
-    def __init__(self, m, e, o):
+    def __init__(self, m, e, o, verbose=False):
         self._length = m.length
-        self._entries = []
         self._collector_ip = None
         self._view_name = ''
         self._nentries = 0
@@ -120,23 +153,57 @@ class PeerIndexTable(MRTType):
         self._nentries = struct.unpack('>H', e[o:o+2])[0]
         o += 2
 
+        self._entry_types = array('B')
+        self._peer_bgp_ids = array('I')
+        self._peer_asids = array('I')
+        self._peer_ips = []
+        self._peer_ip_strs = []
+
         # o is now @ the beginning of first entry
         for i in range(self._nentries):
-            ebyte = struct.unpack('B', e[o:o+1])[0]
-            estr = self._PEER_IDX_TBL_ENTRYSTRS[ebyte]
-            estrlen = struct.calcsize(estr)
-            entry = MRTPeerIndexEntry(*struct.unpack(estr, e[o:o+estrlen]))
-            o += estrlen
-            self._entries.append(entry)
-            self._entry_print(entry)
-
-    def _entry_print(self, entry):
-        print (f"TYPE:{entry.entry_type}, Peer_BGP_ID:{entry.peer_bgp_id}, "
-                f"Peer_IP:{inet_ntoa(entry.peer_ip)},Peer_AS:AS{entry.peer_asid}")
+            ebyte = e[o]
+            s = self._PEER_IDX_TBL_ENTRYSTRUCTS[ebyte]
+            etype, bgp_id, peer_ip, asid = s.unpack_from(e, o)
+            o += s.size
+            self._entry_types.append(etype)
+            self._peer_bgp_ids.append(bgp_id)
+            self._peer_asids.append(asid)
+            self._peer_ips.append(peer_ip)
+            # Bit 0 of the entry type : IPv6 Peer
+            if etype & 0x1:
+                self._peer_ip_strs.append(inet_ntop(AF_INET6, peer_ip))
+            else:
+                self._peer_ip_strs.append(inet_ntoa(peer_ip))
+
+        if verbose:
+            self.print_entries()
+
+    def __len__(self):
+        return self._nentries
+
+    def _entry_print(self, idx):
+        print (f"TYPE:{self._entry_types[idx]}, "
+                f"Peer_BGP_ID:{self._peer_bgp_ids[idx]}, "
+                f"Peer_IP:{self._peer_ip_strs[idx]},"
+                f"Peer_AS:AS{self._peer_asids[idx]}")
+
+    def print_entries(self):
+        for i in range(self._nentries):
+            self._entry_print(i)
 
     def get_peer_at_idx(self, idx):
         """Returns the peer @ given idx."""
-        return self._entries[idx]
+        return MRTPeerIndexEntry(self._entry_types[idx],
+                self._peer_bgp_ids[idx], self._peer_ips[idx],
+                self._peer_asids[idx])
+
+    def get_peer_ip(self, idx):
+        """Returns the IP Address (string) of the peer @ given idx."""
+        return self._peer_ip_strs[idx]
+
+    def get_peer_asid(self, idx):
+        """Returns the AS of the peer @ given idx."""
+        return self._peer_asids[idx]
 
 class PeerIndexEntry(MRTType):
     pass
@@ -147,83 +214,353 @@ RIB_ENTRY_IPV4_MCAST = 1
 RIB_ENTRY_IPV6_UCAST = 2
 RIB_ENTRY_IPV6_MCAST = 3
 
+AFI_IPV4 = 1
+AFI_IPV6 = 2
+SAFI_UNICAST = 1
+SAFI_MULTICAST = 2
+
+# (AFI, SAFI) of each of the RIB Entry types
+_ENTRY_AFI_SAFI = [(AFI_IPV4, SAFI_UNICAST), (AFI_IPV4, SAFI_MULTICAST),
+                    (AFI_IPV6, SAFI_UNICAST), (AFI_IPV6, SAFI_MULTICAST)]
+
+def _entry_type_from_afi_safi(afi, safi):
+    try:
+        return _ENTRY_AFI_SAFI.index((afi, safi))
+    except ValueError:
+        return None
+
+def _read_prefix(e, o, etype):
+    """Returns (prefix, prefix length) of the prefix length and prefix @ o,
+    the prefix padded to 4 or 16 bytes. Raises InvalidMRTEntryErr if the
+    prefix length is longer than the address (or the prefix is cut off)."""
+    plen = e[o]
+    size = RIBEntry._ENTRY_LENGTHS[etype]
+    if plen > size * 8:
+        raise InvalidMRTEntryErr(f'prefix length {plen}')
+    pb = (plen + 7) // 8
+    prefix = e[o+1:o+1+pb]
+    if len(prefix) < pb:
+        raise InvalidMRTEntryErr('prefix past the end of the record')
+    return prefix + bytes(size - pb), plen
+
+def _prefix_to_str(prefix):
+    if len(prefix) == 4:
+        return inet_ntoa(prefix)
+    return inet_ntop(AF_INET6, prefix)
+
+def _dest_as(attrs):
+    """Returns the destination (origin) AS from parsed attributes. For 2
+    octet AS Paths, the AS4_PATH is used if the origin is AS_TRANS."""
+    dest_as = attrs['ASPATH'][-1]
+    if dest_as == AS_TRANS and attrs.get('AS4PATH'):
+        dest_as = attrs['AS4PATH'][-1]
+    return dest_as
+
+
 class RIBEntry(MRTType):
+    """TABLE_DUMP_V2 AFI/SAFI specific RIB Entry (rfc6396 4.3.2), subtypes
+    2 to 5."""
 
     _SEQNO_PREFIX_STR = '>IB'
     _RIBENTRY_PREFIX_STR = '>HIH'
+    _RIBENTRY_HDR = struct.Struct(_RIBENTRY_PREFIX_STR)
     _ENTRY_LENGTHS = [4, 4, 16, 16]
     _ENTRY_TYPES = [ RIB_ENTRY_IPV4_UCAST, RIB_ENTRY_IPV4_MCAST,
                     RIB_ENTRY_IPV6_UCAST, RIB_ENTRY_IPV6_MCAST]
 
     def __init__(self, m, e, o, etype):
         #print bytes_to_hexxtr(e)
-        s, p = struct.unpack(self._SEQNO_PREFIX_STR, e[0:5])
+        s = struct.unpack('>I', e[0:4])[0]
         self._seqno = s
-        self._prefixlen = p
-        self._prefix = None
         self._entry_type = etype
         self._entries = []
         self.owner = o
-        pb = 0
-        if p % 8:
-            pb = 1
-        pb += (p//8)
-        if pb:
-            pestr = self._SEQNO_PREFIX_STR + '%dsH' % pb
-            pestrl = struct.calcsize(pestr)
-            s, pl, pr, en = struct.unpack(pestr, e[0:pestrl])
-            self._prefix = pr + bytes(self._ENTRY_LENGTHS[etype] - pb)
+        used = self._parse_prefix(e, 4)
+        self._parse_entries(e, used)
+
+    def _parse_prefix(self, e, o):
+        """Parses the prefix length and prefix @ o and returns the offset of
+        the first byte after the prefix."""
+        self._prefix, self._prefixlen = _read_prefix(e, o, self._entry_type)
+        self._prefixstr = _prefix_to_str(self._prefix)
+        return o + 1 + (self._prefixlen + 7) // 8
+
+    def _parse_entries(self, e, used):
+        self._entry_count = struct.unpack('>H', e[used:used+2])[0]
+        used += 2
+
+        if self._prefixlen > 0 :
+            prefix_attr = '%s/%d' % (self._prefixstr, self._prefixlen)
         else:
-            pestr = self._SEQNO_PREFIX_STR + 'H'
-            pestrl = struct.calcsize(pestr)
-            #print bytes_to_hexstr(e[0:pestrl])
-            self._prefix = '\x00' * self._ENTRY_LENGTHS[etype]
-            s, pl, en = struct.unpack(pestr, e[0:pestrl])
-        self._entry_count = en
-        self._prefixstr = '.'.join([str(x) for x in self._prefix])
-
-        used = pestrl
+            prefix_attr = "0/0"
+
+        ehdr_len = self._RIBENTRY_HDR.size
         for i in range(self._entry_count):
             # disassemble each entry
-            ehdr_len = struct.calcsize(self._RIBENTRY_PREFIX_STR)
-            peeridx, ts, attrlen = struct.unpack(self._RIBENTRY_PREFIX_STR,
-                                                    e[used:used+ehdr_len])
+            peeridx, ts, attrlen = self._RIBENTRY_HDR.unpack_from(e, used)
             # parse remaining attributes
             begin = used+ehdr_len
             end = begin + attrlen
             attrs = parse_bgp_attrs(e[begin:end])
             used += ehdr_len
             used += attrlen
-            peer = self.owner.get_peer_by_idx(peeridx)
-            attrs['PEER_IP'] = inet_ntoa(peer.peer_ip)
-            attrs['PEER_AS'] = peer.peer_asid
-            if self._prefixlen > 0 :
-                attrs['PREFIX'] = '%s/%d' % \
-                                (inet_ntoa(self._prefix), self._prefixlen)
-            else:
-                attrs['PREFIX'] = "0/0"
+            # Peers are referred to by index, see get_peer_ip/get_peer_as
+            attrs['PEER_IDX'] = peeridx
+            attrs['PREFIX'] = prefix_attr
             self._entries.append(attrs)
 
+    def get_afi_safi(self):
+        return _ENTRY_AFI_SAFI[self._entry_type]
+
+    def get_peer_ip(self, entry_idx):
+        """Returns the IP Address of the peer for the entry @ entry_idx"""
+        return self.owner.get_peer_table().get_peer_ip(
+                    self._entries[entry_idx]['PEER_IDX'])
+
+    def get_peer_as(self, entry_idx):
+        """Returns the AS of the peer for the entry @ entry_idx"""
+        return self.owner.get_peer_table().get_peer_asid(
+                    self._entries[entry_idx]['PEER_IDX'])
+
     def get_prefix_length_dest_as(self):
-        dest_aspath = self._entries[0]['ASPATH']
-        dest_as = dest_aspath[-1]
-        return self._prefixstr, self._prefixlen, dest_as
+        return self._prefixstr, self._prefixlen, _dest_as(self._entries[0])
 
     def __repr__(self):
         return '\n'.join([str(x) for x in self._entries])
 
 
+class RIBGenericEntry(RIBEntry):
+    """TABLE_DUMP_V2 RIB_GENERIC Entry (rfc6396 4.3.3). Only the AFI/SAFI
+    combinations of the specific RIB Entries with a plain prefix as the NLRI
+    are supported."""
+
+    def __init__(self, m, e, o):
+        s, afi, safi = struct.unpack('>IHB', e[0:7])
+        etype = _entry_type_from_afi_safi(afi, safi)
+        if etype is None:
+            raise UnsupportedMRTEntryErr(f'RIB_GENERIC AFI:{afi}, SAFI:{safi}')
+        self._seqno = s
+        self._entry_type = etype
+        self._entries = []
+        self.owner = o
+        used = self._parse_prefix(e, 7)
+        self._parse_entries(e, used)
+
+
+class TableDumpEntry(MRTType):
+    """TABLE_DUMP (Type 12) Entry (rfc6396 4.2). Each record has the prefix as
+    seen from a single peer, AS Paths have 2 octet ASes."""
+
+    _TABLE_DUMP_HDRSTRS = {AFI_IPV4: struct.Struct('>HHIBBI4sH'),
+                            AFI_IPV6: struct.Struct('>HH16sBBI16sH')}
+
+    def __init__(self, m, e, o):
+        afi = m.subtype
+        self._afi = afi
+        hdr = self._TABLE_DUMP_HDRSTRS[afi]
+        view, seqno, prefix, plen, status, ts, peer_ip, peer_as = \
+                hdr.unpack_from(e, 0)
+        if afi == AFI_IPV4:
+            prefix = struct.pack('>I', prefix)
+        if plen > len(prefix) * 8:
+            raise InvalidMRTEntryErr(f'prefix length {plen}')
+        self._view = view
+        self._seqno = seqno
+        self._prefix = prefix
+        self._prefixlen = plen
+        self._prefixstr = _prefix_to_str(prefix)
+        self.owner = o
+        attrlen = struct.unpack('>H', e[hdr.size:hdr.size+2])[0]
+        begin = hdr.size + 2
+        attrs = parse_bgp_attrs(e[begin:begin+attrlen], as_size=2)
+        attrs['PEER_IP'] = _prefix_to_str(peer_ip)
+        attrs['PEER_AS'] = peer_as
+        attrs['PREFIX'] = '%s/%d' % (self._prefixstr, plen) if plen else "0/0"
+        self._entries = [attrs]
+
+    def get_afi_safi(self):
+        return self._afi, SAFI_UNICAST
+
+    def get_prefix_length_dest_as(self):
+        return self._prefixstr, self._prefixlen, _dest_as(self._entries[0])
+
+    def __repr__(self):
+        return str(self._entries[0])
+
+
+def _rib_entry_decoder(etype):
+    return lambda m, e, o: RIBEntry(m, e, o, etype)
+
+# Decoders for every supported (type, subtype)
+MRT_DECODERS = {
+    (12, AFI_IPV4): TableDumpEntry,
+    (12, AFI_IPV6): TableDumpEntry,
+    (13, 1): PeerIndexTable,
+    (13, 2): _rib_entry_decoder(RIB_ENTRY_IPV4_UCAST),
+    (13, 3): _rib_entry_decoder(RIB_ENTRY_IPV4_MCAST),
+    (13, 4): _rib_entry_decoder(RIB_ENTRY_IPV6_UCAST),
+    (13, 5): _rib_entry_decoder(RIB_ENTRY_IPV6_MCAST),
+    (13, 6): RIBGenericEntry,
+}
+
 def read_mrt_entry(m, e, o):
     """ Given an MRT Entry header and buffer, returns an Object
     of respective MRTType. If the type and/or subtype is not supported
     returns None"""
+    decoder = MRT_DECODERS.get((m.type, m.subtype))
+    if decoder is None:
+        return None
+    try:
+        return decoder(m, e, o)
+    except UnsupportedMRTEntryErr:
+        return None
+
 
-    # FIXME : Remove Hardcoding
-    if m.type == 13 and m.subtype == 1:
-        peeridxtbl = PeerIndexTable(m, e, o)
-        return peeridxtbl
-    if m.type == 13 and m.subtype == 2:
-        rib_entry = RIBEntry(m, e, o, RIB_ENTRY_IPV4_UCAST)
-        #print rib_entry.get_prefix_length_dest_as()
-        # Not sure why explicit gc.collect() below is required
-        return rib_entry
+### Fast Prefix/Origin extraction
+#
+# Building a RIBEntry parses every attribute of every peer into a dictionary,
+# while building a routing table only needs the prefix and the origin AS from
+# the first entry. The functions below walk the record buffer directly and
+# return (afi, safi, prefix, prefix length, origin AS) where prefix is the
+# packed (4 or 16 bytes) prefix. Origin AS is None if there's no AS Path
+# (locally originated routes).
+
+def _origin_from_attrs(e, off, end, as_size):
+    origin = None
+    as4_origin = None
+    while off < end:
+        flags, atype = e[off], e[off+1]
+        if flags & 0x10:
+            alen = (e[off+2] << 8) | e[off+3]
+            off += 4
+        else:
+            alen = e[off+2]
+            off += 3
+        if atype == BGP_ATYPE_ASPATH:
+            origin = _last_as(e, off, off+alen, as_size)
+            if as_size == 4 or origin != AS_TRANS:
+                return origin
+        elif atype == BGP_ATYPE_AS4PATH:
+            as4_origin = _last_as(e, off, off+alen, 4)
+        off += alen
+    if origin == AS_TRANS and as4_origin is not None:
+        return as4_origin
+    return origin
+
+def _last_as(e, off, end, as_size):
+    """Returns the last AS in the AS Path @ e[off:end] without building the
+    list of ASes."""
+    last = None
+    while off + 2 <= end:
+        seglen = e[off+1]
+        off += 2
+        if seglen:
+            last = off + (seglen - 1) * as_size
+        off += seglen * as_size
+    if last is None:
+        return None
+    return int.from_bytes(e[last:last+as_size], 'big')
+
+_ENTRY_HDR_LEN = 8 # Peer Index, Originated Time, Attribute Length
+
+def _rib_prefix_origin(e, o, etype):
+    prefix, plen = _read_prefix(e, o, etype)
+    o += 1 + (plen + 7) // 8
+    if not (e[o] << 8) | e[o+1]:
+        return None
+    o += 2
+    attrlen = (e[o+6] << 8) | e[o+7]
+    begin = o + _ENTRY_HDR_LEN
+    origin = _origin_from_attrs(e, begin, begin + attrlen, 4)
+    afi, safi = _ENTRY_AFI_SAFI[etype]
+    return afi, safi, prefix, plen, origin
+
+def _rib_specific_prefix_origin(etype):
+    return lambda m, e: _rib_prefix_origin(e, 4, etype)
+
+def _rib_generic_prefix_origin(m, e):
+    afi, safi = struct.unpack('>HB', e[4:7])
+    etype = _entry_type_from_afi_safi(afi, safi)
+    if etype is None:
+        return None
+    return _rib_prefix_origin(e, 7, etype)
+
+def _table_dump_prefix_origin(m, e):
+    afi, safi, prefix, plen = _table_dump_prefix(m, e)
+    hdr = TableDumpEntry._TABLE_DUMP_HDRSTRS[afi]
+    attrlen = (e[hdr.size] << 8) | e[hdr.size+1]
+    begin = hdr.size + 2
+    origin = _origin_from_attrs(e, begin, begin + attrlen, 2)
+    return afi, safi, prefix, plen, origin
+
+PREFIX_ORIGIN_DECODERS = {
+    (12, AFI_IPV4): _table_dump_prefix_origin,
+    (12, AFI_IPV6): _table_dump_prefix_origin,
+    (13, 2): _rib_specific_prefix_origin(RIB_ENTRY_IPV4_UCAST),
+    (13, 3): _rib_specific_prefix_origin(RIB_ENTRY_IPV4_MCAST),
+    (13, 4): _rib_specific_prefix_origin(RIB_ENTRY_IPV6_UCAST),
+    (13, 5): _rib_specific_prefix_origin(RIB_ENTRY_IPV6_MCAST),
+    (13, 6): _rib_generic_prefix_origin,
+}
+
+def read_prefix_origin(m, e):
+    """ Given an MRT Entry header and buffer, returns a tuple of
+    (afi, safi, prefix, prefix length, origin AS) for RIB records. Returns
+    None for any other records."""
+    decoder = PREFIX_ORIGIN_DECODERS.get((m.type, m.subtype))
+    if decoder is None:
+        return None
+    return decoder(m, e)
+
+
+### Prefix of a RIB record from the first few bytes of the record
+#
+# Used by the reader level filters (see mrtdump.MRTFilter) to decide whether
+# a record is wanted before reading the rest of it. Returns (afi, safi,
+# prefix, prefix length) with the packed prefix padded to 4 or 16 bytes.
+
+RIB_HEAD_LENGTH = 24 # Enough for the prefix of any of the RIB records
+
+def _rib_specific_prefix(etype):
+    def _prefix(m, e):
+        afi, safi = _ENTRY_AFI_SAFI[etype]
+        return (afi, safi) + _read_prefix(e, 4, etype)
+    return _prefix
+
+def _rib_generic_prefix(m, e):
+    afi, safi = struct.unpack('>HB', e[4:7])
+    etype = _entry_type_from_afi_safi(afi, safi)
+    if etype is None:
+        return afi, safi, None, None
+    return (afi, safi) + _read_prefix(e, 7, etype)
+
+def _table_dump_prefix(m, e):
+    if m.subtype == AFI_IPV4:
+        afi, prefix, plen = AFI_IPV4, e[4:8], e[8]
+    else:
+        afi, prefix, plen = AFI_IPV6, e[4:20], e[20]
+    if plen > len(prefix) * 8:
+        raise InvalidMRTEntryErr(f'prefix length {plen}')
+    return afi, SAFI_UNICAST, prefix, plen
+
+PREFIX_DECODERS = {
+    (12, AFI_IPV4): _table_dump_prefix,
+    (12, AFI_IPV6): _table_dump_prefix,
+    (13, 2): _rib_specific_prefix(RIB_ENTRY_IPV4_UCAST),
+    (13, 3): _rib_specific_prefix(RIB_ENTRY_IPV4_MCAST),
+    (13, 4): _rib_specific_prefix(RIB_ENTRY_IPV6_UCAST),
+    (13, 5): _rib_specific_prefix(RIB_ENTRY_IPV6_MCAST),
+    (13, 6): _rib_generic_prefix,
+}
+
+def read_rib_prefix(m, head):
+    """ Given an MRT Entry header and the first RIB_HEAD_LENGTH bytes (or
+    less for shorter records) of the record, returns (afi, safi, prefix,
+    prefix length) for RIB records, None for other records."""
+    decoder = PREFIX_DECODERS.get((m.type, m.subtype))
+    if decoder is None:
+        return None
+    try:
+        return decoder(m, head)
+    except (IndexError, struct.error, InvalidMRTEntryErr):
+        return None
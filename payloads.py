@@ -0,0 +1,180 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Payloads for routing table entries.
+
+A routing table entry has room for a single 32 bit output Index. Instead of
+the origin AS, it can hold an index into a table of deduplicated payload
+records (origin AS, Org, Country, MOAS flag, RPKI state or any other NumPy
+structured dtype). Most routes share their payload with many others (all the
+prefixes of an AS with the same state), so a few thousand payloads are
+enough for a full table.
+
+Lookups in a batch return the output Indices, which are turned into payload
+records for all the addresses at once (a single fancy indexing of the
+structured array), so every column is available without joins in Python.
+
+Payload 0 is reserved - it's returned for addresses without a route.
+
+A table built with payload Indices is a separate, opt-in kind of table and
+not interchangeable with a table of origin ASes - everything else (enrich,
+rir_delegated.CountryOverlay, asrelations.ConeBitmaps.ips_in_cone,
+reverse_index, table_diff) reads the output Index as an AS number, and
+payload Index 0 would be taken for AS0. Keep the table (or PrefixSet) of
+origin ASes for those, or turn the outputs of a payload table back into AS
+numbers with PayloadTable.asns.
+"""
+
+import numpy as np
+
+from prefixset import PrefixSet, last_unique
+
+RPKI_NOT_CHECKED = 0 # Other states are in rpki.py
+
+
+def payload_dtype(org_len=1):
+    """ The default payload record, with room for Org ids of org_len bytes"""
+    return np.dtype([('asn', 'u4'), ('org', f'S{max(org_len, 1)}'),
+                        ('country', 'S2'), ('moas', '?'), ('rpki', 'u1')])
+
+
+class PayloadTable:
+    def __init__(self, dtype=None):
+        self.dtype = np.dtype(dtype if dtype is not None else payload_dtype())
+        self.records = np.zeros(1, dtype=self.dtype)
+        # Record -> Index. Payload 0 isn't in it, so that a route with an
+        # all zero record (eg. AS0 and nothing else known) isn't taken for
+        # no route.
+        self._index = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return "< PayloadTable of %d payloads %s>" % (len(self), hex(id(self)))
+
+    def add(self, records):
+        """ Adds an array of payload records (of self.dtype), returns an
+        array with the payload Index of every record (existing Index for
+        records already in the table)."""
+        records = np.asarray(records, dtype=self.dtype)
+        if not len(records):
+            return np.zeros(0, dtype=np.uint32)
+        raw = np.ascontiguousarray(records).view(f'V{self.dtype.itemsize}')
+        uniq, inverse = np.unique(raw, return_inverse=True)
+        indices = np.zeros(len(uniq), dtype=np.uint32)
+        new = []
+        for i, r in enumerate(uniq.tolist()):
+            idx = self._index.get(r)
+            if idx is None:
+                idx = self._index[r] = len(self.records) + len(new)
+                new.append(i)
+            indices[i] = idx
+        if new:
+            self.records = np.concatenate((self.records,
+                                            uniq[new].view(self.dtype)))
+        return indices[inverse.ravel()]
+
+    def add_one(self, **fields):
+        """ Adds a single payload, returns it's Index"""
+        record = np.zeros(1, dtype=self.dtype)
+        for name, value in fields.items():
+            record[name] = value
+        return int(self.add(record)[0])
+
+    def get(self, indices):
+        """ Payload records of an array of output Indices, -1 (no route,
+        see RouteTable.lookup_many) gives payload 0."""
+        indices = np.asarray(indices)
+        return self.records[np.where(indices < 0, 0, indices)]
+
+    def lookup(self, table, ip_address):
+        """ Returns the payload record of the route of an address in a table
+        built with payload Indices, None if there's no route."""
+        idx = table.lookup(ip_address)
+        return None if idx is None else self.records[idx]
+
+    def lookup_many(self, table, ips):
+        """ Returns payload records (a structured array) of an array of
+        addresses (32 bit integers)."""
+        return self.get(table.lookup_many(ips))
+
+    def asns(self, indices):
+        """ Origin AS of an array of output Indices of a payload table, -1
+        where there's no route (as RouteTable.lookup_many of a table of
+        origin ASes)."""
+        indices = np.asarray(indices)
+        return np.where(indices > 0, self.get(indices)['asn'].astype(np.int64),
+                        -1)
+
+    def save(self, filename):
+        with open(filename, 'wb+') as f:
+            np.savez(f, records=self.records)
+
+    @classmethod
+    def load(cls, filename):
+        x = np.load(filename)
+        self = cls(x['records'].dtype)
+        self.records = x['records']
+        self._index = {r: i for i, r in enumerate(
+                self.records[1:].view(f'V{self.dtype.itemsize}').tolist(), 1)}
+        return self
+
+
+def build_payloads(prefix_set, asinfo=None, payloads=None, roas=None):
+    """ Returns (payloads, prefix set) for a prefix set. The prefix set has
+    one entry per prefix (the last one where it appears more than once, as in
+    PrefixSet.to_route_table) with the payload Index as origin. Prefixes that
+    appear with more than one origin AS are flagged MOAS. Org and Country are
+    from asinfo (a parsed ASInformation) and the RPKI state from roas (an
+    rpki.ROATable) when given. The returned prefix set (and a table built from
+    it) is for payload lookups only, keep prefix_set for anything that
+    expects origin ASes."""
+    keys = prefix_set.keys()
+    uniq, last = last_unique(keys)
+    ps = prefix_set.take(last)
+    # MOAS if any origin of a prefix differs from the selected (last) one
+    group = np.searchsorted(uniq, keys)
+    moas = np.zeros(len(ps), dtype=bool)
+    np.logical_or.at(moas, group, prefix_set.origins != ps.origins[group])
+
+    orgs = asinfo.orgs_for_ases(ps.origins) if asinfo is not None else \
+            np.zeros(len(ps), dtype='S1')
+    if payloads is None:
+        payloads = PayloadTable(payload_dtype(orgs.dtype.itemsize))
+    records = np.zeros(len(ps), dtype=payloads.dtype)
+    records['asn'] = ps.origins
+    records['org'] = orgs
+    if asinfo is not None:
+        records['country'] = asinfo.countries_for_ases(ps.origins)
+    records['moas'] = moas
+    if roas is not None:
+        records['rpki'] = roas.validate_prefix_set(ps)
+    return payloads, PrefixSet(ps.prefixes, ps.lengths, payloads.add(records))
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    from asinformation import ASInformation
+    from ipv4_addresses import u32_to_text
+
+    # payloads.py as-org2info.txt.gz rib [rib ...]
+    a = ASInformation(sys.argv[1])
+    a.parse()
+    sets = [PrefixSet.from_mrt(f) for f in sys.argv[2:]]
+    merged = PrefixSet(np.concatenate([s.prefixes for s in sets]),
+                        np.concatenate([s.lengths for s in sets]),
+                        np.concatenate([s.origins for s in sets]))
+
+    then = dt.now()
+    payloads, ps = build_payloads(merged, a)
+    table = ps.to_route_table()
+    print(f"{len(ps)} routes, {len(payloads)} payloads in {dt.now() - then}")
+
+    ips = np.random.randint(0, 1 << 32, size=10, dtype=np.uint64).astype(
+                                                                np.uint32)
+    for ip, row in zip(u32_to_text(ips), payloads.lookup_many(table, ips)):
+        print(ip, row)
@@ -0,0 +1,301 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+A Poptrie (Asai and Ohara, SIGCOMM 2015) style routing table, an alternative
+to the multibit trie in ipv4_routing_table.py with the same interface.
+
+In the multibit trie every sub-table is fully expanded, a single /26 needs a
+256 entry and a 16 entry table. Here a node of the trie has up to 64 slots
+(a stride of 6 bits) but only keeps two 64 bit bitmaps -
+ - vector : bit i is set if slot i has a child node
+ - leafvec : bit i is set if slot i is a leaf that starts a new run of leaves
+   (consecutive leaves with the same output are stored once)
+and the index of its first child node (base1) and first leaf (base0). Child
+nodes of a node and leaves of a node are stored next to each other, so the
+child of slot v is base1 + popcount(vector & bits 0..v) - 1 and similarly
+for leaves. The first 16 bits are looked up in a directly indexed table.
+
+Leaves are 'pushed': every leaf holds the longest prefix match for the
+addresses of its slot, so a lookup ends at the first leaf.
+
+The trie is built from the set of routes all at once (level by level with
+NumPy), add and delete only update the set of routes and the trie is rebuilt
+at the next lookup. So it is meant for tables that are mostly looked up and
+changed in batches.
+
+Supported RouteTable methods: add, delete, lookup, lookup_packed,
+lookup_int, lookup_many, route_arrays, routes, to_prefix_set, covered_by,
+covering, cidr_segments (see ipv4_routing_table.RouteQueries), build,
+memory, save_table and loading from a file. route_arrays returns every route
+that was added, RouteTable's leaves out the ones hidden by longer prefixes.
+The lookup cache (enable_cache) is not supported, a lookup is a few array
+reads already; flatten and print_table are specific to the multibit trie.
+"""
+
+from socket import inet_aton, inet_ntoa
+import struct
+
+import numpy as np
+
+from ipv4_routing_table import InvalidStridesErr, RouteQueries, find_keys
+from ipv4_routing_table import longest_match
+
+# Bits looked up directly, then by every level of nodes (at most 6)
+DEFAULT_STRIDES = (16, 6, 6, 4)
+
+_ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(x):
+        return np.bitwise_count(x).astype(np.int64)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)],
+                            dtype=np.int64)
+
+    def _popcount(x):
+        x = np.ascontiguousarray(x, dtype=np.uint64)
+        return _BYTE_COUNTS[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PoptrieTable(RouteQueries):
+    def __init__(self, filename=None, strides=DEFAULT_STRIDES):
+        """ strides : Bits looked up directly at first level and then by
+        every level of nodes (at most 6 bits each). They add up to 32."""
+        strides = [int(x) for x in strides]
+        if sum(strides) != 32 or len(strides) < 2 or \
+                max(strides[1:]) > 6 or min(strides) < 1:
+            raise InvalidStridesErr(f'Strides should add up to 32 and be at '
+                                    f'most 6 after the first: {strides}')
+        self.strides = strides
+        self.levels = list(np.cumsum(strides).tolist())
+        self._routes = {} # (prefix, length) : output
+        self._trie = None
+        if filename is not None:
+            self._load_table(filename)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, prefix, length, dest_idx):
+        """ Adds a prefix to routing table."""
+        p = struct.unpack('>I', inet_aton(prefix))[0]
+        p &= ((1 << length) - 1) << (32 - length)
+        self._routes[(p, length)] = int(dest_idx)
+        self._trie = None
+
+    def delete(self, prefix, length):
+        """ Deletes a prefix from the routing table."""
+        p = struct.unpack('>I', inet_aton(prefix))[0]
+        p &= ((1 << length) - 1) << (32 - length)
+        if self._routes.pop((p, length), None) is not None:
+            self._trie = None
+
+    def route_arrays(self):
+        """ Returns all the routes as (prefixes, lengths, outputs) arrays,
+        sorted by prefix and then length."""
+        items = sorted(self._routes.items())
+        prefixes = np.array([k[0] for k, _ in items], dtype=np.uint32)
+        lengths = np.array([k[1] for k, _ in items], dtype=np.uint8)
+        outputs = np.array([v for _, v in items], dtype=np.uint32)
+        return prefixes, lengths, outputs
+
+    def routes(self):
+        """ Iterates over all (prefix, length, output) routes."""
+        for (p, l), o in sorted(self._routes.items()):
+            yield inet_ntoa(struct.pack('>I', p)), l, o
+
+    def enable_cache(self, size=1 << 16):
+        """ Not supported (see RouteTable.enable_cache)"""
+        raise NotImplementedError('PoptrieTable has no lookup cache')
+
+    def to_prefix_set(self):
+        """ Returns the routes as a PrefixSet"""
+        from prefixset import PrefixSet
+
+        return PrefixSet(*self.route_arrays())
+
+    def _longest_match(self, addrs, keys, outputs, lengths, inherited):
+        """ Output of the longest prefix (of the given lengths) covering
+        every address, inherited where there's none."""
+        match = longest_match(keys, addrs, lengths)
+        return np.where(match >= 0, outputs[match], inherited)
+
+    def build(self):
+        """ (Re)builds the trie from the routes, done by lookups as
+        needed.
+
+        Every slot gets the longest match among the prefixes of its level
+        (prefix lengths between the previous level and this one), or else
+        the match of its parent slot."""
+        prefixes, lengths, outputs = self.route_arrays()
+        keys = (prefixes.astype(np.uint64) << np.uint64(8)) | lengths
+        plens = np.unique(lengths)
+        p64 = prefixes.astype(np.uint64)
+
+        def internal(level):
+            # Values of the first level bits of all the slots that have
+            # longer prefixes under them.
+            shift = np.uint64(32 - level)
+            return np.unique(p64[lengths > level] >> shift)
+
+        # Direct table
+        top = self.levels[0]
+        parents = internal(top) if len(self.levels) > 1 else \
+                    np.zeros(0, np.uint64)
+        slots = np.arange(1 << top, dtype=np.uint64)
+        direct_node = np.full(len(slots), -1, dtype=np.int64)
+        direct_node[parents.astype(np.int64)] = np.arange(len(parents))
+        values = self._longest_match(slots << np.uint64(32 - top), keys,
+                            outputs, plens[plens <= top],
+                            np.full(len(slots), -1, dtype=np.int64))
+        inherited = values[direct_node >= 0]
+        direct_leaf = np.where(direct_node >= 0, -1, values)
+        trie = {'direct_node': direct_node, 'direct_leaf': direct_leaf}
+
+        prev = top
+        for depth, (stride, level) in enumerate(zip(self.strides[1:],
+                                                    self.levels[1:]), 1):
+            nslots = 1 << stride
+            nodes = parents
+            slots = ((nodes[:, None] << np.uint64(stride)) +
+                        np.arange(nslots, dtype=np.uint64)).ravel()
+            if level < 32:
+                parents = internal(level)
+                _, is_node = find_keys(parents, slots)
+                base1 = np.searchsorted(parents,
+                                nodes << np.uint64(stride)).astype(np.uint32)
+            else:
+                is_node = np.zeros(len(slots), dtype=bool)
+                base1 = np.zeros(len(nodes), dtype=np.uint32)
+
+            values = self._longest_match(slots << np.uint64(32 - level), keys,
+                            outputs, plens[(plens > prev) & (plens <= level)],
+                            np.repeat(inherited, nslots))
+            inherited = values[is_node]
+            prev = level
+
+            leaf_slots = np.flatnonzero(~is_node)
+            values = values[leaf_slots]
+            node_of = leaf_slots // nslots
+            new_run = np.ones(len(leaf_slots), dtype=bool)
+            new_run[1:] = (node_of[1:] != node_of[:-1]) | \
+                            (values[1:] != values[:-1])
+            runs = leaf_slots[new_run]
+
+            bit = np.uint64(1) << np.arange(nslots, dtype=np.uint64)
+            vector = (is_node.reshape(-1, nslots) * bit).sum(axis=1,
+                                                        dtype=np.uint64)
+            leafbits = np.zeros(len(slots), dtype=bool)
+            leafbits[runs] = True
+            leafvec = (leafbits.reshape(-1, nslots) * bit).sum(axis=1,
+                                                        dtype=np.uint64)
+            nruns = np.bincount(runs // nslots, minlength=len(nodes))
+            base0 = (np.cumsum(nruns) - nruns).astype(np.uint32)
+            trie[depth] = (vector, leafvec, base0, base1, values[new_run])
+        self._trie = trie
+        return trie
+
+    def lookup(self, ip_address):
+        """ Looks up an IP address and returns an output Index"""
+        return self.lookup_int(struct.unpack('>I', inet_aton(ip_address))[0])
+
+    def lookup_packed(self, packed):
+        """ Looks up a 4 byte packed (network byte order) IP address."""
+        return self.lookup_int(int.from_bytes(packed, 'big'))
+
+    def lookup_int(self, ip):
+        """ Looks up an IP address given as a 32 bit integer and returns an
+        output Index (None if there's no matching prefix)"""
+        trie = self._trie if self._trie is not None else self.build()
+        top = ip >> (32 - self.levels[0])
+        node = int(trie['direct_node'][top])
+        if node < 0:
+            leaf = int(trie['direct_leaf'][top])
+            return None if leaf < 0 else leaf
+        for depth, (stride, level) in enumerate(zip(self.strides[1:],
+                                                    self.levels[1:]), 1):
+            vector, leafvec, base0, base1, leaves = trie[depth]
+            v = (ip >> (32 - level)) & ((1 << stride) - 1)
+            mask = (2 << v) - 1
+            vec = int(vector[node])
+            if not (vec >> v) & 1:
+                leaf = int(leaves[int(base0[node]) +
+                                    bin(int(leafvec[node]) & mask).count('1')
+                                    - 1])
+                return None if leaf < 0 else leaf
+            node = int(base1[node]) + bin(vec & mask).count('1') - 1
+        return None
+
+    def lookup_many(self, ips, dedupe=False, threads=None):
+        """ Looks up an array of IP addresses (32 bit integers) and returns an
+        int64 array of output Indices, -1 where there's no matching prefix.
+        If threads is given, chunks of the batch are looked up on a thread
+        pool (see RouteTable.lookup_many)."""
+        from ipv4_routing_table import lookup_in_threads
+
+        ips = np.asarray(ips, dtype=np.uint32)
+        if dedupe:
+            uniq, inverse = np.unique(ips, return_inverse=True)
+            return self.lookup_many(uniq, threads=threads)[inverse.ravel()]
+        trie = self._trie if self._trie is not None else self.build()
+        return lookup_in_threads(lambda chunk: self._lookup_many(trie, chunk),
+                                    ips, threads)
+
+    def _lookup_many(self, trie, ips):
+        """ Lookups in the built trie, for lookup_many"""
+        top = (ips >> np.uint32(32 - self.levels[0])).astype(np.int64)
+        result = trie['direct_leaf'][top]
+        node = trie['direct_node'][top]
+        where = np.flatnonzero(node >= 0)
+        node = node[where]
+        for depth, (stride, level) in enumerate(zip(self.strides[1:],
+                                                    self.levels[1:]), 1):
+            if not len(where):
+                break
+            vector, leafvec, base0, base1, leaves = trie[depth]
+            v = ((ips[where] >> np.uint32(32 - level)) &
+                    np.uint32((1 << stride) - 1)).astype(np.uint64)
+            mask = _ALL_ONES >> (np.uint64(63) - v)
+            vec = vector[node]
+            is_leaf = ((vec >> v) & np.uint64(1)) == 0
+            lnode = node[is_leaf]
+            result[where[is_leaf]] = leaves[base0[lnode] +
+                            _popcount(leafvec[lnode] & mask[is_leaf]) - 1]
+            more = ~is_leaf
+            node = base1[node[more]] + _popcount(vec[more] & mask[more]) - 1
+            where = where[more]
+        return result
+
+    def memory(self):
+        """ Returns bytes used by the trie arrays"""
+        trie = self._trie if self._trie is not None else self.build()
+        return sum(a.nbytes for k, v in trie.items()
+                    for a in (v if isinstance(k, int) else (v,)))
+
+    def save_table(self, filename):
+        prefixes, lengths, outputs = self.route_arrays()
+        with open(filename, 'wb+') as f:
+            np.savez(f, strides=np.array(self.strides), prefixes=prefixes,
+                        lengths=lengths, outputs=outputs)
+
+    def _load_table(self, filename):
+        x = np.load(filename)
+        self.__init__(strides=x['strides'].tolist())
+        self._routes = dict(zip(zip(x['prefixes'].tolist(),
+                                    x['lengths'].tolist()),
+                                x['outputs'].tolist()))
+
+
+if __name__ == '__main__':
+    r = PoptrieTable()
+
+    r.add('12.0.0.0', 8, 2000)
+    r.add('12.128.0.0', 9, 2001)
+    r.add("12.127.10.0", 26, 2002)
+
+    print("lookup: 12.0.1.1", r.lookup('12.0.1.1'))
+    print("lookup: 12.129.1.1", r.lookup('12.129.1.1'))
+    print("lookup: 12.127.10.1", r.lookup('12.127.10.1'))
+    print("lookup_many:", r.lookup_many([0x0C000101, 0x0C810101, 0x0C7F0A01]))
+    print("memory:", r.memory(), "bytes")
@@ -0,0 +1,126 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+A columnar set of IPv4 prefixes and their origin ASes.
+
+Instead of keeping an object per RIB Entry, prefixes are kept in three NumPy
+arrays of the same length
+ - prefixes : 32 bit prefix (host byte order)
+ - lengths : prefix length
+ - origins : origin AS (the 'last AS' in the AS Path)
+
+This is the form in which routes are exchanged between the MRT reader and the
+routing table builders (eg. when merging RIBs from several collectors).
+"""
+
+from array import array
+from socket import inet_ntoa
+import struct
+
+import numpy as np
+
+from mrtdump import MRTDumper
+
+
+def last_unique(keys):
+    """Returns the sorted unique keys and the index of the last occurrence of
+    every key."""
+    uniq, first = np.unique(keys[::-1], return_index=True)
+    return uniq, len(keys) - 1 - first
+
+
+class PrefixSet:
+    def __init__(self, prefixes=None, lengths=None, origins=None):
+        """Builds a prefix set from (equal length) sequences of prefixes (as
+        32 bit integers), prefix lengths and origin ASes."""
+        self.prefixes = np.asarray(prefixes if prefixes is not None else [],
+                                    dtype=np.uint32)
+        self.lengths = np.asarray(lengths if lengths is not None else [],
+                                    dtype=np.uint8)
+        self.origins = np.asarray(origins if origins is not None else [],
+                                    dtype=np.uint32)
+        assert len(self.prefixes) == len(self.lengths) == len(self.origins)
+
+    @classmethod
+    def from_mrt(cls, mrt_file, workers=None, record_filter=None, stats=None):
+        """Reads all IPv4 Unicast RIB Entries from an MRT file (TABLE_DUMP or
+        TABLE_DUMP_V2), only those that match record_filter (an
+        mrtdump.MRTFilter) if given. If stats (a dictionary) is given, it's
+        updated with the reader counters (see MRTDumper.get_stats), eg. for
+        finding out whether a corrupt file was read only partly."""
+        prefixes = array('I')
+        lengths = array('B')
+        origins = array('I')
+        dumper = MRTDumper(mrt_file, workers=workers,
+                            record_filter=record_filter)
+        try:
+            for prefix, length, asid in dumper.prefix_origins():
+                if length > 0:
+                    prefixes.append(int.from_bytes(prefix, 'big'))
+                    lengths.append(length)
+                    origins.append(asid)
+        finally:
+            if stats is not None:
+                stats.update(dumper.get_stats())
+            dumper.close()
+        return cls(np.frombuffer(prefixes, dtype=np.uint32),
+                    np.frombuffer(lengths, dtype=np.uint8),
+                    np.frombuffer(origins, dtype=np.uint32))
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __repr__(self):
+        return "< PrefixSet of %d prefixes %s>" % (len(self), hex(id(self)))
+
+    def keys(self):
+        """Returns a (sortable) 64 bit key for each prefix - prefix, length."""
+        return (self.prefixes.astype(np.uint64) << np.uint64(8)) | \
+                self.lengths.astype(np.uint64)
+
+    def sorted(self):
+        """Returns a new PrefixSet sorted by prefix and then prefix length."""
+        order = np.argsort(self.keys(), kind='stable')
+        return self.take(order)
+
+    def unique(self):
+        """Returns a new PrefixSet sorted by prefix and then prefix length,
+        with one entry per prefix - the last one where it appears more than
+        once (as in to_route_table, later routes replace earlier ones)."""
+        _, last = last_unique(self.keys())
+        return self.take(last)
+
+    def take(self, indices):
+        """Returns a new PrefixSet with only the entries at indices."""
+        return PrefixSet(self.prefixes[indices], self.lengths[indices],
+                            self.origins[indices])
+
+    def routes(self):
+        """Iterates over all (prefix string, length, origin) tuples."""
+        for p, l, o in zip(self.prefixes.tolist(), self.lengths.tolist(),
+                            self.origins.tolist()):
+            yield inet_ntoa(struct.pack('>I', p)), l, o
+
+    def to_route_table(self, table=None):
+        """Adds all the prefixes to a RouteTable (a new one if table is None)
+        and returns it. Prefixes are added shortest first, so that the longer
+        prefixes are never overwritten by the shorter ones."""
+        from ipv4_routing_table import RouteTable
+
+        if table is None:
+            table = RouteTable()
+        order = np.argsort(self.lengths, kind='stable')
+        for prefix, length, origin in self.take(order).routes():
+            table.add(prefix, length, origin)
+        return table
+
+    def save(self, filename):
+        with open(filename, 'wb+') as f:
+            np.savez(f, prefixes=self.prefixes, lengths=self.lengths,
+                        origins=self.origins)
+
+    @classmethod
+    def load(cls, filename):
+        x = np.load(filename)
+        return cls(x['prefixes'], x['lengths'], x['origins'])
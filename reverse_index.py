@@ -0,0 +1,231 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Reverse indexes of a routing table: AS -> prefixes and Country -> ASes ->
+address space.
+
+The indexes are built from the same PrefixSet that the RouteTable is built
+from and are kept in CSR form (one flat array of values and an array of
+offsets, the values of the i'th key are values[offsets[i]:offsets[i+1]]), so
+there are no per AS or per prefix python objects.
+
+For every AS two address counts are kept -
+ - announced : Sum of the sizes of all prefixes originated by the AS
+ - routed : Number of addresses for which the AS is the longest prefix match,
+   ie. more specific prefixes (of the same or other ASes) are taken out. This
+   is what a lookup in the RouteTable would return, so the routed counts of
+   all ASes add up to the total routed address space.
+"""
+
+import numpy as np
+
+from ipv4_routing_table import ip_to_int, longest_match
+from prefixset import PrefixSet
+
+
+def _csr(groups):
+    """Returns (keys, offsets, order) for an array of group keys, such that
+    order[offsets[i]:offsets[i+1]] are the indices of keys[i]."""
+    order = np.argsort(groups, kind='stable')
+    keys, first = np.unique(groups[order], return_index=True)
+    offsets = np.append(first, len(groups)).astype(np.int64)
+    return keys, offsets, order
+
+
+class ReverseIndex:
+    def __init__(self, prefix_set=None, asinfo=None):
+        """ prefix_set : PrefixSet (of origin ASes, not payload Indices)
+            the RouteTable is built from. Where the
+            same prefix appears more than once, the last one is used (as in
+            PrefixSet.to_route_table).
+            asinfo : A parsed ASInformation for the Country indexes (ASes not
+            found there are under country b'').
+        """
+        if prefix_set is None:
+            prefix_set = PrefixSet()
+        self._build_prefixes(prefix_set)
+        self._build_ases()
+        self._build_countries(asinfo)
+
+    def _build_prefixes(self, prefix_set):
+        self._all = prefix_set.unique() # Sorted by prefix
+        self._keys = self._all.keys()
+
+    def _longest_match(self, addrs):
+        """ For every (sorted) address, returns index (into self._all) of the
+        longest prefix covering it, -1 if none."""
+        return longest_match(self._keys, addrs, np.unique(self._all.lengths))
+
+    def _build_ases(self):
+        ps = self._all
+        sizes = np.uint64(1) << (np.uint64(32) - ps.lengths.astype(np.uint64))
+
+        # AS -> prefixes
+        self._as_ids, self._as_offsets, order = _csr(ps.origins)
+        self._as_prefixes = order # indices into self._all, sorted by prefix
+        as_idx = np.searchsorted(self._as_ids, ps.origins)
+        nases = len(self._as_ids)
+        self._announced = np.bincount(as_idx, weights=sizes,
+                                        minlength=nases).astype(np.uint64)
+
+        # Sweep over the address space: between two consecutive prefix
+        # boundaries the longest match doesn't change.
+        starts = ps.prefixes.astype(np.uint64)
+        bounds = np.unique(np.concatenate((starts, starts + sizes)))
+        seg_sizes = np.diff(bounds)
+        owners = self._longest_match(bounds[:-1])
+        routed = owners >= 0
+        self._routed = np.bincount(as_idx[owners[routed]],
+                        weights=seg_sizes[routed],
+                        minlength=nases).astype(np.uint64)
+
+    def _build_countries(self, asinfo):
+        if asinfo is not None:
+            countries = asinfo.countries_for_ases(self._as_ids)
+        else:
+            countries = np.zeros(len(self._as_ids), dtype='S1')
+        self._countries, self._country_offsets, self._country_ases = \
+                _csr(countries)
+
+    def _as_index(self, asid):
+        i = int(np.searchsorted(self._as_ids, asid))
+        if i < len(self._as_ids) and self._as_ids[i] == asid:
+            return i
+        return None
+
+    def _country_index(self, country):
+        if isinstance(country, str):
+            country = country.encode()
+        i = int(np.searchsorted(self._countries, country))
+        if i < len(self._countries) and self._countries[i] == country:
+            return i
+        return None
+
+    def get_ases(self):
+        """ Returns (sorted) array of all origin ASes"""
+        return self._as_ids
+
+    def get_countries(self):
+        return self._countries.tolist()
+
+    def prefixes_for_as(self, asid):
+        """ Returns a PrefixSet (sorted by prefix) of prefixes originated
+        by asid (empty if none)."""
+        i = self._as_index(asid)
+        if i is None:
+            return PrefixSet()
+        begin, end = self._as_offsets[i], self._as_offsets[i+1]
+        return self._all.take(self._as_prefixes[begin:end])
+
+    def address_count(self, asid, routed=True):
+        """ Returns the number of addresses routed to (or announced by) the
+        AS"""
+        i = self._as_index(asid)
+        if i is None:
+            return 0
+        return int(self._routed[i] if routed else self._announced[i])
+
+    def ases_for_country(self, country):
+        """ Returns array of origin ASes of the country"""
+        i = self._country_index(country)
+        if i is None:
+            return np.zeros(0, dtype=np.uint32)
+        begin, end = self._country_offsets[i], self._country_offsets[i+1]
+        return self._as_ids[self._country_ases[begin:end]]
+
+    def country_address_count(self, country, routed=True):
+        i = self._country_index(country)
+        if i is None:
+            return 0
+        counts = self._routed if routed else self._announced
+        begin, end = self._country_offsets[i], self._country_offsets[i+1]
+        return int(counts[self._country_ases[begin:end]].sum())
+
+    def country_totals(self, routed=True):
+        """ Returns list of (country, ases, prefixes, addresses) sorted by
+        addresses (largest first)."""
+        counts = self._routed if routed else self._announced
+        nprefixes = np.diff(self._as_offsets)
+        by_country = self._country_ases
+        offsets = self._country_offsets[:-1]
+        if not len(by_country):
+            return []
+        addrs = np.add.reduceat(counts[by_country], offsets)
+        prefixes = np.add.reduceat(nprefixes[by_country], offsets)
+        ases = np.diff(self._country_offsets)
+        result = list(zip(self._countries.tolist(), ases.tolist(),
+                            prefixes.tolist(), addrs.tolist()))
+        return sorted(result, key=lambda x: x[3], reverse=True)
+
+    def top_ases(self, n=10, routed=True):
+        """ Returns list of (asid, addresses) of the n ASes with the most
+        addresses."""
+        counts = self._routed if routed else self._announced
+        top = np.argsort(counts, kind='stable')[::-1][:n]
+        return list(zip(self._as_ids[top].tolist(), counts[top].tolist()))
+
+    def ases_in_range(self, first, last):
+        """ Returns (ases, prefixes, routed addresses) arrays for the origin
+        ASes in the range first..last (inclusive), eg. private AS numbers."""
+        begin = np.searchsorted(self._as_ids, first)
+        end = np.searchsorted(self._as_ids, last, side='right')
+        nprefixes = np.diff(self._as_offsets[begin:end+1])
+        return (self._as_ids[begin:end], nprefixes,
+                self._routed[begin:end])
+
+    def prefixes_in_range(self, first, last):
+        """ Returns a PrefixSet of prefixes starting in the address range
+        first..last (inclusive, strings or integers)."""
+        first = np.uint64(ip_to_int(first)) << np.uint64(8)
+        last = (np.uint64(ip_to_int(last)) << np.uint64(8)) | np.uint64(0xFF)
+        begin = np.searchsorted(self._keys, first)
+        end = np.searchsorted(self._keys, last, side='right')
+        return self._all.take(np.arange(begin, end))
+
+    def save(self, filename):
+        with open(filename, 'wb+') as f:
+            np.savez(f, prefixes=self._all.prefixes, lengths=self._all.lengths,
+                    origins=self._all.origins, as_ids=self._as_ids,
+                    as_offsets=self._as_offsets,
+                    as_prefixes=self._as_prefixes, announced=self._announced,
+                    routed=self._routed, countries=self._countries,
+                    country_offsets=self._country_offsets,
+                    country_ases=self._country_ases)
+
+    @classmethod
+    def load(cls, filename):
+        x = np.load(filename)
+        self = cls.__new__(cls)
+        self._all = PrefixSet(x['prefixes'], x['lengths'], x['origins'])
+        self._keys = self._all.keys()
+        for name in ('as_ids', 'as_offsets', 'as_prefixes', 'announced',
+                        'routed', 'countries', 'country_offsets',
+                        'country_ases'):
+            setattr(self, '_' + name, x[name])
+        return self
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    from asinformation import ASInformation
+    from ribmerge import merge_ribs
+
+    # reverse_index.py as-org2info.txt.gz rib1 [rib2 ...]
+    a = ASInformation(sys.argv[1])
+    a.parse()
+    a.close()
+
+    merged, _ = merge_ribs(sys.argv[2:])
+    then = dt.now()
+    r = ReverseIndex(merged, a)
+    print(f"Reverse index of {len(merged)} prefixes built in {dt.now() - then}")
+
+    for country, ases, prefixes, addrs in r.country_totals()[:20]:
+        print(f"{country.decode() or '??'}: {ases} ASes, {prefixes} prefixes, "
+                f"{addrs} addresses")
+    for asid, addrs in r.top_ases(10):
+        print(f"AS{asid}: {addrs} addresses, "
+                f"{len(r.prefixes_for_as(asid))} prefixes")
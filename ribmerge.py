@@ -0,0 +1,153 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Merges RIBs from several collectors (eg. RouteViews and RIS) into a single
+set of prefixes.
+
+Each MRT file is read in it's own worker process, so the total time taken is
+close to the time taken for the largest file. The prefixes from all the files
+are then put together and for every prefix exactly one origin AS is selected
+using one of the following rules
+ - 'first' : Origin from the collector that appears first in the list of files
+ - 'lowest' : Lowest origin AS number
+ - 'majority' : The origin seen by most collectors (ties are broken by the
+                order of the collectors)
+
+Everything after reading the files is done on the columnar arrays, there's no
+per prefix python code.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from prefixset import PrefixSet
+
+MERGE_RULES = ('first', 'lowest', 'majority')
+
+CollectorCoverage = namedtuple('CollectorCoverage',
+                        ['name', 'prefixes', 'unique', 'selected', 'coverage'])
+
+
+class InvalidMergeRuleErr(Exception):
+    pass
+
+
+def _read_rib(mrt_file):
+    """Worker: returns a PrefixSet for the file"""
+    # Don't start a decompression pool in every worker
+    return PrefixSet.from_mrt(mrt_file, workers=1)
+
+
+def merge_rows(keys, origins, collectors, rule, nsets):
+    """Selects an origin for every prefix of (prefix << 8 | length) keys,
+    origins and collector numbers (rows of the same collector in the order
+    they were read). All the rows of a prefix need to be given at once.
+    Returns the merged PrefixSet (sorted by prefix and prefix length) and
+    per collector counts (prefixes, unique, selected) of CollectorCoverage.
+    """
+    # Same prefix seen more than once by a collector (eg. in an 'updates'
+    # file), keep just one.
+    _, first = np.unique(np.stack([keys, collectors.astype(np.uint64)]),
+                            axis=1, return_index=True)
+    keys, origins, collectors = keys[first], origins[first], collectors[first]
+
+    if rule == 'first':
+        order = np.lexsort((collectors, keys))
+    elif rule == 'lowest':
+        order = np.lexsort((collectors, origins, keys))
+    else:
+        # Number of collectors that agree with the (prefix, origin) pair.
+        pair = np.stack([keys, origins.astype(np.uint64)])
+        _, inverse, counts = np.unique(pair, axis=1, return_inverse=True,
+                                        return_counts=True)
+        votes = counts[inverse.ravel()]
+        order = np.lexsort((collectors, -votes.astype(np.int64), keys))
+
+    keys, origins, collectors = keys[order], origins[order], collectors[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:] != keys[:-1]
+
+    merged = PrefixSet((keys[is_first] >> np.uint64(8)).astype(np.uint32),
+                        (keys[is_first] & np.uint64(0xFF)).astype(np.uint8),
+                        origins[is_first])
+
+    # Number of collectors that saw every prefix, to find prefixes unique to
+    # a collector.
+    group = np.cumsum(is_first) - 1
+    seen_by = np.bincount(group, minlength=len(merged))[group]
+
+    total = np.bincount(collectors, minlength=nsets)
+    unique = np.bincount(collectors[seen_by == 1], minlength=nsets)
+    selected = np.bincount(collectors[is_first], minlength=nsets)
+    return merged, (total, unique, selected)
+
+
+def coverage_of(names, counts, nmerged):
+    """List of CollectorCoverage from the counts of merge_rows (summed over
+    all the rows) and the number of merged prefixes."""
+    total, unique, selected = counts
+    return [CollectorCoverage(name, int(total[i]), int(unique[i]),
+                    int(selected[i]),
+                    float(total[i]) / nmerged if nmerged else 0.0)
+                for i, name in enumerate(names)]
+
+
+def merge_prefix_sets(sets, rule='first', names=None):
+    """Merges a list of PrefixSets. Returns the merged PrefixSet (sorted by
+    prefix and prefix length) and a list of CollectorCoverage one for each of
+    the input sets.
+    """
+    if rule not in MERGE_RULES:
+        raise InvalidMergeRuleErr(rule)
+    if names is None:
+        names = [str(i) for i in range(len(sets))]
+
+    keys = np.concatenate([s.keys() for s in sets]) if sets else \
+            np.zeros(0, np.uint64)
+    origins = np.concatenate([s.origins for s in sets]) if sets else \
+            np.zeros(0, np.uint32)
+    collectors = np.concatenate([np.full(len(s), i, dtype=np.uint32)
+                                    for i, s in enumerate(sets)]) if sets else \
+            np.zeros(0, np.uint32)
+    merged, counts = merge_rows(keys, origins, collectors, rule, len(sets))
+    return merged, coverage_of(names, counts, len(merged))
+
+
+def merge_ribs(mrt_files, rule='first', workers=None):
+    """Reads all the mrt_files concurrently (one worker per file) and merges
+    the prefixes. Returns the merged PrefixSet and the per collector
+    coverage. See merge_prefix_sets for details."""
+    if rule not in MERGE_RULES:
+        raise InvalidMergeRuleErr(rule)
+    if workers is None:
+        workers = min(len(mrt_files), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sets = list(pool.map(_read_rib, mrt_files))
+    else:
+        sets = [_read_rib(f) for f in mrt_files]
+    return merge_prefix_sets(sets, rule,
+                                [os.path.basename(f) for f in mrt_files])
+
+
+def merge_ribs_to_table(mrt_files, rule='first', workers=None, table=None):
+    """Same as merge_ribs, but returns a RouteTable populated with the merged
+    prefixes instead of the PrefixSet."""
+    merged, coverage = merge_ribs(mrt_files, rule, workers)
+    return merged.to_route_table(table), coverage
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    then = dt.now()
+    merged, coverage = merge_ribs(sys.argv[1:])
+    print(f"Merged {len(merged)} prefixes in {dt.now() - then}")
+    for c in coverage:
+        print(f"{c.name}: prefixes:{c.prefixes}, unique:{c.unique}, "
+                f"selected:{c.selected}, coverage:{c.coverage:.2%}")
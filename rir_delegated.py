@@ -0,0 +1,215 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Country of an address from the RIR delegated(-extended) statistics files, as
+a fallback (or a cross check) for the country of the origin AS.
+
+Lines of the delegated files look like
+    registry|cc|type|start|value|date|status[|opaque-id[|extensions]]
+For ipv4 records, start is the first address and value the number of
+addresses, which need not be a power of 2 - such ranges are split into
+CIDR prefixes. The prefixes are added to a second routing table with the
+country code (two letters packed in an integer) as the output Index.
+
+CountryOverlay looks up a batch of addresses in both the routing table and
+the registry table (each a single lookup_many) and returns the AS, the
+country of the AS and the registry country for all of them.
+"""
+
+from collections import Counter
+import numpy as np
+
+from decompress import open_stream
+from ipv4_addresses import text_to_u32
+from prefixset import PrefixSet
+
+DEFAULT_STATUSES = (b'allocated', b'assigned')
+
+_CHUNK_SIZE = 1 << 20
+
+
+def country_code(cc):
+    """ Two letter country code (str or bytes) -> integer"""
+    if isinstance(cc, str):
+        cc = cc.encode()
+    return int.from_bytes(cc[:2].upper(), 'big')
+
+
+def country_codes_to_bytes(codes):
+    """ Array of integer codes (see country_code) -> bytes array, b'' for
+    negative codes (not found)"""
+    codes = np.asarray(codes, dtype=np.int64)
+    return np.where(codes < 0, 0, codes).astype('>u2').view('S2')
+
+
+def range_to_cidrs(starts, counts):
+    """ Splits address ranges (start, number of addresses) into CIDR
+    prefixes. Returns (prefixes, lengths, range index of every prefix)."""
+    starts = np.asarray(starts, dtype=np.int64)
+    left = np.asarray(counts, dtype=np.int64)
+    which = np.arange(len(starts))
+    prefixes, lengths, ranges = [], [], []
+    while len(which):
+        # Largest block aligned at start that fits in the remaining count
+        align = starts & -starts
+        align[starts == 0] = 1 << 32
+        fit = np.int64(1) << (np.floor(np.log2(np.maximum(left, 1)))
+                                ).astype(np.int64)
+        size = np.minimum(align, fit)
+        prefixes.append(starts)
+        lengths.append(32 - np.log2(size).astype(np.int64))
+        ranges.append(which)
+        starts = starts + size
+        left = left - size
+        more = left > 0
+        starts, left, which = starts[more], left[more], which[more]
+    if not prefixes:
+        return (np.zeros(0, np.uint32), np.zeros(0, np.uint8),
+                np.zeros(0, np.int64))
+    return (np.concatenate(prefixes).astype(np.uint32),
+            np.concatenate(lengths).astype(np.uint8), np.concatenate(ranges))
+
+
+class RIRDelegated:
+    def __init__(self, engine='multibit'):
+        """ engine : Routing table engine for the registry table (see
+        ipv4_routing_table.make_route_table)"""
+        self._engine = engine
+        self._starts = []
+        self._counts = []
+        self._countries = []
+        self.errors = Counter()
+        self.records = 0
+        self._table = None
+
+    def _parse_lines(self, lines, statuses):
+        """ Tokenizes the ipv4 lines of a chunk, lines with the same number
+        of fields (7 for delegated, 8 or more for delegated-extended files)
+        with a single split."""
+        by_fields = {}
+        for line in lines:
+            if b'|ipv4|' in line and not line.startswith(b'#'):
+                line = line.rstrip(b'\r')
+                by_fields.setdefault(line.count(b'|') + 1, []).append(line)
+        for nfields, group in by_fields.items():
+            if nfields < 7:
+                # Summary lines (registry|*|ipv4|*|count|summary)
+                self.errors['skipped'] += len(group)
+                continue
+            toks = b'|'.join(group).split(b'|')
+            ccs = np.char.upper(np.array(toks[1::nfields], dtype='S2'))
+            starts = toks[3::nfields]
+            counts = toks[4::nfields]
+            ok = np.isin(np.array(toks[6::nfields], dtype='S'),
+                            np.array(statuses, dtype='S'))
+            ok &= np.array(starts, dtype='S') != b'*'
+            self.errors['skipped'] += int(np.count_nonzero(~ok))
+            addrs, valid = text_to_u32(b'\n'.join(starts))
+            try:
+                counts = np.array(counts, dtype='S').astype(np.int64)
+            except ValueError:
+                counts = np.array([int(c) if c.isdigit() else 0
+                                    for c in counts], dtype=np.int64)
+            bad = ok & (~valid | (counts <= 0) |
+                        (addrs.astype(np.int64) + counts > 1 << 32))
+            self.errors['invalid_line'] += int(np.count_nonzero(bad))
+            ok &= ~bad
+            self._starts.append(addrs[ok].astype(np.int64))
+            self._counts.append(counts[ok])
+            self._countries.append(
+                    np.frombuffer(ccs[ok].tobytes(), dtype='>u2').astype(
+                                    np.uint32))
+            self.records += int(np.count_nonzero(ok))
+
+    def load(self, filename, statuses=DEFAULT_STATUSES):
+        """ Reads ipv4 records (with one of the statuses) of a delegated or
+        delegated-extended file, a chunk of lines at a time."""
+        self._table = None
+        rest = b''
+        with open_stream(filename) as f:
+            while True:
+                data = f.read(_CHUNK_SIZE)
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                self._parse_lines(lines, statuses)
+        self._parse_lines([rest], statuses)
+
+    def prefix_set(self):
+        """ Returns the delegations as a PrefixSet, with country codes as
+        origins."""
+        if not self._starts:
+            return PrefixSet()
+        starts = np.concatenate(self._starts)
+        prefixes, lengths, which = range_to_cidrs(starts,
+                                                np.concatenate(self._counts))
+        return PrefixSet(prefixes, lengths,
+                            np.concatenate(self._countries)[which])
+
+    def get_table(self):
+        """ Returns the registry routing table (built when needed)"""
+        if self._table is None:
+            from ipv4_routing_table import make_route_table
+
+            self._table = self.prefix_set().to_route_table(
+                                make_route_table(self._engine))
+        return self._table
+
+    def lookup(self, ip_address):
+        """ Returns the registry country (bytes) of the address or None"""
+        code = self.get_table().lookup(ip_address)
+        return None if code is None else \
+                bytes(country_codes_to_bytes([code])[0])
+
+    def lookup_many(self, ips):
+        """ Returns integer country codes of an array of addresses (-1 where
+        not found)"""
+        return self.get_table().lookup_many(ips)
+
+
+class CountryOverlay:
+    def __init__(self, table, asinfo, registry):
+        """ table : Routing table with origin ASes as output Index (not a
+            table of payload Indices, see payloads.py)
+            asinfo : Parsed ASInformation
+            registry : RIRDelegated
+        """
+        self._table = table
+        self._asinfo = asinfo
+        self._registry = registry
+
+    def lookup_many(self, ips):
+        """ Returns (ases, AS countries, registry countries) arrays for an
+        array of addresses (32 bit integers). AS is -1 and countries are b''
+        where not found."""
+        ips = np.asarray(ips, dtype=np.uint32)
+        ases = self._table.lookup_many(ips)
+        as_countries = self._asinfo.countries_for_ases(
+                            np.where(ases < 0, 0, ases))
+        as_countries[ases < 0] = b''
+        rir_countries = country_codes_to_bytes(self._registry.lookup_many(ips))
+        return ases, as_countries, rir_countries
+
+    def countries(self, ips):
+        """ Country of the origin AS of every address, the registry country
+        where that's not known."""
+        _, as_countries, rir_countries = self.lookup_many(ips)
+        return np.where(as_countries == b'', rir_countries, as_countries)
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    # rir_delegated.py delegated-file [delegated-file ...]
+    r = RIRDelegated()
+    then = dt.now()
+    for filename in sys.argv[1:]:
+        r.load(filename)
+    table = r.get_table()
+    print(f"{r.records} records loaded in {dt.now() - then}, "
+            f"errors: {dict(r.errors)}")
+    for ip in ('1.1.1.1', '8.8.8.8', '103.21.244.1', '196.1.1.1'):
+        print(ip, r.lookup(ip))
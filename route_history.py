@@ -0,0 +1,266 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+A history of Routing tables, that can answer 'which AS did this IP address
+route to at time T'.
+
+The first snapshot (the base) is a regular RouteTable. Every later snapshot is
+stored as a delta against the previous one - only the sub-tables that are
+touched by a changed prefix (added, removed or with a different origin AS) are
+copied (copy-on-write), all other sub-tables are shared between versions.
+
+To be able to share parts of the first level as well, the 64K entries of the
+first level are split into pages of 256 entries. A version is just a list of
+pages, so an unchanged page costs a single reference. Memory therefore grows
+with the churn between the snapshots and not with the number of snapshots.
+
+When a prefix changes, the entries of the level that it belongs to are
+recomputed from the new set of prefixes (the longest prefix of that level,
+covering the entry), which is exactly what RouteTable would have in those
+entries had it been built from the new set of prefixes.
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+
+from ipv4_routing_table import RouteEntryNP, flatten_tables, lookup_flat_numpy
+from ipv4_routing_table import ip_to_int, longest_match
+
+
+class SnapshotOrderErr(Exception):
+    pass
+
+
+class RouteTableHistory:
+
+    PAGE_SIZE = 256
+
+    def __init__(self):
+        self._timestamps = []
+        self._versions = [] # For every version, list of first level pages
+        self._alloced = [] # Entries allocated by every version
+        self._keys = None # Sorted (prefix << 8 | length) of latest snapshot
+        self._origins = None
+        self._flat_pages = {} # id of page -> (page, flattened page)
+        self.levels = None
+        self.table_sizes = None
+
+    def __len__(self):
+        return len(self._versions)
+
+    def add_snapshot(self, timestamp, prefix_set):
+        """Adds a snapshot (a PrefixSet) of the routing table at timestamp.
+        Snapshots need to be added in the order of timestamps. Where a prefix
+        appears more than once, the last one is used (see PrefixSet.unique)."""
+        if self._timestamps and timestamp <= self._timestamps[-1]:
+            raise SnapshotOrderErr(f'{timestamp} <= {self._timestamps[-1]}')
+
+        # Keys need to be unique for comparing the snapshots
+        ps = prefix_set.unique()
+        keys = ps.keys()
+        origins = ps.origins
+        if not self._versions:
+            table = ps.to_route_table()
+            self.levels = table.levels
+            self.table_sizes = table.table_sizes
+            lvl0 = table.level0_table
+            pages = [lvl0[i:i+self.PAGE_SIZE]
+                        for i in range(0, len(lvl0), self.PAGE_SIZE)]
+            alloced = table.rtentries_alloced
+        else:
+            old_keys, old_origins = self._keys, self._origins
+            self._keys, self._origins = keys, origins
+            pages = list(self._versions[-1])
+            copied = set()
+            alloced = 0
+            for key in self._changed_keys(old_keys, old_origins).tolist():
+                alloced += self._update(pages, copied, key >> 8, key & 0xFF)
+
+        self._keys, self._origins = keys, origins
+        self._timestamps.append(timestamp)
+        self._versions.append(pages)
+        self._alloced.append(alloced)
+
+    def add_snapshot_from_mrt(self, timestamp, mrt_file):
+        from prefixset import PrefixSet
+
+        self.add_snapshot(timestamp, PrefixSet.from_mrt(mrt_file))
+
+    def _changed_keys(self, old_keys, old_origins):
+        """Keys of the prefixes that are added, removed or changed origin
+        between the old and the latest snapshot."""
+        changed = np.setxor1d(old_keys, self._keys, assume_unique=True)
+        _, old_i, new_i = np.intersect1d(old_keys, self._keys,
+                                    assume_unique=True, return_indices=True)
+        moved = old_i[old_origins[old_i] != self._origins[new_i]]
+        return np.union1d(changed, old_keys[moved])
+
+    def _writable(self, tbl, copied):
+        """Returns a copy of the table unless it is created in this version"""
+        if id(tbl) in copied:
+            return tbl, 0
+        tbl = tbl.copy()
+        copied.add(id(tbl))
+        return tbl, len(tbl)
+
+    def _best_routes(self, addrs, lo, hi):
+        """For every address in addrs, finds the longest prefix in the latest
+        snapshot with length in (lo, hi] that covers the address.
+        Returns (found, prefix lengths, origins)"""
+        match = longest_match(self._keys, addrs, range(lo + 1, hi + 1))
+        found = match >= 0
+        match = match[found]
+        lengths = np.zeros(len(addrs), dtype=np.uint8)
+        lengths[found] = self._keys[match] & np.uint64(0xFF)
+        origins = np.zeros(len(addrs), dtype=np.uint32)
+        origins[found] = self._origins[match]
+        return found, lengths, origins
+
+    def _update(self, pages, copied, prefix, length):
+        """Recomputes the entries for prefix/length (copying the tables on
+        the way). Returns number of entries allocated."""
+        levels = self.levels
+        level = 0
+        while length > levels[level]:
+            level += 1
+        alloced = 0
+
+        # Walk (and copy) the tables down to the level of the prefix
+        tbl = None
+        for l in range(level):
+            shift = 32 - levels[l]
+            idx = (prefix >> shift) & (self.table_sizes[l] - 1)
+            if l == 0:
+                page_no, idx = divmod(idx, self.PAGE_SIZE)
+                pages[page_no], n = self._writable(pages[page_no], copied)
+                tbl = pages[page_no]
+                alloced += n
+            child = tbl['children'][idx]
+            if isinstance(child, np.ndarray):
+                child, n = self._writable(child, copied)
+            else:
+                child = np.zeros(self.table_sizes[l+1], RouteEntryNP)
+                copied.add(id(child))
+                n = len(child)
+            alloced += n
+            tbl['children'][idx] = child
+            tbl = child
+
+        shift = 32 - levels[level]
+        span = 1 << (levels[level] - length)
+        idx_base = (prefix >> shift) & (self.table_sizes[level] - 1)
+        addrs = (np.uint64(prefix) & np.uint64((~((span << shift) - 1)) &
+                    0xFFFFFFFF)) + \
+                (np.arange(span, dtype=np.uint64) << np.uint64(shift))
+        lo = levels[level-1] if level else 0
+        found, lengths, origins = self._best_routes(addrs, lo, levels[level])
+
+        for i in range(span):
+            idx = idx_base + i
+            if level == 0:
+                page_no, idx = divmod(idx, self.PAGE_SIZE)
+                pages[page_no], n = self._writable(pages[page_no], copied)
+                tbl = pages[page_no]
+                alloced += n
+            tbl['final'][idx] = found[i]
+            tbl['prefix_len'][idx] = lengths[i]
+            tbl['output_idx'][idx] = origins[i]
+        return alloced
+
+    def _version_at(self, timestamp):
+        return bisect_right(self._timestamps, timestamp) - 1
+
+    def _lookup_in(self, pages, ip):
+        match = None
+        idx = ip >> (32 - self.levels[0])
+        tbl = pages[idx // self.PAGE_SIZE]
+        idx = idx % self.PAGE_SIZE
+        for level in range(len(self.levels)):
+            if level:
+                idx = (ip >> (32 - self.levels[level])) & \
+                        (self.table_sizes[level] - 1)
+            entry = tbl[idx]
+            if entry['final'] == 1:
+                match = int(entry['output_idx'])
+            children = entry['children']
+            if not isinstance(children, np.ndarray):
+                break
+            tbl = children
+        return match
+
+    def lookup(self, ip_address, timestamp):
+        """Looks up an IP address in the snapshot that was current at the
+        timestamp. Returns None if no route or if timestamp is before the
+        first snapshot."""
+        v = self._version_at(timestamp)
+        if v < 0:
+            return None
+        return self._lookup_in(self._versions[v], ip_to_int(ip_address))
+
+    def _flat_page(self, page):
+        """Flattened page (see RouteTable.flatten). Pages don't change once
+        their version is added, so pages shared by versions are flattened
+        once."""
+        cached = self._flat_pages.get(id(page))
+        if cached is None or cached[0] is not page:
+            cached = (page, flatten_tables([page], len(self.levels)))
+            self._flat_pages[id(page)] = cached
+        return cached[1]
+
+    def lookup_many(self, ip_addresses, timestamps):
+        """Looks up every IP address (strings or 32 bit integers) at the
+        corresponding timestamp (or a single timestamp for all). Addresses
+        are grouped by snapshot and first level page, and every group is
+        looked up at once on the flattened page. Returns an int64 array of
+        outputs, -1 where there's no route (as RouteTable.lookup_many)."""
+        if isinstance(ip_addresses, np.ndarray):
+            ips = ip_addresses.astype(np.uint32)
+        else:
+            ips = np.array([ip_to_int(ip) for ip in ip_addresses],
+                            dtype=np.uint32)
+        result = np.full(len(ips), -1, dtype=np.int64)
+        if not len(ips) or not self._versions:
+            return result
+        timestamps = np.broadcast_to(np.asarray(timestamps), ips.shape)
+        versions = np.searchsorted(np.asarray(self._timestamps), timestamps,
+                                    side='right') - 1
+        idx = (ips >> np.uint32(32 - self.levels[0])).astype(np.int64)
+        npages = len(self._versions[0])
+        group = versions * npages + idx // self.PAGE_SIZE
+        order = np.argsort(group, kind='stable')
+        group = group[order]
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        ends = np.r_[starts[1:], len(group)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            v, page_no = divmod(int(group[start]), npages)
+            if v < 0:
+                continue
+            sel = order[start:end]
+            result[sel], _ = lookup_flat_numpy(
+                            self._flat_page(self._versions[v][page_no]),
+                            self.levels, self.table_sizes, ips[sel],
+                            idx[sel] % self.PAGE_SIZE)
+        return result
+
+    def get_timestamps(self):
+        return list(self._timestamps)
+
+    def get_alloced(self):
+        """Returns number of table entries allocated by every snapshot"""
+        return list(self._alloced)
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    # route_history.py ts1 rib1 ts2 rib2 ...
+    h = RouteTableHistory()
+    args = sys.argv[1:]
+    for ts, mrt_file in zip(args[::2], args[1::2]):
+        then = dt.now()
+        h.add_snapshot_from_mrt(int(ts), mrt_file)
+        print(f"{ts}: {mrt_file} loaded in {dt.now() - then}, "
+                f"entries allocated: {h.get_alloced()[-1]}")
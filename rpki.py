@@ -0,0 +1,248 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Route Origin Validation (RFC 6811) against ROAs exported by a validator
+(Routinator, rpki-client, RIPE validator etc.) as CSV or JSON.
+
+    CSV : ASN,IP Prefix,Max Length[,Trust Anchor...] (columns are found from
+          the header, eg. 'AS13335,1.0.0.0/24,24,apnic')
+    JSON : {"roas": [{"asn": "AS13335", "prefix": "1.0.0.0/24",
+                      "maxLength": 24, "ta": "apnic"}, ...]}
+
+ROAs (IPv4 only) are kept in NumPy arrays, grouped by the ROA prefix length.
+A route (prefix, length, origin) is validated against all the ROAs of one
+length at a time for all the routes - the route prefix cut to that length is
+looked up (searchsorted) in the sorted ROA prefixes to find whether it's
+covered, and (prefix, origin AS) in the sorted (prefix, AS) keys to find a
+matching ROA and it's max length. So a full table is validated with a couple
+of searchsorted per ROA prefix length.
+
+The states fit the 'rpki' field of payloads (see payloads.py).
+"""
+
+from collections import Counter
+import json
+
+import numpy as np
+
+from decompress import open_stream
+from ipv4_addresses import text_to_ints, text_to_u32
+from ipv4_routing_table import find_keys
+from payloads import RPKI_NOT_CHECKED
+
+RPKI_VALID = 1
+RPKI_INVALID = 2
+RPKI_NOT_FOUND = 3
+
+RPKI_STATES = {RPKI_NOT_CHECKED: 'not-checked', RPKI_VALID: 'valid',
+                RPKI_INVALID: 'invalid', RPKI_NOT_FOUND: 'not-found'}
+
+_ASN_COLUMNS = (b'asn', b'as', b'origin')
+_PREFIX_COLUMNS = (b'ip prefix', b'prefix')
+_MAXLEN_COLUMNS = (b'max length', b'maxlength', b'max_length', b'max len')
+
+
+class InvalidROAFileErr(Exception):
+    pass
+
+
+def _asn(values):
+    """ AS numbers from strings like 'AS13335' or '13335' -> (AS numbers,
+    valid)"""
+    asns, valid = text_to_ints([v.strip().upper().lstrip(b'AS')
+                                for v in values])
+    return asns, valid & (asns >= 0) & (asns <= 0xFFFFFFFF)
+
+
+def _split_prefixes(values):
+    """ 'a.b.c.d/len' strings -> (prefixes, lengths, is IPv4)"""
+    addrs, lengths = [], []
+    for v in values:
+        addr, _, length = v.strip().partition(b'/')
+        addrs.append(addr)
+        lengths.append(length or b'-1')
+    prefixes, valid = text_to_u32(b'\n'.join(addrs))
+    lengths, numeric = text_to_ints(lengths)
+    valid &= numeric & (lengths >= 0) & (lengths <= 32)
+    return prefixes, lengths, valid
+
+
+class ROATable:
+    def __init__(self, filename=None):
+        # ipv6 (skipped), invalid_line, bad_asn, bad_maxlen
+        self.errors = Counter()
+        self._prefixes = []
+        self._lengths = []
+        self._maxlens = []
+        self._asns = []
+        self._index = None
+        if filename is not None:
+            self.load(filename)
+
+    def __len__(self):
+        return sum(len(p) for p in self._prefixes)
+
+    def __repr__(self):
+        return "< ROATable of %d ROAs %s>" % (len(self), hex(id(self)))
+
+    def add(self, prefixes, lengths, maxlens, asns):
+        """ Adds ROAs from arrays (prefixes as 32 bit integers). ROAs with a
+        max length shorter than the prefix or longer than 32 are not valid
+        (RFC 6482), they are counted in errors['bad_maxlen'] and dropped."""
+        lengths = np.asarray(lengths, dtype=np.uint8)
+        maxlens = np.asarray(maxlens, dtype=np.int64)
+        ok = (maxlens >= lengths) & (maxlens <= 32)
+        self.errors['bad_maxlen'] += int(np.count_nonzero(~ok))
+        self._prefixes.append(np.asarray(prefixes, dtype=np.uint32)[ok])
+        self._lengths.append(lengths[ok])
+        self._maxlens.append(maxlens[ok].astype(np.uint8))
+        self._asns.append(np.asarray(asns, dtype=np.uint32)[ok])
+        self._index = None
+
+    def _add_columns(self, asns, prefixes, maxlens):
+        ipv4 = np.array([b':' not in p for p in prefixes], dtype=bool)
+        self.errors['ipv6'] += int(np.count_nonzero(~ipv4))
+        keep = np.flatnonzero(ipv4).tolist()
+        asns = [asns[i] for i in keep]
+        maxlens = [maxlens[i] or b'-1' for i in keep]
+        asns, asn_ok = _asn(asns)
+        maxlens, maxlen_ok = text_to_ints(maxlens)
+        prefixes, lengths, valid = _split_prefixes([prefixes[i] for i in keep])
+        self.errors['invalid_line'] += int(np.count_nonzero(~valid))
+        self.errors['bad_asn'] += int(np.count_nonzero(valid & ~asn_ok))
+        valid &= asn_ok
+        self.errors['bad_maxlen'] += int(np.count_nonzero(valid & ~maxlen_ok))
+        valid &= maxlen_ok
+        # No max length means the prefix length
+        maxlens = np.where(maxlens == -1, lengths, maxlens)
+        self.add(prefixes[valid], lengths[valid], maxlens[valid], asns[valid])
+
+    def _load_csv(self, data):
+        lines = [l.rstrip(b'\r').replace(b'"', b'') for l in data.split(b'\n')
+                    if l.strip() and not l.startswith(b'#')]
+        if not lines:
+            return
+        header = [h.strip().lower() for h in lines[0].split(b',')]
+        columns = []
+        for names in (_ASN_COLUMNS, _PREFIX_COLUMNS, _MAXLEN_COLUMNS):
+            found = [i for i, h in enumerate(header) if h in names]
+            columns.append(found[0] if found else None)
+        if None in columns[:2]:
+            if header[0].upper().lstrip(b'AS').isdigit():
+                columns = [0, 1, 2] # No header
+            else:
+                raise InvalidROAFileErr(f'Unknown CSV columns: {lines[0]}')
+        else:
+            lines = lines[1:]
+        nfields = len(header)
+        good = [l for l in lines if l.count(b',') + 1 == nfields]
+        self.errors['invalid_line'] += len(lines) - len(good)
+        toks = b','.join(good).split(b',')
+        maxlens = toks[columns[2]::nfields] if columns[2] is not None else \
+                    [b''] * len(good)
+        self._add_columns(toks[columns[0]::nfields],
+                            toks[columns[1]::nfields], maxlens)
+
+    def _load_json(self, data):
+        roas = json.loads(data)
+        if isinstance(roas, dict):
+            roas = roas.get('roas', [])
+        asns, prefixes, maxlens = [], [], []
+        for roa in roas:
+            asns.append(str(roa.get('asn', '')).encode())
+            prefixes.append(str(roa.get('prefix', '')).encode())
+            maxlen = roa.get('maxLength', roa.get('max_length', ''))
+            maxlens.append(str(maxlen).encode())
+        self._add_columns(asns, prefixes, maxlens)
+
+    def load(self, filename):
+        """ Adds ROAs from a (possibly compressed) CSV or JSON file"""
+        with open_stream(filename) as f:
+            data = f.read()
+        if data.lstrip()[:1] in (b'{', b'['):
+            self._load_json(data)
+        else:
+            self._load_csv(data)
+
+    def _build(self):
+        """ For every ROA prefix length - sorted covering prefixes and sorted
+        (prefix, AS) keys with the largest max length of each key."""
+        prefixes = np.concatenate(self._prefixes) if self._prefixes else \
+                    np.zeros(0, np.uint32)
+        lengths = np.concatenate(self._lengths) if self._lengths else \
+                    np.zeros(0, np.uint8)
+        maxlens = np.concatenate(self._maxlens) if self._maxlens else \
+                    np.zeros(0, np.uint8)
+        asns = np.concatenate(self._asns) if self._asns else \
+                    np.zeros(0, np.uint32)
+        self._index = []
+        for l in np.unique(lengths).tolist():
+            sel = lengths == l
+            bits = (prefixes[sel].astype(np.uint64) >> np.uint64(32 - l))
+            covering = np.unique(bits)
+            keys = (bits << np.uint64(32)) | asns[sel].astype(np.uint64)
+            order = np.lexsort((maxlens[sel], keys))
+            keys, ml = keys[order], maxlens[sel][order]
+            last = np.ones(len(keys), dtype=bool)
+            last[:-1] = keys[:-1] != keys[1:]
+            # AS 0 ROAs (RFC 7607) cover but never validate a route
+            last &= (keys & np.uint64(0xFFFFFFFF)) != 0
+            self._index.append((l, covering, keys[last], ml[last]))
+
+    def validate(self, prefixes, lengths, origins):
+        """ Returns the RPKI states (RPKI_VALID, RPKI_INVALID or
+        RPKI_NOT_FOUND) of routes given as arrays of prefixes (32 bit
+        integers), lengths and origin ASes."""
+        if self._index is None:
+            self._build()
+        prefixes = np.asarray(prefixes, dtype=np.uint32).astype(np.uint64)
+        lengths = np.asarray(lengths, dtype=np.uint8)
+        origins = np.asarray(origins, dtype=np.uint32).astype(np.uint64)
+        covered = np.zeros(len(prefixes), dtype=bool)
+        valid = np.zeros(len(prefixes), dtype=bool)
+        for l, covering, keys, maxlens in self._index:
+            todo = np.flatnonzero((lengths >= l) & ~valid)
+            if not len(todo):
+                continue
+            bits = prefixes[todo] >> np.uint64(32 - l)
+            _, hit = find_keys(covering, bits)
+            covered[todo[hit]] = True
+            if not len(keys):
+                continue
+            pos, hit = find_keys(keys, (bits << np.uint64(32)) | origins[todo])
+            ok = hit & (maxlens[pos] >= lengths[todo])
+            valid[todo[ok]] = True
+        return np.where(valid, RPKI_VALID, np.where(covered, RPKI_INVALID,
+                                        RPKI_NOT_FOUND)).astype(np.uint8)
+
+    def validate_prefix_set(self, prefix_set):
+        """ RPKI states of all the routes of a PrefixSet"""
+        return self.validate(prefix_set.prefixes, prefix_set.lengths,
+                                prefix_set.origins)
+
+    def validate_one(self, prefix, length, origin):
+        """ RPKI state of a route, prefix is a string or an integer"""
+        if isinstance(prefix, str):
+            prefix = int(text_to_u32(prefix.encode())[0][0])
+        return int(self.validate([prefix], [length], [origin])[0])
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    from prefixset import PrefixSet
+
+    # rpki.py roas.csv|roas.json rib
+    then = dt.now()
+    roas = ROATable(sys.argv[1])
+    print(f"{len(roas)} ROAs loaded in {dt.now() - then}, "
+            f"errors: {dict(roas.errors)}")
+
+    ps = PrefixSet.from_mrt(sys.argv[2])
+    then = dt.now()
+    states = roas.validate_prefix_set(ps)
+    print(f"{len(ps)} routes validated in {dt.now() - then}")
+    for state, count in zip(*np.unique(states, return_counts=True)):
+        print(f"{RPKI_STATES[int(state)]}: {count}")
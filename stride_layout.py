@@ -0,0 +1,112 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Picks a stride layout (see RouteTable strides) for a prefix set.
+
+For every candidate layout, the tables that RouteTable would allocate for the
+prefix set are counted without building the table - a table at level k+1 is
+needed for every distinct level k index that has a prefix longer than level k
+under it. This gives
+ - memory : entries (and bytes) allocated
+ - depth : average number of levels visited by a lookup, either for an
+   address chosen uniformly from the whole IPv4 space or for a sample of
+   (real) addresses.
+
+The layout with the lowest average depth that fits in the memory budget is
+picked.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from ipv4_routing_table import RouteEntryNP, DEFAULT_STRIDES
+
+CANDIDATE_LAYOUTS = [(24, 8), (16, 16), (20, 12), (16, 8, 8), (20, 4, 8),
+                    DEFAULT_STRIDES, (16, 4, 4, 4, 4),
+                    (12, 4, 4, 4, 4, 4), (8, 8, 8, 8)]
+
+LayoutStats = namedtuple('LayoutStats', ['strides', 'entries', 'bytes',
+                                            'depth'])
+
+
+def simulate_layout(prefix_set, strides, addrs=None):
+    """Returns LayoutStats of a RouteTable with the given strides populated
+    with prefix_set. If addrs (uint32 array) is given, depth is averaged over
+    those addresses, otherwise over the whole address space."""
+    prefixes = prefix_set.prefixes.astype(np.uint64)
+    lengths = prefix_set.lengths
+    if addrs is not None:
+        addrs = np.asarray(addrs, dtype=np.uint64)
+        depth = np.ones(len(addrs))
+    else:
+        depth = 1.0
+
+    entries = 1 << strides[0]
+    level = 0
+    for stride, next_stride in zip(strides, strides[1:]):
+        level += stride
+        shift = np.uint64(32 - level)
+        parents = np.unique(prefixes[lengths > level] >> shift)
+        entries += len(parents) << next_stride
+        if addrs is not None and len(parents):
+            pos = np.searchsorted(parents, addrs >> shift)
+            pos[pos == len(parents)] = 0
+            depth += parents[pos] == addrs >> shift
+        elif addrs is None:
+            depth += len(parents) / (1 << level)
+
+    if addrs is not None:
+        depth = float(depth.mean()) if len(depth) else 1.0
+    return LayoutStats(tuple(strides), entries,
+                        entries * RouteEntryNP.itemsize, depth)
+
+
+def choose_layout(prefix_set, max_bytes=1 << 30, addrs=None,
+                    layouts=CANDIDATE_LAYOUTS):
+    """Returns (best strides, list of LayoutStats of all layouts). Best is
+    the one with least average depth (and then least memory) within
+    max_bytes, or the smallest one if none fits."""
+    stats = [simulate_layout(prefix_set, s, addrs) for s in
+                dict.fromkeys(tuple(l) for l in layouts)]
+    fits = [s for s in stats if s.bytes <= max_bytes]
+    if fits:
+        best = min(fits, key=lambda s: (s.depth, s.bytes))
+    else:
+        best = min(stats, key=lambda s: s.bytes)
+    return best.strides, stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from prefixset import PrefixSet
+
+    parser = argparse.ArgumentParser(description='Picks a RouteTable stride '
+                                        'layout for a RIB')
+    parser.add_argument('--max-mb', type=int, default=1024,
+                        help='Memory budget in MB')
+    parser.add_argument('--addresses', help='File with sample addresses '
+                        '(one per line) to weigh the lookup depth')
+    parser.add_argument('rib', help='MRT RIB file or a saved PrefixSet (.npz)')
+    args = parser.parse_args()
+
+    if args.rib.endswith('.npz'):
+        ps = PrefixSet.load(args.rib)
+    else:
+        ps = PrefixSet.from_mrt(args.rib)
+    addrs = None
+    if args.addresses:
+        from ipv4_addresses import text_to_u32
+
+        with open(args.addresses, 'rb') as f:
+            addrs, valid = text_to_u32(f.read())
+        addrs = addrs[valid]
+
+    best, stats = choose_layout(ps, args.max_mb << 20, addrs)
+    for s in sorted(stats, key=lambda s: s.depth):
+        print(f"{'-'.join(map(str, s.strides)):16s} entries: {s.entries:11d} "
+                f"memory: {s.bytes / (1 << 20):9.1f} MB, "
+                f"depth: {s.depth:.3f}")
+    print(f"best: {best}")
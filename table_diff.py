@@ -0,0 +1,188 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Differences between two routing table snapshots (PrefixSets of origin ASes,
+eg. from the RIBs of two days) and applying them to a live routing table.
+Tables and PrefixSets of payload Indices (payloads.py) are not supported -
+the change of any payload field would show as a change of origin.
+
+Both snapshots are sorted on the (prefix, length) keys and compared with
+NumPy set operations, the result is kept columnar -
+ - added : prefixes only in the new snapshot
+ - removed : prefixes only in the old snapshot
+ - changed : prefixes in both, with a different origin AS
+Per country address space shifts are from the routed address counts of the
+reverse indexes (reverse_index.py) of the two snapshots.
+
+apply_diff updates a RouteTable built from the old snapshot, so that it
+gives the same results as one built from the new snapshot, without
+rebuilding it.
+"""
+
+from socket import inet_ntoa
+import struct
+
+import numpy as np
+
+from ipv4_routing_table import find_keys
+from prefixset import PrefixSet
+
+
+def _sizes(ps):
+    return np.uint64(1) << (np.uint64(32) - ps.lengths.astype(np.uint64))
+
+
+class TableDiff:
+    def __init__(self, added, removed, changed, old_origins):
+        """ added, removed : PrefixSets
+            changed : PrefixSet of prefixes with new origins
+            old_origins : Their origins in the old snapshot
+        """
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.old_origins = old_origins
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __repr__(self):
+        return "< TableDiff +%d -%d ~%d %s>" % (len(self.added),
+                len(self.removed), len(self.changed), hex(id(self)))
+
+    def changes(self):
+        """Iterates over (change, prefix, length, old origin, new origin)
+        tuples, change is one of 'added', 'removed' or 'changed'. Origin is
+        None where there's none."""
+        for p, l, o in zip(self.added.prefixes.tolist(),
+                self.added.lengths.tolist(), self.added.origins.tolist()):
+            yield 'added', inet_ntoa(struct.pack('>I', p)), l, None, o
+        for p, l, o in zip(self.removed.prefixes.tolist(),
+                self.removed.lengths.tolist(), self.removed.origins.tolist()):
+            yield 'removed', inet_ntoa(struct.pack('>I', p)), l, o, None
+        for p, l, old, new in zip(self.changed.prefixes.tolist(),
+                self.changed.lengths.tolist(), self.old_origins.tolist(),
+                self.changed.origins.tolist()):
+            yield 'changed', inet_ntoa(struct.pack('>I', p)), l, old, new
+
+    def summary(self):
+        """Returns a dict of counts and announced address space of the
+        added, removed and changed prefixes."""
+        return {
+            'added': len(self.added),
+            'removed': len(self.removed),
+            'changed': len(self.changed),
+            'added_addresses': int(_sizes(self.added).sum()),
+            'removed_addresses': int(_sizes(self.removed).sum()),
+            'changed_addresses': int(_sizes(self.changed).sum()),
+        }
+
+
+def diff_prefix_sets(old, new):
+    """Returns the TableDiff from PrefixSet old to PrefixSet new."""
+    old = old.unique()
+    new = new.unique()
+    old_keys, new_keys = old.keys(), new.keys()
+    _, old_i, new_i = np.intersect1d(old_keys, new_keys, assume_unique=True,
+                                        return_indices=True)
+    moved = old.origins[old_i] != new.origins[new_i]
+
+    in_new = np.zeros(len(new), dtype=bool)
+    in_new[new_i] = True
+    in_old = np.zeros(len(old), dtype=bool)
+    in_old[old_i] = True
+    return TableDiff(new.take(np.flatnonzero(~in_new)),
+                    old.take(np.flatnonzero(~in_old)),
+                    new.take(new_i[moved]), old.origins[old_i[moved]])
+
+
+def diff_tables(old_table, new_table):
+    """Same as diff_prefix_sets, for the routes in two routing tables (see
+    RouteTable.route_arrays)."""
+    return diff_prefix_sets(old_table.to_prefix_set(),
+                            new_table.to_prefix_set())
+
+
+def country_shifts(old_index, new_index):
+    """Returns list of (country, old addresses, new addresses) for countries
+    whose routed address space changed, largest change first. old_index and
+    new_index are ReverseIndexes of the two snapshots."""
+    old = {c: a for c, _, _, a in old_index.country_totals()}
+    new = {c: a for c, _, _, a in new_index.country_totals()}
+    shifts = [(c, old.get(c, 0), new.get(c, 0)) for c in set(old) | set(new)
+                if old.get(c, 0) != new.get(c, 0)]
+    return sorted(shifts, key=lambda x: abs(x[2] - x[1]), reverse=True)
+
+
+def _covering(ps, prefixes, lengths, levels):
+    """Indices (into sorted PrefixSet ps) of the prefixes of ps that cover any
+    of prefixes/lengths and are in the same table level as it (a default
+    route is in the first level)."""
+    keys = ps.keys()
+    found = []
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64)
+    bounds = np.asarray([0] + list(levels))
+    level_lo = bounds[np.searchsorted(bounds, lengths, side='left') - 1]
+    p64 = prefixes.astype(np.uint64)
+    for l in np.unique(ps.lengths).tolist():
+        todo = (lengths > l) & ((level_lo < l) | ((l == 0) & (level_lo == 0)))
+        if not todo.any():
+            continue
+        mask = np.uint64(((1 << l) - 1) << (32 - l))
+        k = ((p64[todo] & mask) << np.uint64(8)) | np.uint64(l)
+        pos, hit = find_keys(keys, k)
+        found.append(pos[hit])
+    if not found:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(found))
+
+
+def apply_diff(table, diff, new):
+    """Applies diff to a routing table built from the old snapshot. new is
+    the new snapshot (PrefixSet), needed to refill the entries of deleted
+    prefixes with the covering prefixes of the same level (see
+    RouteTable.delete)."""
+    for prefix, length, _ in diff.removed.routes():
+        table.delete(prefix, length)
+
+    new = new.unique()
+    refill = _covering(new, diff.removed.prefixes, diff.removed.lengths,
+                        getattr(table, 'levels', [32]))
+    updates = PrefixSet(
+        np.concatenate((new.prefixes[refill], diff.changed.prefixes,
+                        diff.added.prefixes)),
+        np.concatenate((new.lengths[refill], diff.changed.lengths,
+                        diff.added.lengths)),
+        np.concatenate((new.origins[refill], diff.changed.origins,
+                        diff.added.origins)))
+    return updates.to_route_table(table)
+
+
+if __name__ == '__main__':
+    import sys
+    from datetime import datetime as dt
+
+    # table_diff.py old_rib new_rib [as-org2info.txt.gz]
+    old = PrefixSet.from_mrt(sys.argv[1])
+    new = PrefixSet.from_mrt(sys.argv[2])
+
+    then = dt.now()
+    d = diff_prefix_sets(old, new)
+    print(f"Diff of {len(old)} and {len(new)} prefixes in {dt.now() - then}")
+    print(d.summary())
+    for change in list(d.changes())[:20]:
+        print(*change)
+
+    if len(sys.argv) > 3:
+        from asinformation import ASInformation
+        from reverse_index import ReverseIndex
+
+        a = ASInformation(sys.argv[3])
+        a.parse()
+        a.close()
+        shifts = country_shifts(ReverseIndex(old, a), ReverseIndex(new, a))
+        for country, before, after in shifts[:20]:
+            print(f"{country.decode() or '??'}: {before} -> {after} "
+                    f"({after - before:+d})")
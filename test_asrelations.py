@@ -0,0 +1,51 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+ASRelations and ConeBitmaps on an as-rel file with bad lines.
+
+    python -m pytest test_asrelations.py
+"""
+
+import numpy as np
+
+from asrelations import ASRelations, ConeBitmaps
+
+AS_REL = b"""# source:topology|BGP
+1|2|-1
+1|3|-1
+2|4|-1
+2|x4|-1
+3|5|0|bgp
+3|5|7
+-6|5|0
+4294967296|5|-1
+3|5|-1
+5|6|p2c
+4|7|-1
+"""
+
+
+def test_bad_lines_are_dropped(tmp_path):
+    filename = tmp_path / 'as-rel.txt'
+    filename.write_bytes(AS_REL)
+    r = ASRelations(str(filename))
+    assert dict(r.errors) == {'invalid_line': 1, 'bad_asid': 3,
+                                'bad_relationship': 2}
+    assert r.as_ids.tolist() == [1, 2, 3, 4, 5, 7]
+    assert r.customer_cone(1).tolist() == [1, 2, 3, 4, 5, 7]
+    assert r.get_providers(5).tolist() == [3]
+    assert len(r.get_peers(3)) == 0
+    assert r.index_of([7, 6, 1]).tolist() == [5, -1, 0]
+
+    cones = ConeBitmaps.from_relations(r, [2, 3])
+    assert cones.cone_size(2) == 3
+    assert cones.in_cone_many(2, np.array([4, 7, 5, -1, 6])).tolist() == \
+            [True, True, False, False, False]
+    assert cones.in_cone_many(3, [5]).tolist() == [True]
+
+
+def test_empty_relations():
+    r = ASRelations()
+    assert r.index_of([1, 2]).tolist() == [-1, -1]
+    assert ConeBitmaps([]).in_cone_many(1, [1]).tolist() == [False]
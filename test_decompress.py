@@ -0,0 +1,80 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Parallel bzip2 decoding against the serial decoders, and truncated or corrupt
+streams, which end the data and are reported by stream_error.
+
+    python -m pytest test_decompress.py
+"""
+
+import bz2
+import gzip
+import lzma
+
+import numpy as np
+import pytest
+
+from decompress import open_stream, stream_error
+
+
+@pytest.fixture(scope='module')
+def data():
+    """About 1MB, compressible but not too much (several bzip2 blocks)"""
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 16, 1 << 20, dtype=np.uint8).tobytes()
+
+
+def _read(filename, workers):
+    with open_stream(filename, workers=workers, buffer_size=1 << 16) as f:
+        chunks = []
+        while True:
+            d = f.read(12345)
+            if not d:
+                break
+            chunks.append(d)
+        return b''.join(chunks), stream_error(f)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_bz2_blocks_and_streams(data, tmp_path, workers):
+    # Small blocks (level 1 is 100K) and two concatenated streams (pbzip2)
+    filename = tmp_path / 'data.bz2'
+    filename.write_bytes(bz2.compress(data[:700000], 1) +
+                            bz2.compress(data[700000:], 2))
+    assert _read(str(filename), workers) == (data, None)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+@pytest.mark.parametrize('cut', [1000, 150000, -10])
+def test_truncated_bz2(data, tmp_path, workers, cut):
+    filename = tmp_path / 'data.bz2'
+    filename.write_bytes(bz2.compress(data, 1)[:cut])
+    result, error = _read(str(filename), workers)
+    assert error is not None
+    assert data.startswith(result)
+    if cut > 0: # Without the end of stream all the data may be there
+        assert len(result) < len(data)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_corrupt_bz2_block(data, tmp_path, workers):
+    compressed = bytearray(bz2.compress(data, 1))
+    compressed[len(compressed) // 2] ^= 0xFF
+    filename = tmp_path / 'data.bz2'
+    filename.write_bytes(bytes(compressed))
+    result, error = _read(str(filename), workers)
+    assert error is not None
+    assert data.startswith(result)
+
+
+@pytest.mark.parametrize('compress', [gzip.compress, lzma.compress])
+def test_truncated_gzip_xz(data, tmp_path, compress):
+    compressed = compress(data)
+    filename = tmp_path / 'data'
+    filename.write_bytes(compressed)
+    assert _read(str(filename), 1) == (data, None)
+    filename.write_bytes(compressed[:len(compressed) // 2])
+    result, error = _read(str(filename), 1)
+    assert error is not None
+    assert len(result) < len(data) and data.startswith(result)
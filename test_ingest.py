@@ -0,0 +1,100 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+ingest_file interrupted at records all over a file and resumed from the
+checkpoint, against reading the whole file, and build_bounded against
+merging and building in memory.
+
+    python -m pytest test_ingest.py
+"""
+
+import os
+from socket import inet_aton
+import struct
+
+import numpy as np
+import pytest
+
+import ingest
+import mrtdump
+from prefixset import PrefixSet
+
+
+def _table_dump(prefix, length, path, peer):
+    """A TABLE_DUMP (type 12) IPv4 record with ORIGIN and AS_PATH"""
+    attrs = struct.pack('>BBBB', 0x40, 1, 1, 0)
+    segment = struct.pack('>BB', 2, len(path)) + \
+                b''.join(struct.pack('>H', asn) for asn in path)
+    attrs += struct.pack('>BBB', 0x40, 2, len(segment)) + segment
+    body = struct.pack('>HH4sBBI4sHH', 0, 1, inet_aton(prefix), length, 1, 0,
+                        inet_aton(peer), 65000, len(attrs)) + attrs
+    return struct.pack('>IHHI', 1, 12, 1, len(body)) + body
+
+
+@pytest.fixture
+def table_dump(tmp_path):
+    """200 prefixes with a record from each of 3 peers, the peers disagree
+    on the origin of some of them"""
+    records = []
+    for i in range(200):
+        prefix = '20.0.%d.0' % i
+        for peer in range(3):
+            origin = 1000 + i + (peer if i % 7 == 0 else 0)
+            records.append(_table_dump(prefix, 24, [701, origin],
+                                        '192.0.2.%d' % (peer + 1)))
+    filename = tmp_path / 'table_dump.mrt'
+    filename.write_bytes(b''.join(records))
+    return str(filename)
+
+
+def test_resume_table_dump(table_dump, tmp_path, monkeypatch):
+    expected = PrefixSet.from_mrt(table_dump)
+    assert len(expected) == 200
+    monkeypatch.setattr(ingest, '_CHECK_EVERY', 1)
+    read_prefix_origin = mrtdump.read_prefix_origin
+    for stop in range(2, 600, 23):
+        checkpoint = str(tmp_path / ('%d.npz' % stop))
+        calls = [0]
+        def interrupted(m, e):
+            calls[0] += 1
+            if calls[0] == stop:
+                raise KeyboardInterrupt
+            return read_prefix_origin(m, e)
+        monkeypatch.setattr(mrtdump, 'read_prefix_origin', interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            ingest.ingest_file(table_dump, checkpoint, interval=0)
+        monkeypatch.setattr(mrtdump, 'read_prefix_origin', read_prefix_origin)
+
+        stats = {}
+        ps = ingest.ingest_file(table_dump, checkpoint, interval=0,
+                                stats=stats)
+        assert stats['resumed_at'] > 0
+        assert len(ps) == len(expected)
+        assert (ps.prefixes == expected.prefixes).all()
+        assert (ps.origins == expected.origins).all()
+
+
+@pytest.mark.parametrize('rule', ['first', 'lowest', 'majority'])
+def test_build_bounded_matches_merge(table_dump, tmp_path, monkeypatch, rule):
+    monkeypatch.setattr(ingest, '_MIN_ROWS', 16) # Many runs and blocks
+    records = [_table_dump('20.0.%d.0' % i, 24 if i % 3 else 23,
+                            [702, 2000 + i % 5], '192.0.2.9')
+                for i in range(0, 256, 2)]
+    other = tmp_path / 'other.mrt'
+    other.write_bytes(b''.join(records))
+    files = [table_dump, str(other)]
+    merged, coverage = ingest.merge_prefix_sets(
+                            [PrefixSet.from_mrt(f) for f in files], rule,
+                            [os.path.basename(f) for f in files])
+    expected = merged.to_route_table()
+    ips = np.arange(20 << 24, (20 << 24) + (1 << 16), 97, dtype=np.uint32)
+    for budget in (1, 1000, 40000, 1 << 20):
+        spill_dir = tmp_path / str(budget)
+        spill_dir.mkdir()
+        table, cov, report = ingest.build_bounded(files, budget,
+                                                    str(spill_dir), rule)
+        assert cov == coverage
+        assert (table.lookup_many(ips) == expected.lookup_many(ips)).all()
+        assert [s.stage for s in report][-1] == 'merge and build'
+        assert not list(spill_dir.iterdir())
@@ -0,0 +1,64 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+The compiled lookup kernel against the NumPy implementation, on random
+tables. Skipped when _lookupkernel.so isn't built (python lookupkernel.py
+build).
+
+    python -m pytest test_lookupkernel.py
+"""
+
+import numpy as np
+import pytest
+
+import lookupkernel
+from benchmark import random_prefix_set, random_addresses
+from ipv4_routing_table import RouteTable
+
+pytestmark = pytest.mark.skipif(not lookupkernel.available(),
+                                reason='_lookupkernel.so is not built')
+
+STRIDES = [(16, 8, 4, 4), (24, 8), (16, 4, 4, 4, 4), (8, 8, 8, 8),
+            (12, 12, 8)]
+
+
+def _table(strides, nroutes, seed):
+    table = random_prefix_set(nroutes, seed).to_route_table(
+                                                RouteTable(strides=strides))
+    # Routes at the edges of the levels and a default route
+    for prefix, length in (('0.0.0.0', 0), ('10.0.0.0', 8), ('10.1.0.0', 16),
+                            ('10.1.2.0', 24), ('10.1.2.3', 32)):
+        table.add(prefix, length, length + 1)
+    return table
+
+
+@pytest.mark.parametrize('strides', STRIDES)
+@pytest.mark.parametrize('seed', [1, 2])
+def test_kernel_matches_numpy(strides, seed):
+    table = _table(strides, 3000, seed)
+    ips = np.concatenate((random_addresses(1 << 16, seed),
+                        random_addresses(1 << 14, seed + 10, skew=False),
+                        np.array([0, 0xFFFFFFFF, 0x0A010203, 0x0A0102FF],
+                                    dtype=np.uint32)))
+    expected, expected_depth = table._lookup_many_numpy(ips)
+    result, depth = table._lookup_many(ips)
+    assert (result == expected).all()
+    assert (depth == expected_depth).all()
+
+
+def test_kernel_on_empty_table_and_batch():
+    table = RouteTable()
+    ips = random_addresses(1000, 3)
+    assert (table._lookup_many(ips)[0] == -1).all()
+    assert len(table._lookup_many(np.zeros(0, dtype=np.uint32))[0]) == 0
+
+
+def test_kernel_after_update():
+    table = _table((16, 8, 4, 4), 2000, 4)
+    ips = random_addresses(1 << 14, 4)
+    table.lookup_many(ips)
+    table.add('10.1.2.128', 25, 7)
+    table.delete('10.1.0.0', 16)
+    expected, _ = table._lookup_many_numpy(ips)
+    assert (table._lookup_many(ips)[0] == expected).all()
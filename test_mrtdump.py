@@ -0,0 +1,136 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+MRTDumper on corrupt input - corrupt headers, truncated records, records that
+can't be decoded and truncated or broken compressed streams.
+
+    python -m pytest test_mrtdump.py
+"""
+
+import bz2
+from socket import inet_aton
+import struct
+
+import pytest
+
+from mrtdump import MRTDumper, MRTFilter
+from prefixset import PrefixSet
+
+
+def _record(mtype, subtype, body, ts=1600000000):
+    return struct.pack('>IHHI', ts, mtype, subtype, len(body)) + body
+
+
+def _peer_index(npeers=2):
+    body = struct.pack('>4sHH', inet_aton('192.0.2.1'), 0, npeers)
+    for i in range(npeers):
+        body += struct.pack('>BI4sI', 2, i + 1, inet_aton('192.0.2.%d' % i),
+                            65000 + i)
+    return _record(13, 1, body)
+
+
+def _rib(seq, prefix, length, origins):
+    """A RIB_IPV4_UNICAST record with an entry (ORIGIN and AS_PATH) for
+    every origin"""
+    pb = (length + 7) // 8
+    body = struct.pack('>IB', seq, length) + inet_aton(prefix)[:pb] + \
+            struct.pack('>H', len(origins))
+    for peer, origin in enumerate(origins):
+        attrs = struct.pack('>BBBB', 0x40, 1, 1, 0)
+        attrs += struct.pack('>BBBBBII', 0x40, 2, 10, 2, 2, 701, origin)
+        body += struct.pack('>HIH', peer, 0, len(attrs)) + attrs
+    return _record(13, 2, body)
+
+
+def _ribs(n):
+    return [_rib(i, '10.%d.%d.0' % (i >> 8, i & 0xFF), 24, [1000 + i, 7])
+            for i in range(n)]
+
+
+def test_truncated_compressed_stream(tmp_path):
+    # Cut at a record boundary of the compressed stream - every record
+    # read is complete, but the end of the stream is missing
+    data = _peer_index() + b''.join(_ribs(5000))
+    compressed = bz2.compress(data, 1) # 100K blocks
+    filename = tmp_path / 'rib.bz2'
+    for workers, cut in ((1, -10), (2, -10), (1, len(compressed) // 2)):
+        filename.write_bytes(compressed[:cut])
+        dumper = MRTDumper(str(filename), workers=workers)
+        n = len(list(dumper.prefix_origins()))
+        assert 0 < n <= 5000
+        assert dumper.get_stats()['truncated'] == 1
+        dumper.close()
+    filename.write_bytes(compressed)
+    stats = {}
+    assert len(PrefixSet.from_mrt(str(filename), stats=stats)) == 5000
+    assert stats['truncated'] == 0
+
+
+def _table_dump(prefix, length, origin):
+    attrs = struct.pack('>BBBBBBBBBHH', 0x40, 1, 1, 0, 0x40, 2, 6, 2, 2, 701,
+                        origin)
+    body = struct.pack('>HH4sBBI4sHH', 0, 1, inet_aton(prefix), length, 1, 0,
+                        inet_aton('192.0.2.1'), 65000, len(attrs)) + attrs
+    return _record(12, 1, body)
+
+
+def _write(tmp_path, records):
+    filename = tmp_path / 'rib.mrt'
+    filename.write_bytes(b''.join(records))
+    return str(filename)
+
+
+@pytest.mark.parametrize('flt', [None, MRTFilter(prefix='10.0.0.0/8')])
+def test_bad_prefix_length(tmp_path, flt):
+    ribs = _ribs(3)
+    bad = bytearray(ribs[1])
+    bad[12 + 4] = 40 # Prefix length of the middle record
+    filename = _write(tmp_path, [_peer_index(), ribs[0], bytes(bad), ribs[2]])
+    dumper = MRTDumper(filename, record_filter=flt)
+    entries = list(dumper)
+    assert len(entries) == 3 # The peer table and two RIB records
+    assert dumper.get_stats()['decode_errors'] == 1
+    stats = {}
+    ps = PrefixSet.from_mrt(filename, record_filter=flt, stats=stats)
+    assert ps.origins.tolist() == [1000, 1002]
+    assert stats['decode_errors'] == 1
+
+    filename = _write(tmp_path, [_table_dump('10.0.0.0', 8, 1),
+                                    _table_dump('10.1.0.0', 40, 2),
+                                    _table_dump('10.2.0.0', 16, 3)])
+    stats = {}
+    ps = PrefixSet.from_mrt(filename, record_filter=flt, stats=stats)
+    assert ps.origins.tolist() == [1, 3]
+    assert stats['decode_errors'] == 1
+
+
+def test_corrupt_headers_and_truncated_record(tmp_path):
+    ribs = _ribs(100)
+    garbage = struct.pack('>IHHI', 0, 99, 0, 20) + bytes(range(20))
+    smashed = bytearray(ribs[60])
+    smashed[4:6] = b'\xff\xff' # Unknown type
+    records = [_peer_index()] + ribs[:30] + [garbage] + ribs[30:60] + \
+                [bytes(smashed)] + ribs[61:] + [ribs[0][:30]]
+    stats = {}
+    ps = PrefixSet.from_mrt(_write(tmp_path, records), stats=stats)
+    assert ps.origins.tolist() == [1000 + i for i in range(100) if i != 60]
+    assert stats['resyncs'] == 2
+    assert stats['truncated'] == 1
+    assert stats['decode_errors'] == 0
+    assert stats['skipped_bytes'] == len(garbage) + len(smashed) + 30
+
+
+def test_filtered_record_past_the_end(tmp_path):
+    # A record filtered out by its type is seeked over in a plain file
+    ribs = _ribs(5)
+    filename = _write(tmp_path, [_peer_index()] + ribs + [ribs[0][:-5]])
+    stats = {}
+    ps = PrefixSet.from_mrt(filename, record_filter=MRTFilter(types=[12]),
+                            stats=stats)
+    assert len(ps) == 0
+    assert stats['filtered'] == 6
+    assert stats['truncated'] == 1
+    stats = {}
+    assert len(PrefixSet.from_mrt(filename, stats=stats)) == 5
+    assert stats['truncated'] == 1
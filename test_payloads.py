@@ -0,0 +1,40 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+Payload tables - build_payloads and turning payload lookups back into origin
+ASes for the modules that expect them.
+
+    python -m pytest test_payloads.py
+"""
+
+import numpy as np
+
+from asrelations import ConeBitmaps
+from payloads import PayloadTable, build_payloads
+from prefixset import PrefixSet
+
+
+def test_payload_outputs_to_asns(tmp_path):
+    ps = PrefixSet([10 << 24, 11 << 24, 11 << 24, 12 << 24], [8, 8, 8, 8],
+                    [0, 64500, 64501, 64500])
+    payloads, pps = build_payloads(ps)
+    assert payloads.records['moas'][pps.origins].tolist() == \
+            [False, True, False]
+    ips = np.array([10 << 24, 11 << 24, 12 << 24, 13 << 24], dtype=np.uint32)
+    expected = ps.to_route_table().lookup_many(ips)
+    outputs = pps.to_route_table().lookup_many(ips)
+    # AS0 and no route are told apart
+    assert payloads.asns(outputs).tolist() == expected.tolist() == \
+            [0, 64501, 64500, -1]
+    cones = ConeBitmaps([0, 64500, 64501])
+    cones.add_cone(64500, [64500, 0])
+    assert cones.in_cone_many(64500, payloads.asns(outputs)).tolist() == \
+            [True, False, True, False]
+
+    # AS0 keeps its own payload after a reload
+    payloads.save(str(tmp_path / 'payloads.npz'))
+    loaded = PayloadTable.load(str(tmp_path / 'payloads.npz'))
+    assert loaded.add(payloads.records[pps.origins]).tolist() == \
+            pps.origins.tolist()
+    assert loaded.add_one(asn=64502) == len(payloads)
@@ -0,0 +1,89 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+PoptrieTable against the multibit RouteTable on random tables - lookups,
+route queries and updates.
+
+    python -m pytest test_poptrie.py
+"""
+
+import numpy as np
+import pytest
+
+from benchmark import random_prefix_set, random_addresses
+from ipv4_routing_table import InvalidStridesErr, RouteTable
+from poptrie import PoptrieTable
+
+STRIDES = [(16, 6, 6, 4), (8, 6, 6, 6, 6), (20, 6, 6), (12, 6, 6, 6, 2)]
+EDGES = (('0.0.0.0', 0), ('10.0.0.0', 8), ('10.1.0.0', 16), ('10.1.2.0', 24),
+            ('10.1.2.3', 32), ('10.1.2.4', 30))
+
+
+def _tables(strides, nroutes, seed):
+    ps = random_prefix_set(nroutes, seed)
+    tables = (ps.to_route_table(), ps.to_route_table(PoptrieTable(
+                                                        strides=strides)))
+    for table in tables:
+        for prefix, length in EDGES:
+            table.add(prefix, length, length + 1)
+    return tables
+
+
+def _addresses(tables, seed):
+    prefixes, lengths, _ = tables[1].route_arrays()
+    last = prefixes.astype(np.int64) + (1 << (32 - lengths.astype(np.int64)))
+    return np.concatenate((random_addresses(1 << 15, seed), prefixes,
+                            (last - 1).astype(np.uint32),
+                            np.minimum(last, 0xFFFFFFFF).astype(np.uint32)))
+
+
+@pytest.mark.parametrize('strides', STRIDES)
+@pytest.mark.parametrize('seed', [1, 2])
+def test_lookup_parity(strides, seed):
+    multibit, poptrie = _tables(strides, 5000, seed)
+    ips = _addresses((multibit, poptrie), seed)
+    assert (poptrie.lookup_many(ips) == multibit.lookup_many(ips)).all()
+    assert (poptrie.lookup_many(ips, dedupe=True, threads=2) ==
+            multibit.lookup_many(ips)).all()
+    for ip in ips[::97].tolist():
+        assert poptrie.lookup_int(ip) == multibit.lookup_int(ip)
+
+    # Updates rebuild the trie. RouteTable.delete doesn't bring back the
+    # covering prefixes and add needs shortest first (see
+    # table_diff.apply_diff), so it's rebuilt from the routes instead.
+    for prefix, length, _ in list(poptrie.routes())[::7]:
+        poptrie.delete(prefix, length)
+    poptrie.add('10.1.2.0', 23, 99)
+    multibit = poptrie.to_prefix_set().to_route_table()
+    assert (poptrie.lookup_many(ips) == multibit.lookup_many(ips)).all()
+
+
+@pytest.mark.parametrize('strides', STRIDES[:2])
+def test_route_queries(strides):
+    multibit, poptrie = _tables(strides, 3000, 3)
+    for prefix, length in EDGES + (('128.0.0.0', 1), ('200.0.0.0', 6)):
+        assert poptrie.covering(prefix, length) == \
+                multibit.covering(prefix, length)
+        for a, b in zip(poptrie.cidr_segments(prefix, length),
+                        multibit.cidr_segments(prefix, length)):
+            assert a.tolist() == b.tolist()
+        # Every route of the poptrie, RouteTable leaves out hidden ones
+        prefixes, lengths, outputs = poptrie.covered_by(prefix, length)
+        first, last = poptrie._range_of(prefix, length)
+        all_p, all_l, all_o = poptrie.route_arrays()
+        inside = (all_p >= first) & (all_p <= last) & (all_l >= length)
+        assert prefixes.tolist() == all_p[inside].tolist()
+        assert lengths.tolist() == all_l[inside].tolist()
+        assert outputs.tolist() == all_o[inside].tolist()
+        assert set(zip(*(a.tolist() for a in
+                        multibit.covered_by(prefix, length)))) <= \
+                set(zip(prefixes.tolist(), lengths.tolist(),
+                        outputs.tolist()))
+
+
+def test_unsupported():
+    with pytest.raises(InvalidStridesErr):
+        PoptrieTable(strides=(16, 8, 8))
+    with pytest.raises(NotImplementedError):
+        PoptrieTable().enable_cache()
@@ -0,0 +1,53 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+RIRDelegated on a delegated file with bad lines, and range_to_cidrs.
+
+    python -m pytest test_rir_delegated.py
+"""
+
+import gzip
+
+import numpy as np
+
+from rir_delegated import RIRDelegated, range_to_cidrs
+
+DELEGATED = b"""2|ripencc|20240101|6|19830101|20240101|+0000
+ripencc|*|ipv4|*|6|summary
+# a comment line with |ipv4| in it
+ripencc|NL|ipv4|10.0.0.0|256|20100101|allocated
+ripencc|de|ipv4|10.0.1.0|768|20100101|assigned|abc|e-stats
+ripencc|FR|ipv4|10.0.4.0|256|20100101|reserved
+ripencc|FR|ipv4|10.0.300.0|256|20100101|allocated
+ripencc|FR|ipv4|10.0.5.0|x256|20100101|allocated
+ripencc|FR|ipv4|10.0.6.0|0|20100101|allocated
+ripencc|FR|ipv4|255.255.255.0|512|20100101|allocated
+ripencc|FR|ipv4|*|256|20100101|allocated
+ripencc|GB|ipv6|2001:db8::|32|20100101|allocated
+ripencc|BE|ipv4|10.0.8.0|256|20100101|allocated\r
+ripencc|IT|ipv4|10.0.9.0|256|20100101|allocated"""
+
+
+def test_bad_lines_are_counted(tmp_path):
+    filename = tmp_path / 'delegated.gz'
+    filename.write_bytes(gzip.compress(DELEGATED))
+    r = RIRDelegated()
+    r.load(str(filename))
+    assert r.records == 4
+    assert dict(r.errors) == {'skipped': 3, 'invalid_line': 4}
+    assert [r.lookup(ip) for ip in ('10.0.0.1', '10.0.3.255', '10.0.4.1',
+                                    '10.0.8.1', '10.0.9.1', '11.0.0.1')] == \
+            [b'NL', b'DE', None, b'BE', b'IT', None]
+    assert len(r.prefix_set()) == 5 # 10.0.1.0/24 and 10.0.2.0/23 for DE
+
+
+def test_range_to_cidrs():
+    starts = np.array([0x0A000100, 0, 0xFFFFFF00])
+    counts = np.array([768, 1 << 32, 256])
+    prefixes, lengths, which = range_to_cidrs(starts, counts)
+    order = np.lexsort((prefixes, which))
+    assert list(zip(prefixes[order].tolist(), lengths[order].tolist(),
+                    which[order].tolist())) == \
+            [(0x0A000100, 24, 0), (0x0A000200, 23, 0), (0, 0, 1),
+                (0xFFFFFF00, 24, 2)]
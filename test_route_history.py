@@ -0,0 +1,58 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+RouteTableHistory against a RouteTable built from every snapshot, on random
+snapshots with repeated prefixes.
+
+    python -m pytest test_route_history.py
+"""
+
+import numpy as np
+
+from prefixset import PrefixSet
+from route_history import RouteTableHistory
+
+
+def _snapshot(rng, n):
+    lengths = rng.choice([8, 12, 16, 20, 24, 28, 32], n).astype(np.uint8)
+    prefixes = rng.integers(10 << 24, 14 << 24, n, dtype=np.uint64)
+    masks = ((np.uint64(1) << lengths.astype(np.uint64)) - np.uint64(1)) << \
+            (np.uint64(32) - lengths.astype(np.uint64))
+    ps = PrefixSet((prefixes & masks).astype(np.uint32), lengths,
+                    rng.integers(1, 20, n, dtype=np.uint32))
+    # Every tenth prefix again, with another origin
+    again = ps.take(np.arange(0, n, 10))
+    return PrefixSet(np.concatenate((ps.prefixes, again.prefixes)),
+                    np.concatenate((ps.lengths, again.lengths)),
+                    np.concatenate((ps.origins, again.origins + 100)))
+
+
+def test_history_matches_rebuilt_tables():
+    rng = np.random.default_rng(0)
+    snapshots = [_snapshot(rng, n) for n in (3000, 2500, 3000)]
+    snapshots.append(PrefixSet())
+    snapshots.append(_snapshot(rng, 1000))
+    history = RouteTableHistory()
+    for ts, ps in enumerate(snapshots, 1):
+        history.add_snapshot(ts * 10, ps)
+
+    ips = np.concatenate((rng.integers(10 << 24, 14 << 24, 20000,
+                                        dtype=np.uint32),
+                            snapshots[0].prefixes, snapshots[-1].prefixes))
+    for ts, ps in enumerate(snapshots, 1):
+        expected = ps.to_route_table().lookup_many(ips)
+        assert (history.lookup_many(ips, ts * 10 + 5) == expected).all()
+        for ip, output in zip(ips[:200].tolist(), expected[:200].tolist()):
+            found = history.lookup(ip, ts * 10)
+            assert (-1 if found is None else found) == output
+    assert (history.lookup_many(ips, 5) == -1).all()
+
+
+def test_repeated_prefix_then_empty_snapshot():
+    history = RouteTableHistory()
+    history.add_snapshot(1, PrefixSet([10 << 24, 10 << 24], [8, 8], [1, 2]))
+    assert history.lookup('10.1.2.3', 1) == 2
+    history.add_snapshot(2, PrefixSet())
+    assert history.lookup('10.1.2.3', 2) is None
+    assert history.lookup('10.1.2.3', 1) == 2
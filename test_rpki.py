@@ -0,0 +1,69 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+ROATable on CSV and JSON exports with bad rows, and route validation.
+
+    python -m pytest test_rpki.py
+"""
+
+import json
+
+from rpki import ROATable, RPKI_INVALID, RPKI_NOT_FOUND, RPKI_VALID
+
+ROAS_CSV = b"""ASN,IP Prefix,Max Length,Trust Anchor
+AS13335,1.0.0.0/24,24,apnic
+AS13335,1.1.0.0/16,,apnic
+ASx13335,1.2.0.0/16,24,apnic
+AS4294967296,1.3.0.0/16,24,apnic
+AS64500,1.4.0.0/16,twenty,apnic
+AS64500,1.5.0.0/16,12,apnic
+AS64500,1.6.0.0/16,33,apnic
+AS64500,1.7.0.0/x,24,apnic
+AS64500,1.8.0.0/16,24
+AS64500,2001:db8::/32,48,ripe
+AS64501,1.9.0.0/16,20,ripe
+"""
+
+
+def _check(roas, invalid_lines):
+    assert dict(roas.errors) == {'ipv6': 1, 'invalid_line': invalid_lines,
+                                    'bad_asn': 2, 'bad_maxlen': 3}
+    assert roas.validate_one('1.0.0.0', 24, 13335) == RPKI_VALID
+    assert roas.validate_one('1.1.0.0', 16, 13335) == RPKI_VALID
+    assert roas.validate_one('1.1.1.0', 24, 13335) == RPKI_INVALID
+    assert roas.validate_one('1.9.16.0', 20, 64501) == RPKI_VALID
+    assert roas.validate_one('1.9.16.0', 20, 64500) == RPKI_INVALID
+    # The dropped ROAs cover nothing
+    for prefix in ('1.2.0.0', '1.3.0.0', '1.4.0.0', '1.5.0.0', '1.6.0.0'):
+        assert roas.validate_one(prefix, 16, 64500) == RPKI_NOT_FOUND
+
+
+def test_csv_bad_rows(tmp_path):
+    filename = tmp_path / 'roas.csv'
+    filename.write_bytes(ROAS_CSV)
+    roas = ROATable(str(filename))
+    assert len(roas) == 3
+    _check(roas, 2) # The line without a trust anchor too
+
+
+def test_json_bad_rows(tmp_path):
+    roas = []
+    for line in ROAS_CSV.decode().splitlines()[1:]:
+        asn, prefix, maxlen = line.split(',')[:3]
+        roas.append({'asn': asn, 'prefix': prefix, 'maxLength': maxlen})
+    filename = tmp_path / 'roas.json'
+    filename.write_text(json.dumps({'roas': roas}))
+    roas = ROATable(str(filename))
+    assert len(roas) == 4
+    _check(roas, 1)
+    assert roas.validate_one('1.8.0.0', 16, 64500) == RPKI_VALID
+
+
+def test_add_bad_maxlen():
+    roas = ROATable()
+    roas.add([0x0A000000, 0x0B000000, 0x0C000000], [16, 16, 16],
+                [24, 8, 16], [1, 2, 3])
+    assert len(roas) == 2
+    assert roas.errors['bad_maxlen'] == 1
+    assert roas.validate_one('11.0.0.0', 16, 2) == RPKI_NOT_FOUND
@@ -0,0 +1,80 @@
+#
+# Refer to LICENSE file and README file for licensing information.
+#
+"""
+apply_diff against a table rebuilt from the new snapshot, on random
+snapshots.
+
+    python -m pytest test_table_diff.py
+"""
+
+import numpy as np
+import pytest
+
+from ipv4_routing_table import RouteTable
+from prefixset import PrefixSet
+from table_diff import diff_prefix_sets, apply_diff
+
+
+def _random_routes(rng, n):
+    lengths = rng.choice([8, 9, 12, 15, 16, 17, 20, 23, 24, 25, 28, 32], n,
+                            p=[0.01, 0.01, 0.04, 0.04, 0.1, 0.05, 0.1, 0.05,
+                                0.4, 0.05, 0.1, 0.05]).astype(np.uint8)
+    # All in sixteen /8s, so that they cover each other
+    prefixes = rng.integers(8 << 24, 24 << 24, n, dtype=np.uint64)
+    masks = ((np.uint64(1) << lengths.astype(np.uint64)) - np.uint64(1)) << \
+            (np.uint64(32) - lengths.astype(np.uint64))
+    prefixes = (prefixes & masks).astype(np.uint32)
+    origins = rng.integers(1, 50, n, dtype=np.uint32)
+    return PrefixSet(prefixes, lengths, origins)
+
+
+def _next_snapshot(rng, old):
+    keep = rng.random(len(old)) < 0.8
+    origins = old.origins.copy()
+    moved = rng.random(len(old)) < 0.1
+    origins[moved] = rng.integers(1, 50, int(moved.sum()), dtype=np.uint32)
+    added = _random_routes(rng, len(old) // 5)
+    return PrefixSet(np.concatenate((old.prefixes[keep], added.prefixes)),
+                    np.concatenate((old.lengths[keep], added.lengths)),
+                    np.concatenate((origins[keep], added.origins)))
+
+
+def _addresses(rng, ps, n):
+    """n addresses in the prefixes of ps and n anywhere"""
+    i = rng.integers(0, len(ps), n)
+    sizes = np.uint64(1) << (np.uint64(32) - ps.lengths[i].astype(np.uint64))
+    offsets = (rng.random(n) * sizes).astype(np.uint64)
+    addrs = (ps.prefixes[i].astype(np.uint64) + offsets) & np.uint64(0xFFFFFFFF)
+    return np.concatenate((addrs.astype(np.uint32),
+                rng.integers(0, 1 << 32, n, dtype=np.uint64).astype(np.uint32)))
+
+
+@pytest.mark.parametrize('strides', [(16, 8, 4, 4), (8, 8, 8, 8),
+                                        (16, 4, 4, 4, 4)])
+@pytest.mark.parametrize('seed', range(3))
+def test_apply_diff_matches_rebuild(strides, seed):
+    rng = np.random.default_rng(seed)
+    old = _random_routes(rng, 2000)
+    if seed != 1: # With and without a default route in the old snapshot
+        old = PrefixSet(np.append(old.prefixes, np.uint32(0)),
+                        np.append(old.lengths, np.uint8(0)),
+                        np.append(old.origins, np.uint32(99)))
+    table = old.to_route_table(RouteTable(strides=strides))
+    for _ in range(3):
+        new = _next_snapshot(rng, old)
+        apply_diff(table, diff_prefix_sets(old, new), new)
+        rebuilt = new.to_route_table(RouteTable(strides=strides))
+        ips = np.concatenate((_addresses(rng, old, 10000),
+                                _addresses(rng, new, 10000)))
+        assert (table.lookup_many(ips) == rebuilt.lookup_many(ips)).all()
+        old = new
+
+
+def test_removed_prefix_falls_back_to_default_route():
+    old = PrefixSet([0, 10 << 24, 11 << 24], [0, 8, 9], [1, 2, 3])
+    new = PrefixSet([0, 11 << 24], [0, 9], [1, 3])
+    table = old.to_route_table()
+    apply_diff(table, diff_prefix_sets(old, new), new)
+    assert table.lookup('10.1.2.3') == 1
+    assert table.lookup('11.1.2.3') == 3